@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute 
+# it and/or modify it under the terms of the GNU Affero General Public 
+# License as published by the Free Software Foundation, either version 
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Benchmarks of the catalogue reading, storage and query tools on synthetic
+catalogues. Each module benchmarks one tool and is run from the root of
+the repository, e.g.
+
+    python -m benchmarks.benchmark_compression --events 20000
+
+The shared synthetic catalogues and timing tools are in
+:mod: benchmarks.synthetic
+"""
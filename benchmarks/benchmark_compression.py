@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Reading throughput (MB of uncompressed text per second) of the ISF reader
+from a synthetic bulletin as a plain file and compressed with gzip, bzip2
+and xz:
+
+    python -m benchmarks.benchmark_compression [--events N]
+"""
+import os
+import bz2
+import gzip
+import lzma
+import shutil
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from benchmarks.synthetic import (best_of, get_synthetic_events,
+                                  write_bulletin, run_benchmark)
+
+
+def benchmark_compression(number_events, seed, tempdir):
+    """
+    Times ISFReader.iter_events and ISFReader.read_tables on each input
+    """
+    filename = os.path.join(tempdir, "bulletin.isf")
+    write_bulletin(filename, get_synthetic_events(number_events, seed))
+    size = os.path.getsize(filename) / 1.0E6
+    files = [("plain", filename)]
+    for name, module, suffix in [("gzip", gzip, ".gz"), ("bzip2", bz2, ".bz2"),
+                                 ("xz", lzma, ".xz")]:
+        with open(filename, "rb") as f_in:
+            with module.open(filename + suffix, "wb") as f_out:
+                shutil.copyfileobj(f_in, f_out)
+        files.append((name, filename + suffix))
+    print("%.1f MB bulletin (MB/s)" % size)
+    print("%-8s %12s %12s" % ("input", "iter_events", "read_tables"))
+    for name, path in files:
+        reader = ISFReader(path)
+        iter_time = best_of(lambda: sum(1 for _ in reader.iter_events()), 1)
+        table_time = best_of(reader.read_tables, 1)
+        print("%-8s %12.1f %12.1f" % (name, size / iter_time,
+                                      size / table_time))
+
+
+if __name__ == "__main__":
+    run_benchmark(benchmark_compression,
+                  "Reading of plain and compressed ISF bulletins", 20000)
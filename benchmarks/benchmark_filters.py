@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Time of ISFReader.read_file on a synthetic bulletin with selection
+criteria of increasing selectivity, which reject the rows and events
+before they are parsed:
+
+    python -m benchmarks.benchmark_filters [--events N]
+"""
+import os
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from benchmarks.synthetic import (best_of, get_synthetic_events,
+                                  write_bulletin, run_benchmark)
+
+# Selection criteria (keyword arguments of ISFReader)
+FILTERS = [("none", {}),
+           ("M>=5", {"lower_magnitude": 5.0}),
+           ("M>=7", {"lower_magnitude": 7.0}),
+           ("bbox 60x30", {"bbox": [0.0, 0.0, 60.0, 30.0]}),
+           ("bbox 10x10", {"bbox": [0.0, 0.0, 10.0, 10.0]}),
+           ("ISC only", {"selected_origin_agencies": ["ISC"],
+                         "selected_magnitude_agencies": ["ISC"]})]
+
+
+def benchmark_filters(number_events, seed, tempdir):
+    """
+    Times ISFReader.read_file with each of the selection criteria
+    """
+    filename = os.path.join(tempdir, "bulletin.isf")
+    write_bulletin(filename, get_synthetic_events(number_events, seed))
+    print("%-12s %8s %10s" % ("filter", "events", "read_file"))
+    for name, kwargs in FILTERS:
+        reader = ISFReader(filename, **kwargs)
+        timing = best_of(lambda: reader.read_file("A", "A"), 1)
+        print("%-12s %8d %9.2fs" % (name, len(reader.catalogue), timing))
+
+
+if __name__ == "__main__":
+    run_benchmark(benchmark_filters,
+                  "Reading of an ISF bulletin with selection criteria", 20000)
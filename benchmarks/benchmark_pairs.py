@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Time of get_agency_magnitude_pairs on a synthetic catalogue, against the
+per-event groupby used before it was vectorised (on a smaller catalogue,
+as the groupby takes over 1 ms per common event):
+
+    python -m benchmarks.benchmark_pairs [--events N]
+
+At the default of 10^6 events (3.3 x 10^6 magnitudes), on a single core,
+each pair took 0.45-1.4 s for 89000-332000 common events, while the
+groupby took 1.1-1.5 ms per common event at 20000 events (i.e. about 6
+minutes for the largest pair at 10^6 events)
+"""
+import io
+import contextlib
+from collections import OrderedDict
+import numpy as np
+from eqcat.catalogue_query_tools import get_agency_magnitude_pairs
+from benchmarks.synthetic import (best_of, get_synthetic_catalogue,
+                                  run_benchmark)
+
+# Pairs of (agency, magnitude type) combinations, and no_case
+PAIRS = [("ISC mb, GCMT Mw", ("ISC", "mb"), ("GCMT", "Mw"), False),
+         ("NEIC Mw, NEIC mb", ("NEIC", "Mw"), ("NEIC", "mb"), False),
+         ("isc MB, bji ms (no_case)", ("isc", "MB"), ("bji", "ms"), True)]
+
+# Number of events of the catalogue of the groupby reference
+REFERENCE_EVENTS = 20000
+
+
+def groupby_pairs(catalogue, pair1, pair2, no_case=False):
+    """
+    Returns the magnitudes of the common events of two (agency, magnitude
+    type) combinations by grouping the magnitudes by event, as done by
+    get_agency_magnitude_pairs before it was vectorised
+    """
+    magnitudes = catalogue.magnitudes
+    agencies = magnitudes["magAgency"].astype(str)
+    mag_types = magnitudes["magType"].astype(str)
+    if no_case:
+        agencies, mag_types = agencies.str.lower(), mag_types.str.lower()
+        pair1 = (pair1[0].lower(), pair1[1].lower())
+        pair2 = (pair2[0].lower(), pair2[1].lower())
+    select_cat1 = magnitudes[(agencies == pair1[0]) &
+                             (mag_types == pair1[1])]
+    select_cat2 = magnitudes[(agencies == pair2[0]) &
+                             (mag_types == pair2[1])]
+    common_catalogue = select_cat2[
+        select_cat2.eventID.isin(select_cat1.eventID)]
+    cat1_groups = select_cat1.groupby("eventID", observed=True)
+    mag1, mag2 = [], []
+    for _, grp in common_catalogue.groupby("eventID", observed=True):
+        event0 = grp.iloc[np.argmax(grp["value"].values)]
+        mag2.append(event0.value)
+        event1 = cat1_groups.get_group(event0.eventID)
+        mag1.append(event1.iloc[np.argmax(np.asarray(
+            event1["originID"]))].value)
+    return OrderedDict([("pair1", np.array(mag1)),
+                        ("pair2", np.array(mag2))]), None
+
+
+def _time_pairs(catalogue, function, repeat=1):
+    """
+    Returns the number of common events and the time of each pair
+    """
+    output = []
+    for _, pair1, pair2, no_case in PAIRS:
+        with contextlib.redirect_stdout(io.StringIO()):
+            data = function(catalogue, pair1, pair2, no_case)[0]
+            timing = best_of(lambda: function(catalogue, pair1, pair2,
+                                              no_case), repeat)
+        output.append((len(list(data.values())[0]), timing))
+    return output
+
+
+def benchmark_pairs(number_events, seed, tempdir):
+    """
+    Times get_agency_magnitude_pairs for each pair, and compares it with
+    the groupby on a smaller catalogue
+    """
+    catalogue = get_synthetic_catalogue(number_events, seed)
+    print("%d events, %d magnitudes" % (number_events,
+                                         len(catalogue.magnitudes)))
+    print("%-26s %9s %12s" % ("", "events", "vectorised"))
+    for (name, _, _, _), (number, timing) in zip(
+            PAIRS, _time_pairs(catalogue, get_agency_magnitude_pairs, 3)):
+        print("%-26s %9d %11.3fs" % (name, number, timing))
+    del catalogue
+    catalogue = get_synthetic_catalogue(min(number_events, REFERENCE_EVENTS),
+                                        seed)
+    print("")
+    print("%d events, %d magnitudes" % (min(number_events, REFERENCE_EVENTS),
+                                         len(catalogue.magnitudes)))
+    print("%-26s %9s %12s %9s" % ("", "events", "vectorised", "groupby"))
+    for (name, _, _, _), (number, timing), (_, reference_timing) in zip(
+            PAIRS, _time_pairs(catalogue, get_agency_magnitude_pairs, 3),
+            _time_pairs(catalogue, groupby_pairs)):
+        print("%-26s %9d %11.3fs %8.3fs" % (name, number, timing,
+                                            reference_timing))
+
+
+if __name__ == "__main__":
+    run_benchmark(benchmark_pairs, "Extraction of agency-magnitude pairs",
+                  1000000)
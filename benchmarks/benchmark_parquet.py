@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Times of opening, loading and selecting from a synthetic catalogue
+database stored as hdf5 and as a parquet dataset partitioned by year
+(requires pyarrow):
+
+    python -m benchmarks.benchmark_parquet [--events N]
+"""
+import os
+from eqcat.isf_catalogue import CatalogueHDF5Writer
+from eqcat.catalogue_parquet import write_parquet_dataset, pa
+from eqcat.catalogue_query_tools import CatalogueDB, CatalogueSelector
+from benchmarks.synthetic import best_of, get_synthetic_tables, run_benchmark
+
+
+def _lazy_select(path, method, *args):
+    """
+    Applies a selection to a lazy catalogue database
+    """
+    catalogue = CatalogueDB(path, lazy=True)
+    try:
+        getattr(CatalogueSelector(catalogue), method)(*args)
+    finally:
+        catalogue.close()
+
+
+# Timed operations, each taking the path to the database
+CASES = [
+    ("open (lazy)", lambda path: CatalogueDB(path, lazy=True).close()),
+    ("full load", lambda path: CatalogueDB(path)),
+    ("select_by_agency", lambda path: _lazy_select(
+        path, "select_by_agency", "ISC")),
+    ("select_within_date_range", lambda path: _lazy_select(
+        path, "select_within_date_range", 2000, 2005))]
+
+
+def benchmark_parquet(number_events, seed, tempdir):
+    """
+    Times each operation on the hdf5 and the parquet databases
+    """
+    if pa is None:
+        print("pyarrow is not available - skipped")
+        return
+    origins, magnitudes = get_synthetic_tables(number_events, seed)
+    hdf5_file = os.path.join(tempdir, "catalogue.hdf5")
+    parquet_dir = os.path.join(tempdir, "catalogue_parquet")
+    with CatalogueHDF5Writer(hdf5_file) as writer:
+        writer.append(origins, magnitudes)
+    write_parquet_dataset(parquet_dir, origins, magnitudes)
+    print("%d origins, %d magnitudes" % (len(origins), len(magnitudes)))
+    print("%-26s %9s %9s" % ("", "hdf5", "parquet"))
+    for name, function in CASES:
+        print("%-26s %8.3fs %8.3fs" % (
+            name, best_of(lambda: function(hdf5_file)),
+            best_of(lambda: function(parquet_dir))))
+
+
+if __name__ == "__main__":
+    run_benchmark(benchmark_parquet,
+                  "HDF5 and parquet storage of the catalogue database", 20000)
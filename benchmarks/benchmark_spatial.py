@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Times of polygon selections on a synthetic catalogue with the grid
+spatial index, against a full contains_points scan of the origins for
+each polygon:
+
+    python -m benchmarks.benchmark_spatial [--events N]
+"""
+import numpy as np
+from matplotlib.path import Path
+from eqcat.catalogue_query_tools import CatalogueSelector
+from benchmarks.synthetic import (best_of, get_synthetic_catalogue,
+                                  run_benchmark)
+
+# Number of polygons selected
+NUMBER_POLYGONS = 300
+
+
+def get_polygons(number_polygons, seed=1000):
+    """
+    Returns random quadrilaterals of 4 to 20 degrees across, as arrays of
+    (longitude, latitude) vertices
+    """
+    rng = np.random.RandomState(seed)
+    polygons = []
+    for _ in range(number_polygons):
+        centre = [rng.uniform(-170.0, 170.0), rng.uniform(-50.0, 50.0)]
+        size = rng.uniform(2.0, 10.0, 2)
+        polygons.append(np.array([
+            [centre[0] - size[0], centre[1] - size[1]],
+            [centre[0] + size[0], centre[1] - rng.uniform(0.0, size[1])],
+            [centre[0] + size[0], centre[1] + size[1]],
+            [centre[0] - rng.uniform(0.0, size[0]), centre[1] + size[1]]]))
+    return polygons
+
+
+def benchmark_spatial(number_events, seed, tempdir):
+    """
+    Times the full scans, the building and the queries of the index and
+    the selections
+    """
+    catalogue = get_synthetic_catalogue(number_events, seed)
+    polygons = get_polygons(NUMBER_POLYGONS, seed)
+    points = np.column_stack([catalogue.origins["longitude"].values,
+                              catalogue.origins["latitude"].values])
+
+    def full_scan():
+        for polygon in polygons:
+            Path(polygon).contains_points(points)
+
+    def index_build():
+        catalogue.clear_cache()
+        catalogue.get_spatial_index()
+
+    def index_query():
+        spatial_index = catalogue.get_spatial_index()
+        for polygon in polygons:
+            spatial_index.query_polygon(Path(polygon))
+
+    def select():
+        selector = CatalogueSelector(catalogue)
+        for polygon in polygons:
+            selector.select_within_polygon(polygon[:, 0], polygon[:, 1])
+
+    print("%d origins, %d polygons" % (len(points), len(polygons)))
+    print("contains_points (full scan)  %8.3f s" % best_of(full_scan))
+    print("spatial index build          %8.3f s" % best_of(index_build))
+    print("spatial index queries        %8.3f s" % best_of(index_query))
+    print("select_within_polygon        %8.3f s" % best_of(select, 1))
+
+
+if __name__ == "__main__":
+    run_benchmark(benchmark_spatial,
+                  "Polygon selections with the grid spatial index", 20000)
@@ -0,0 +1,255 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Synthetic catalogues and timing tools shared by the benchmarks. The
+synthetic events are returned either as lists (to write ISF bulletins) or
+directly as the origin and magnitude tables of a catalogue database,
+generated column by column so that catalogues of millions of events can
+be built in seconds
+"""
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from eqcat.isf_catalogue import DATAMAP, MAGDATAMAP
+from eqcat.parsers.isf_catalogue_reader import (origin_header,
+                                                magnitude_header)
+from eqcat.catalogue_query_tools import CatalogueDB
+
+# Agencies of the synthetic catalogues and the magnitude types they report
+AGENCIES = {"ISC": ["mb", "Ms"], "NEIC": ["mb", "Mw"], "EHB": ["mb"],
+            "GCMT": ["Mw"], "BJI": ["Ms", "mb"], "MOS": ["mb", "Ms"]}
+
+# Maximum number of origins (each from a different agency) of an event
+MAX_ORIGINS = 3
+
+
+def best_of(function, repeat=3):
+    """
+    Returns the shortest of repeat timings (s) of a function
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def _fill(width, fields):
+    """
+    Returns a row of the given width with the strings of the list of
+    (start, string) fields placed at their start positions
+    """
+    row = [" "] * width
+    for start, string in fields:
+        row[start:(start + len(string))] = list(string)
+    return "".join(row)
+
+
+def get_synthetic_events(number_events, seed=1000):
+    """
+    Returns a list of synthetic events, each as a tuple of the event ID and
+    the lists of origins (origin ID, agency, year, month, day, longitude,
+    latitude, depth) and of magnitudes (origin ID, agency, type, value)
+    """
+    origins, magnitudes = get_synthetic_tables(number_events, seed)
+    event_origins = dict([(event_id, []) for event_id in
+                          origins["eventID"].cat.categories])
+    event_magnitudes = dict([(event_id, []) for event_id in event_origins])
+    for row in origins[["eventID", "originID", "Agency", "year", "month",
+                        "day", "longitude", "latitude",
+                        "depth"]].itertuples(index=False):
+        event_origins[row[0]].append(tuple(row[1:]))
+    for row in magnitudes[["eventID", "originID", "magAgency", "magType",
+                           "value"]].itertuples(index=False):
+        event_magnitudes[row[0]].append(tuple(row[1:]))
+    return [(event_id, event_origins[event_id], event_magnitudes[event_id])
+            for event_id in event_origins]
+
+
+def write_bulletin(filename, events):
+    """
+    Writes a list of synthetic events as an ISF bulletin
+    """
+    rows = ["DATA_TYPE EVENT IMS1.0", "ISC Bulletin"]
+    for event_id, origins, magnitudes in events:
+        rows.extend(["Event %s Synthetic region" % event_id, origin_header])
+        for iloc, (origin_id, agency, year, month, day, longitude, latitude,
+                   depth) in enumerate(origins):
+            rows.append(_fill(136, [
+                (0, "{:04d}/{:02d}/{:02d}".format(year, month, day)),
+                (11, "12:00:00.00"), (36, "{:8.4f}".format(latitude)),
+                (45, "{:9.4f}".format(longitude)),
+                (71, "{:4.1f}".format(depth)), (118, agency),
+                (128, "{:>8s}".format(origin_id))]))
+            if not iloc:
+                rows.append(" (#PRIME)")
+        rows.extend(["", magnitude_header])
+        for origin_id, agency, scale, value in magnitudes:
+            rows.append(_fill(38, [(0, scale), (6, "{:4.1f}".format(value)),
+                                   (20, agency),
+                                   (30, "{:>8s}".format(origin_id))]))
+        rows.append("")
+    rows.append("STOP")
+    with open(filename, "w") as f:
+        f.write("\n".join(rows) + "\n")
+
+
+def _get_table(columns, datamap, number_rows):
+    """
+    Returns a table with the columns of a table definition (e.g. DATAMAP),
+    taking the given columns and filling the others with zeros (or empty
+    strings)
+    """
+    data = {}
+    for name, dtype in datamap:
+        if name in columns:
+            data[name] = columns[name]
+        elif dtype.startswith("U"):
+            data[name] = pd.Categorical.from_codes(
+                np.zeros(number_rows, dtype=int), [""])
+        else:
+            data[name] = np.zeros(number_rows, dtype=dtype)
+    return pd.DataFrame(data, columns=[name for name, _ in datamap])
+
+
+def get_synthetic_tables(number_events, seed=1000):
+    """
+    Returns the origin and magnitude tables (as in a catalogue database) of
+    a synthetic catalogue. Each event is reported by one to MAX_ORIGINS
+    agencies, each with an origin scattered around the event location and
+    a magnitude of each of its types scattered around the event size. The
+    first origin of each event is prime
+    """
+    rng = np.random.RandomState(seed)
+    agencies = np.array(list(AGENCIES))
+    # Events
+    year = rng.randint(1960, 2016, number_events)
+    month = rng.randint(1, 13, number_events)
+    day = rng.randint(1, 29, number_events)
+    longitude = rng.uniform(-179.0, 179.0, number_events)
+    latitude = rng.uniform(-60.0, 60.0, number_events)
+    size = 4.0 + rng.exponential(0.8, number_events)
+    # Origins: the first agencies of a random order of the agencies
+    number_origins = rng.randint(1, MAX_ORIGINS + 1, number_events)
+    agency_order = np.argsort(rng.rand(number_events, len(agencies)),
+                              axis=1)
+    taken = np.arange(len(agencies)) < number_origins[:, np.newaxis]
+    origin_event = np.repeat(np.arange(number_events), number_origins)
+    origin_agency = agency_order[taken]
+    first = np.r_[0, np.cumsum(number_origins)[:-1]]
+    prime = np.zeros(len(origin_event), dtype="i1")
+    prime[first] = 1
+    # IDs as categoricals of unique values, which need no factorisation
+    event_ids = pd.Categorical.from_codes(
+        np.arange(number_events),
+        (600000 + np.arange(number_events)).astype(str))
+    origin_ids = pd.Categorical.from_codes(
+        np.arange(len(origin_event)),
+        (1 + np.arange(len(origin_event))).astype(str))
+    origins = _get_table({
+        "eventID": event_ids[origin_event],
+        "originID": origin_ids,
+        "Agency": pd.Categorical.from_codes(origin_agency, agencies),
+        "year": year[origin_event].astype("i2"),
+        "month": month[origin_event].astype("i2"),
+        "day": day[origin_event].astype("i2"),
+        "hour": np.full(len(origin_event), 12, dtype="i2"),
+        "longitude": (longitude[origin_event] +
+                      rng.normal(0.0, 0.1, len(origin_event))).astype("f4"),
+        "latitude": (latitude[origin_event] +
+                     rng.normal(0.0, 0.1, len(origin_event))).astype("f4"),
+        "depth": rng.uniform(0.0, 100.0, len(origin_event)).astype("f4"),
+        "prime": prime}, DATAMAP, len(origin_event))
+    # Magnitudes: one of each type of the agency of each origin
+    mag_types = sorted(set(sum(AGENCIES.values(), [])))
+    number_types = np.array([len(AGENCIES[agency]) for agency in agencies])
+    type_codes = np.array([
+        [mag_types.index(mag_type) for mag_type in AGENCIES[agency]] +
+        [-1] * (number_types.max() - number_types[iloc])
+        for iloc, agency in enumerate(agencies)])
+    mag_origin = np.repeat(np.arange(len(origin_event)),
+                           number_types[origin_agency])
+    type_iloc = np.arange(len(mag_origin)) - np.repeat(
+        np.cumsum(number_types[origin_agency]) -
+        number_types[origin_agency], number_types[origin_agency])
+    mag_agency = origin_agency[mag_origin]
+    mag_type = type_codes[mag_agency, type_iloc]
+    value = np.round(np.minimum(size[origin_event[mag_origin]] +
+                                rng.normal(0.0, 0.2, len(mag_origin)), 9.5),
+                     1)
+    # Magnitude IDs (see eqcat.isf_catalogue.get_magnitude_id), with the
+    # values (rounded to 0.1 and at most 9.5) formatted from a table
+    value_strings = np.array(["{:.2f}".format(0.1 * iloc)
+                              for iloc in range(96)], dtype=object)
+    magnitude_ids = np.array(["|".join(fields) for fields in zip(
+        origin_ids.categories.values.astype(object)[mag_origin],
+        agencies.astype(object)[mag_agency],
+        value_strings[np.round(10.0 * value).astype(int)],
+        np.array(mag_types, dtype=object)[mag_type])], dtype=object)
+    magnitudes = _get_table({
+        "eventID": event_ids[origin_event[mag_origin]],
+        "originID": origin_ids[mag_origin],
+        "magnitudeID": magnitude_ids,
+        "value": value.astype("f4"),
+        "magType": pd.Categorical.from_codes(mag_type, mag_types),
+        "magAgency": pd.Categorical.from_codes(mag_agency, agencies)},
+        MAGDATAMAP, len(mag_origin))
+    return origins, magnitudes
+
+
+def get_synthetic_catalogue(number_events, seed=1000):
+    """
+    Returns a catalogue database of a synthetic catalogue
+    """
+    catalogue = CatalogueDB()
+    catalogue.origins, catalogue.magnitudes = get_synthetic_tables(
+        number_events, seed)
+    _ = catalogue._get_number_origins_magnitudes()
+    return catalogue
+
+
+def run_benchmark(benchmark, description, number_events, argv=None):
+    """
+    Parses the command line arguments (number of events and seed of the
+    synthetic catalogue) of a benchmark and runs it in a temporary
+    directory
+    :param benchmark:
+        Function taking the number of events, the seed and the path to
+        the temporary directory
+    :param str description:
+        Description of the benchmark
+    :param int number_events:
+        Default number of events
+    """
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--events", type=int, default=number_events,
+                        help="Number of events of the synthetic catalogue "
+                             "(default %(default)s)")
+    parser.add_argument("--seed", type=int, default=1000,
+                        help="Seed of the synthetic catalogue")
+    args = parser.parse_args(argv)
+    tempdir = tempfile.mkdtemp()
+    try:
+        benchmark(args.events, args.seed, tempdir)
+    finally:
+        shutil.rmtree(tempdir)
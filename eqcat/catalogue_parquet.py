@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Parquet storage of the origin and magnitude tables of the catalogue
+database. The tables are written as a directory holding the "origins" and
+"magnitudes" datasets, each partitioned by year (hive-style
+"year=YYYY" subdirectories). The magnitudes are partitioned by the year of
+the first origin of their event.
+"""
+import os
+import operator
+import numpy as np
+import pandas as pd
+from eqcat.isf_catalogue import DATAMAP, MAGDATAMAP
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+except ImportError:
+    pa = None
+
+
+TABLE_DATAMAPS = {"origins": DATAMAP, "magnitudes": MAGDATAMAP}
+
+# Comparison operators of the selection terms, applied to pyarrow dataset
+# fields. The "in" operator takes a list of values
+EXPRESSION_OPERATORS = {"==": operator.eq,
+                        "!=": operator.ne,
+                        ">=": operator.ge,
+                        "<=": operator.le,
+                        ">": operator.gt,
+                        "<": operator.lt,
+                        "in": lambda field, value: field.isin(list(value))}
+
+
+def _check_pyarrow():
+    """
+    Raises an ImportError if pyarrow is not available
+    """
+    if pa is None:
+        raise ImportError("The parquet catalogue storage requires pyarrow")
+
+
+def get_filter_expression(terms):
+    """
+    Returns the pyarrow dataset filter expression of a list of selection
+    terms (or None if the list is empty)
+    :param list terms:
+        Selection terms as tuples of (column, operator, value)
+    """
+    expression = None
+    for column, oper, value in terms:
+        term = EXPRESSION_OPERATORS[oper](ds.field(column), value)
+        expression = term if expression is None else (expression & term)
+    return expression
+
+
+def write_parquet_dataset(path, origins, magnitudes):
+    """
+    Writes the origin and magnitude tables to a parquet dataset, replacing
+    any partitions of the same years already present
+    :param str path:
+        Path to the dataset directory
+    :param origins:
+        Origins as instance of :class: pandas.DataFrame
+    :param magnitudes:
+        Magnitudes as instance of :class: pandas.DataFrame
+    """
+    _check_pyarrow()
+    event_year = origins.groupby("eventID", sort=False,
+                                 observed=True)["year"].first()
+    # Magnitudes of events without origins are held in partition year=0
+    magnitudes = magnitudes.assign(
+        year=magnitudes["eventID"].astype(object).map(
+            event_year).fillna(0).astype(np.int16))
+    for table, data in [("origins", origins), ("magnitudes", magnitudes)]:
+        # Categorical columns are stored as strings, as every partition
+        # would otherwise hold the full dictionary of categories
+        categorical = dict([(col, object) for col in data.columns
+                            if isinstance(data[col].dtype,
+                                          pd.CategoricalDtype)])
+        if categorical:
+            data = data.astype(categorical)
+        ds.write_dataset(
+            pa.Table.from_pandas(data, preserve_index=False),
+            os.path.join(path, table), format="parquet",
+            partitioning=ds.partitioning(pa.schema([("year", pa.int16())]),
+                                         flavor="hive"),
+            existing_data_behavior="delete_matching")
+
+
+class ParquetCatalogueStore(object):
+    """
+    Reader of the origin and magnitude tables of a parquet dataset. Only the
+    requested columns are read, and the partitions and row groups that
+    cannot satisfy the selection terms are skipped
+    :param str path:
+        Path to the dataset directory
+    :param dict datasets:
+        Origin and magnitude datasets as instances of
+        :class: pyarrow.dataset.Dataset
+    """
+    def __init__(self, path):
+        _check_pyarrow()
+        if not os.path.isdir(path):
+            raise IOError("Parquet dataset %s does not exist!" % path)
+        self.path = path
+        self.datasets = dict([
+            (table, ds.dataset(os.path.join(path, table), format="parquet",
+                               partitioning="hive"))
+            for table in TABLE_DATAMAPS])
+
+    def get_number_rows(self, table):
+        """
+        Returns the number of rows of a table
+        """
+        return self.datasets[table].count_rows()
+
+    def read(self, table, terms=None, columns=None):
+        """
+        Reads the rows of a table satisfying all of the selection terms
+        :param str table:
+            Table to read ("origins" or "magnitudes")
+        :param list terms:
+            Selection terms as tuples of (column, operator, value). Terms
+            on year prune the partitions of either table
+        :param list columns:
+            Columns to read (all of the table columns if None)
+        :returns:
+            Rows as instance of :class: pandas.DataFrame
+        """
+        datamap = TABLE_DATAMAPS[table]
+        if not columns:
+            columns = [val[0] for val in datamap]
+        data = self.datasets[table].to_table(
+            columns=columns,
+            filter=get_filter_expression(terms or [])).to_pandas()
+        # Restore the dtypes of the table definition (the partition column
+        # is read as int32)
+        return data.astype(dict([(name, dtype) for name, dtype in datamap
+                                 if (name in columns) and
+                                 not dtype.startswith("U")]))
+
+    def close(self):
+        """
+        Parquet datasets hold no open files
+        """
+        pass
@@ -18,10 +18,14 @@
 """
 Collection of Catalogue Database Query Tools
 """
+import os
 import h5py
+import multiprocessing
 import re
+import operator
 import numpy as np
 import pandas as pd
+from math import ceil, floor
 from copy import copy, deepcopy
 from datetime import datetime, date, time
 from collections import OrderedDict
@@ -33,9 +37,12 @@ from matplotlib.colors import Normalize, LogNorm
 import eqcat.utils as utils
 from eqcat.regression_models import function_map
 from matplotlib.path import Path
-from scipy import odr
+from scipy import odr, sparse
 from eqcat.isf_catalogue import (Magnitude, Location, Origin,
-                                 Event, ISFCatalogue)
+                                 Event, ISFCatalogue, CatalogueHDF5Writer,
+                                 HDF5_DATA_COLUMNS)
+from eqcat.catalogue_parquet import (ParquetCatalogueStore,
+                                     write_parquet_dataset)
 
 try:
     from mpl_toolkits.basemap import Basemap
@@ -51,52 +58,540 @@ matplotlib.rcParams["pdf.fonttype"] = 42
 matplotlib.rcParams["ps.fonttype"] = 42
 matplotlib.rcParams["ps.useafm"] = True
 
+# Columns held as pandas categoricals - selections on them compare integer
+# codes rather than strings
+CATEGORICAL_COLUMNS = ["eventID", "originID", "Agency", "magType", "magAgency"]
+
+# Comparison operators of the selection terms
+TERM_OPERATORS = {"==": operator.eq,
+                  "!=": operator.ne,
+                  ">=": operator.ge,
+                  "<=": operator.le,
+                  ">": operator.gt,
+                  "<": operator.lt}
+
+
+def _get_where_clause(terms):
+    """
+    Returns the PyTables where-clause of a list of selection terms
+    :param list terms:
+        Selection terms as tuples of (column, operator, value)
+    """
+    return " & ".join(["(%s %s %r)" % (column, oper, _to_python(value))
+                       for column, oper, value in terms])
+
+
+def _to_python(value):
+    """
+    Converts numpy scalars (e.g. values taken from a dataframe) to the
+    python float, int or str, whose repr can be parsed in a where-clause
+    """
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def _get_terms_mask(data, terms):
+    """
+    Returns the boolean array of the rows of a dataframe that satisfy all of
+    the selection terms
+    """
+    idx = np.ones(len(data), dtype=bool)
+    for column, oper, value in terms:
+        idx &= np.asarray(TERM_OPERATORS[oper](data[column].values, value))
+    return idx
+
+
+def _sort_counts(counts):
+    """
+    Sorts a series of counts indexed by name in decreasing order of count,
+    and in order of name for equal counts
+    """
+    order = np.lexsort((np.asarray(counts.index, dtype=str),
+                        -counts.values))
+    return counts.iloc[order]
+
+
+def _count_group_events(group_ids, event_codes, number_groups,
+                        number_events):
+    """
+    Returns the number of distinct events in each group, from the group
+    index and the event code of each row (rows without an event have code
+    -1 and are not counted)
+    """
+    valid = (group_ids >= 0) & (event_codes >= 0)
+    pairs = np.unique(group_ids[valid].astype(np.int64) * number_events +
+                      event_codes[valid])
+    return np.bincount(pairs // max(number_events, 1),
+                       minlength=number_groups)
+
+
+def set_categorical_columns(data):
+    """
+    Returns the table with the agency, magnitude type and ID columns
+    (CATEGORICAL_COLUMNS) converted to pandas categoricals
+    :param data:
+        Origin or magnitude table as instance of :class: pandas.DataFrame
+    """
+    return data.astype(dict([(col, "category")
+                             for col in CATEGORICAL_COLUMNS
+                             if col in data.columns]))
+
+
 class CatalogueDB(object):
     """
-    Holder class for the catalogue database
+    Holder class for the catalogue database. Results derived from the
+    tables (see :meth: get_event_codes) are cached until the origins or
+    magnitudes are replaced or change length; :meth: clear_cache must be
+    called after any other in-place change to the tables (e.g. assigning
+    values to a column)
     """
-    def __init__(self, filename=None):
+    def __init__(self, filename=None, lazy=False, chunk_size=100000):
         """
         Instantiate the class. If a filename is supplied this will load the
         data from the file
         :param str filename:
-            Path to input file
+            Path to input file - either an hdf5 file or the directory of a
+            parquet dataset (see :func: write_parquet_dataset)
+        :param bool lazy:
+            If True the store is kept open and the tables are not
+            loaded. Selections are then read from the store (see
+            :meth: select_from_store and :meth: query_table)
+        :param int chunk_size:
+            Maximum number of rows read at once from the store in lazy mode
         """
         self.filename = filename
+        if filename and os.path.isdir(filename):
+            self.backend = "parquet"
+        else:
+            self.backend = "hdf5"
+        self.lazy = lazy
+        self.chunk_size = chunk_size
+        self.store = None
         self.origins = []
         self.magnitudes = []
         self.number_origins = None
         self.number_magnitudes = None
         self.load_data_from_file()
 
+    @property
+    def origins(self):
+        """
+        Returns the origins table
+        """
+        return self._origins
+
+    @origins.setter
+    def origins(self, origins):
+        self._origins = origins
+        self.clear_cache()
+
+    @property
+    def magnitudes(self):
+        """
+        Returns the magnitudes table
+        """
+        return self._magnitudes
+
+    @magnitudes.setter
+    def magnitudes(self, magnitudes):
+        self._magnitudes = magnitudes
+        self.clear_cache()
+
+    def clear_cache(self):
+        """
+        Discards the cached results derived from the tables
+        """
+        self._cache = {}
+
+    def _get_cached(self, name):
+        """
+        Returns the cached result of the given name, or None if there is
+        no result or if the tables have changed since it was cached
+        """
+        cached = self._cache.get(name)
+        if cached and (cached[0] == self._get_tables_key()):
+            return cached[1]
+        return None
+
+    def _set_cached(self, name, value):
+        """
+        Caches a result derived from the current tables
+        """
+        self._cache[name] = (self._get_tables_key(), value)
+        return value
+
     def load_data_from_file(self):
         """
         If a filename is specified then will import data from file
         """
-        if self.filename:
-            self.origins = pd.read_hdf(self.filename, "catalogue/origins")
-            self.magnitudes = pd.read_hdf(self.filename,
-                                          "catalogue/magnitudes")
+        if self.filename and (self.backend == "parquet"):
+            self.store = ParquetCatalogueStore(self.filename)
+            if self.lazy:
+                self.origins = None
+                self.magnitudes = None
+                self.number_origins = self.store.get_number_rows("origins")
+                self.number_magnitudes = \
+                    self.store.get_number_rows("magnitudes")
+            else:
+                self.origins = set_categorical_columns(
+                    self.store.read("origins"))
+                self.magnitudes = set_categorical_columns(
+                    self.store.read("magnitudes"))
+                self.close()
+                _ = self._get_number_origins_magnitudes()
+        elif self.filename and self.lazy:
+            self.store = pd.HDFStore(self.filename, mode="r")
+            self.origins = None
+            self.magnitudes = None
+            self.number_origins = \
+                self.store.get_storer("catalogue/origins").nrows
+            self.number_magnitudes = \
+                self.store.get_storer("catalogue/magnitudes").nrows
+        elif self.filename:
+            self.origins = set_categorical_columns(
+                pd.read_hdf(self.filename, "catalogue/origins"))
+            self.magnitudes = set_categorical_columns(
+                pd.read_hdf(self.filename, "catalogue/magnitudes"))
             _ = self._get_number_origins_magnitudes()
         else:
             pass
 
+    def close(self):
+        """
+        Closes the store of a lazy catalogue
+        """
+        if self.store is not None:
+            self.store.close()
+            self.store = None
+
     def _get_number_origins_magnitudes(self):
         """
         Returns the number of origins and the number of magnitudes
         """
+        if self.lazy:
+            return self.number_origins, self.number_magnitudes
         self.number_origins = len(self.origins) 
         self.number_magnitudes = len(self.magnitudes)
         return self.number_origins, self.number_magnitudes
 
-    def export_current_selection(self, output_file):
+    def _read_rows(self, key, coordinates, columns=None):
+        """
+        Reads the rows of a table of the store at the given coordinates,
+        in blocks of chunk_size rows
+        """
+        if not len(coordinates):
+            return self.store.select(key, start=0, stop=0, columns=columns)
+        return pd.concat([
+            self.store.select(key,
+                              where=coordinates[i:(i + self.chunk_size)],
+                              columns=columns)
+            for i in range(0, len(coordinates), self.chunk_size)])
+
+    def _get_coordinates(self, key, terms, polygon=None):
+        """
+        Returns the coordinates (row numbers) of the rows of a table of the
+        store satisfying all of the selection terms, and lying inside the
+        polygon if given. Terms on the data columns of the table are
+        evaluated by PyTables, the others (and the polygon) are evaluated
+        on the matching rows.
+        :param str key:
+            Table of the store
+        :param list terms:
+            Selection terms as tuples of (column, operator, value)
+        :param polygon:
+            Polygon as instance of :class: matplotlib.path.Path
+        """
+        data_columns = self.store.get_storer(key).data_columns
+        pushed = [term for term in terms if term[0] in data_columns]
+        remaining = [term for term in terms if not term[0] in data_columns]
+        if len(pushed):
+            coordinates = np.asarray(self.store.select_as_coordinates(
+                key, _get_where_clause(pushed)))
+        else:
+            coordinates = np.arange(self.store.get_storer(key).nrows)
+        if not len(coordinates) or not (len(remaining) or polygon):
+            return coordinates
+        columns = list(set([term[0] for term in remaining]))
+        if polygon:
+            columns.extend(["longitude", "latitude"])
+        idx = []
+        for i in range(0, len(coordinates), self.chunk_size):
+            data = self._read_rows(key, coordinates[i:(i + self.chunk_size)],
+                                   columns)
+            block_idx = _get_terms_mask(data, remaining)
+            if polygon:
+                block_idx &= polygon.contains_points(np.column_stack([
+                    data["longitude"].values, data["latitude"].values]))
+            idx.append(block_idx)
+        return coordinates[np.concatenate(idx)]
+
+    def _get_event_coordinates(self, key, event_list):
+        """
+        Returns the coordinates of the rows of a table of the store
+        belonging to the events in the list
+        """
+        if "eventID" in self.store.get_storer(key).data_columns:
+            event_ids = self.store.select_column(key, "eventID").values
+        else:
+            event_ids = self._read_rows(
+                key, np.arange(self.store.get_storer(key).nrows),
+                ["eventID"])["eventID"].values
+        return np.flatnonzero(pd.Series(event_ids).isin(event_list).values)
+
+    def query_table(self, table, terms=None, columns=None, polygon=None):
+        """
+        Reads the rows of a table of the store of a lazy catalogue that
+        satisfy all of the selection terms (and lie inside the polygon if
+        given). The terms are pushed down to the store where possible:
+        where-clauses on the data columns of an hdf5 store, and partition
+        and row group filters of a parquet dataset
+        :param str table:
+            Table to read ("origins" or "magnitudes")
+        :param list terms:
+            Selection terms as tuples of (column, operator, value)
+        :param list columns:
+            Columns to read (all if None)
+        :param polygon:
+            Polygon (longitude, latitude) as instance of
+            :class: matplotlib.path.Path
+        :returns:
+            Rows as instance of :class: pandas.DataFrame
+        """
+        terms = terms or []
+        if self.backend == "hdf5":
+            key = "catalogue/%s" % table
+            return self._read_rows(
+                key, self._get_coordinates(key, terms, polygon), columns)
+        if not polygon:
+            return self.store.read(table, terms, columns)
+        read_columns = None
+        if columns:
+            read_columns = list(columns) + [
+                col for col in ["longitude", "latitude"]
+                if not col in columns]
+        data = self.store.read(table, terms, read_columns)
+        idx = polygon.contains_points(np.column_stack([
+            data["longitude"].values, data["latitude"].values]))
+        data = data[idx]
+        if columns:
+            data = data[list(columns)]
+        return data
+
+    def _query_events(self, table, event_list):
+        """
+        Reads the rows of a table of the store of a lazy catalogue belonging
+        to the events in the list
+        """
+        if self.backend == "hdf5":
+            key = "catalogue/%s" % table
+            return self._read_rows(
+                key, self._get_event_coordinates(key, event_list))
+        return self.store.read(table, [("eventID", "in", event_list)])
+
+    def select_from_store(self, table, terms, polygon=None,
+                          select_type="any"):
+        """
+        Reads the events selected by origin or by magnitude from the store
+        of a lazy catalogue, loading only the matching rows
+        :param str table:
+            Table to select from ("origins" or "magnitudes")
+        :param list terms:
+            Selection terms as tuples of (column, operator, value)
+        :param polygon:
+            Polygon (longitude, latitude) as instance of
+            :class: matplotlib.path.Path
+        :param str select_type:
+            Either "any" (all origins and magnitudes of an event with at
+            least one selected row) or "all" (only the selected rows, with
+            all the rows of their events from the other table)
+        :returns:
+            Selected catalogue as instance of :class: CatalogueDB
         """
-        Exports the current selection to file   
+        if not table in ("origins", "magnitudes"):
+            raise ValueError("Table must be 'origins' or 'magnitudes'")
+        if not select_type in ("any", "all"):
+            raise ValueError(
+                "Selection Type must correspond to 'any' or 'all'")
+        other = "magnitudes" if table == "origins" else "origins"
+        if select_type == "all":
+            selected = self.query_table(table, terms, polygon=polygon)
+            event_list = selected["eventID"].unique()
+        else:
+            event_list = self.query_table(table, terms, ["eventID"],
+                                          polygon)["eventID"].unique()
+            selected = self._query_events(table, event_list)
+        output_catalogue = CatalogueDB()
+        setattr(output_catalogue, table, set_categorical_columns(selected))
+        setattr(output_catalogue, other, set_categorical_columns(
+            self._query_events(other, event_list)))
+        _ = output_catalogue._get_number_origins_magnitudes()
+        return output_catalogue
+
+    def limit_from_store(self, origin_terms, magnitude_terms):
         """
-        store = pd.HDFStore(output_file)
-        store.append("catalogue/origins", self.origins)
-        store.append("catalogue/magnitudes", self.magnitudes)
-        store.close()
+        Reads the origins and the magnitudes satisfying their own selection
+        terms from the store of a lazy catalogue
+        :returns:
+            Selected catalogue as instance of :class: CatalogueDB
+        """
+        output_catalogue = CatalogueDB()
+        output_catalogue.origins = set_categorical_columns(
+            self.query_table("origins", origin_terms))
+        output_catalogue.magnitudes = set_categorical_columns(
+            self.query_table("magnitudes", magnitude_terms))
+        _ = output_catalogue._get_number_origins_magnitudes()
+        return output_catalogue
+
+    def export_current_selection(self, output_file, chunk_size=100000,
+                                 complib="blosc", complevel=5,
+                                 data_columns=HDF5_DATA_COLUMNS):
+        """
+        Exports the current selection to file
+        :param str output_file:
+            Path to the hdf5 file
+        :param int chunk_size:
+            Maximum number of rows written at once
+        :param str complib:
+            Compression library (see :class: CatalogueHDF5Writer)
+        :param int complevel:
+            Compression level
+        :param list data_columns:
+            Columns to index for queries
+        """
+        with CatalogueHDF5Writer(output_file, chunk_size=chunk_size,
+                                 complib=complib, complevel=complevel,
+                                 data_columns=data_columns) as writer:
+            writer.append(self.origins, self.magnitudes)
+
+    def export_current_selection_to_parquet(self, output_dir):
+        """
+        Exports the current selection to a parquet dataset, partitioned by
+        year (see :func: write_parquet_dataset)
+        :param str output_dir:
+            Path to the dataset directory
+        """
+        write_parquet_dataset(output_dir, self.origins, self.magnitudes)
+
+    def view(self):
+        """
+        Returns a view of the whole catalogue, on which selections are
+        returned as views (see :class: CatalogueView)
+        """
+        return CatalogueView(self)
+
+    def get_event_codes(self):
+        """
+        Returns the integer codes of the events of the origins and of the
+        magnitudes (from a single factorisation of their event IDs) and the
+        number of events. The codes are cached (see :meth: clear_cache)
+        """
+        cached = self._get_cached("event_codes")
+        if cached is not None:
+            return cached
+        number_origins = len(self.origins)
+        codes, event_ids = pd.factorize(np.concatenate([
+            np.asarray(self.origins["eventID"], dtype=object),
+            np.asarray(self.magnitudes["eventID"], dtype=object)]))
+        return self._set_cached("event_codes", (codes[:number_origins],
+                                                codes[number_origins:],
+                                                len(event_ids)))
+
+    def get_spatial_index(self, cell_size=1.0):
+        """
+        Returns the grid index of the origin locations. The index is cached
+        (see :meth: clear_cache)
+        :param float cell_size:
+            Size of the grid cells (decimal degrees)
+        :returns:
+            Index as instance of :class: eqcat.utils.SpatialGridIndex
+        """
+        cached = self._get_cached("spatial_index")
+        if cached is not None and (cached.cell_size == cell_size):
+            return cached
+        return self._set_cached("spatial_index", utils.SpatialGridIndex(
+            self.origins["longitude"].values,
+            self.origins["latitude"].values, cell_size))
+
+    def _get_tables_key(self):
+        """
+        Returns the identity and length of the current tables of the
+        catalogue, for the validation of cached results. No references to
+        the tables are kept, so replaced tables are not held by the cache
+        """
+        return ((id(self.origins), len(self.origins)),
+                (id(self.magnitudes), len(self.magnitudes)))
+
+    def get_agency_statistics(self):
+        """
+        Returns the statistics of the magnitudes of each (agency, magnitude
+        type) pair and of the origins of each agency, each from a single
+        grouped aggregation. The statistics are cached (see
+        :meth: clear_cache)
+        :returns:
+            magnitude_stats - pandas.DataFrame of agency, magType,
+                              n_magnitudes, n_events, first_year, last_year
+                              and mean_value, sorted by agency and magType.
+                              The year of a magnitude is that of its origin
+                              (or of the first origin of its event)
+            origin_stats    - pandas.DataFrame of agency, n_origins and
+                              n_events, sorted by decreasing n_origins
+                              (then by agency)
+        """
+        cached = self._get_cached("agency_statistics")
+        if cached is not None:
+            return cached
+        origins = self.origins
+        magnitudes = self.magnitudes
+        origin_codes, magnitude_codes, number_events = self.get_event_codes()
+        years = origins["year"].values.astype(float)
+        # Year of the first origin of each event
+        event_years = np.nan * np.ones(number_events)
+        codes, first_rows = np.unique(origin_codes, return_index=True)
+        event_years[codes] = years[first_rows]
+        # Year of the origin of each magnitude, matched on the categories
+        # of the origin IDs rather than on every row
+        origin_ids = pd.Categorical(origins["originID"])
+        magnitude_ids = pd.Categorical(magnitudes["originID"])
+        id_rows = -np.ones(len(origin_ids.categories), dtype=int)
+        id_rows[origin_ids.codes[::-1]] = np.arange(len(origin_ids))[::-1]
+        loc = origin_ids.categories.get_indexer(magnitude_ids.categories)
+        loc = np.where(loc >= 0, id_rows[loc], -1)[magnitude_ids.codes]
+        loc[magnitude_ids.codes < 0] = -1
+        magnitude_years = np.where(loc >= 0, years[np.maximum(loc, 0)],
+                                   event_years[magnitude_codes])
+        grouped = pd.DataFrame({
+            "agency": pd.Categorical(magnitudes["magAgency"]),
+            "magType": pd.Categorical(magnitudes["magType"]),
+            "year": magnitude_years,
+            "value": magnitudes["value"].values.astype(float)}).groupby(
+                ["agency", "magType"], sort=True, observed=True)
+        magnitude_stats = grouped.agg(
+            n_magnitudes=("value", "size"),
+            first_year=("year", "min"),
+            last_year=("year", "max"),
+            mean_value=("value", "mean")).reset_index()
+        magnitude_stats.insert(3, "n_events", _count_group_events(
+            grouped.ngroup().values, magnitude_codes, grouped.ngroups,
+            number_events))
+        for col in ["first_year", "last_year"]:
+            if magnitude_stats[col].notnull().all():
+                magnitude_stats[col] = magnitude_stats[col].astype(int)
+        grouped = pd.Series(origin_codes).groupby(
+            pd.Categorical(origins["Agency"]), sort=True, observed=True)
+        origin_stats = grouped.size().to_frame("n_origins")
+        origin_stats.index.name = "agency"
+        origin_stats["n_events"] = _count_group_events(
+            grouped.ngroup().values, origin_codes, grouped.ngroups,
+            number_events)
+        # Agencies in the order of get_agency_origin_count
+        origin_stats = origin_stats.loc[
+            _sort_counts(origin_stats["n_origins"]).index].reset_index()
+        for stats in [magnitude_stats, origin_stats]:
+            stats["agency"] = stats["agency"].astype(object)
+        magnitude_stats["magType"] = magnitude_stats["magType"].astype(object)
+        return self._set_cached("agency_statistics",
+                                (magnitude_stats, origin_stats))
 
     def build_isf(self, identifier, name):
         """
@@ -109,8 +604,8 @@ class CatalogueDB(object):
             Catalogue as instance of :class: ISFCatalogue  
         """
         isf_catalogue = ISFCatalogue(identifier, name)
-        event_groups = self.origins.groupby("eventID")
-        mag_groups = self.magnitudes.groupby("eventID")
+        event_groups = self.origins.groupby("eventID", observed=True)
+        mag_groups = self.magnitudes.groupby("eventID", observed=True)
         mag_keys = list(mag_groups.indices.keys())
         ngrps = len(event_groups)
         for iloc, grp in enumerate(event_groups):
@@ -200,17 +695,173 @@ class CatalogueDB(object):
         return mag_list
 
 
+class CatalogueView(CatalogueDB):
+    """
+    Sub-set of a catalogue held as the row positions of its origins and
+    magnitudes in the tables of a parent catalogue, which are shared and
+    not copied. Views of views refer directly to the parent catalogue. The
+    selections of :class: CatalogueSelector and :class: CatalogueQuery on
+    a view are returned as views. The origins and magnitudes attributes
+    return new (materialised) tables on every access - as when exporting
+    the view, or with :meth: materialise
+    :param parent:
+        Parent catalogue as instance of :class: CatalogueDB
+    :param numpy.ndarray origin_rows:
+        Positions of the origins of the view in the parent origins table
+    :param numpy.ndarray magnitude_rows:
+        Positions of the magnitudes of the view in the parent magnitudes
+        table
+    """
+    def __init__(self, parent, origin_rows=None, magnitude_rows=None):
+        """
+        :param parent:
+            Catalogue as instance of :class: CatalogueDB or CatalogueView
+        :param origin_rows:
+            Positions of the origins in the tables of the given catalogue
+            (all if None)
+        :param magnitude_rows:
+            Positions of the magnitudes in the tables of the given catalogue
+            (all if None)
+        """
+        if isinstance(parent, CatalogueView):
+            if origin_rows is not None:
+                origin_rows = parent.origin_rows[origin_rows]
+            else:
+                origin_rows = parent.origin_rows
+            if magnitude_rows is not None:
+                magnitude_rows = parent.magnitude_rows[magnitude_rows]
+            else:
+                magnitude_rows = parent.magnitude_rows
+            parent = parent.parent
+        if parent.lazy:
+            raise ValueError("Views require a catalogue loaded in memory")
+        self.parent = parent
+        if origin_rows is None:
+            origin_rows = np.arange(len(parent.origins))
+        if magnitude_rows is None:
+            magnitude_rows = np.arange(len(parent.magnitudes))
+        self.origin_rows = np.asarray(origin_rows)
+        self.magnitude_rows = np.asarray(magnitude_rows)
+        self.filename = None
+        self.backend = parent.backend
+        self.lazy = False
+        self.chunk_size = parent.chunk_size
+        self.store = None
+        self.number_origins = len(self.origin_rows)
+        self.number_magnitudes = len(self.magnitude_rows)
+        self.clear_cache()
+
+    @property
+    def origins(self):
+        """
+        Returns the origins of the view
+        """
+        return self.parent.origins.iloc[self.origin_rows]
+
+    @property
+    def magnitudes(self):
+        """
+        Returns the magnitudes of the view
+        """
+        return self.parent.magnitudes.iloc[self.magnitude_rows]
+
+    def _get_number_origins_magnitudes(self):
+        """
+        Returns the number of origins and the number of magnitudes
+        """
+        return self.number_origins, self.number_magnitudes
+
+    def view(self):
+        """
+        Returns the view itself
+        """
+        return self
+
+    def _get_tables_key(self):
+        """
+        Returns the key of the tables of the parent catalogue and the
+        identity and length of the rows of the view, for the validation of
+        cached results
+        """
+        return self.parent._get_tables_key() + (
+            (id(self.origin_rows), len(self.origin_rows)),
+            (id(self.magnitude_rows), len(self.magnitude_rows)))
+
+    def get_event_codes(self):
+        """
+        Returns the integer codes of the events of the origins and of the
+        magnitudes of the view (those of the parent catalogue) and the
+        number of events of the parent catalogue
+        """
+        origin_codes, magnitude_codes, number_events = \
+            self.parent.get_event_codes()
+        return (origin_codes[self.origin_rows],
+                magnitude_codes[self.magnitude_rows], number_events)
+
+    def get_spatial_index(self, cell_size=1.0):
+        """
+        Returns the grid index of the origin locations of the view. The
+        index is cached until the rows of the view or the tables of the
+        parent catalogue change
+        """
+        cached = self._get_cached("spatial_index")
+        if cached is not None and (cached.cell_size == cell_size):
+            return cached
+        return self._set_cached("spatial_index", utils.SpatialGridIndex(
+            self.parent.origins["longitude"].values[self.origin_rows],
+            self.parent.origins["latitude"].values[self.origin_rows],
+            cell_size))
+
+    def materialise(self):
+        """
+        Returns the view as a catalogue holding its own tables
+        :returns:
+            Catalogue as instance of :class: CatalogueDB
+        """
+        output_catalogue = CatalogueDB()
+        output_catalogue.origins = self.origins
+        output_catalogue.magnitudes = self.magnitudes
+        _ = output_catalogue._get_number_origins_magnitudes()
+        return output_catalogue
+
+
 class CatalogueSelector(object):
     """
     Tool to select sub-sets of the catalogue
     """
     def __init__(self, catalogue, create_copy=True):
         """
-
+        :param catalogue:
+            Catalogue as instance of :class: CatalogueDB. If the catalogue
+            is lazy the selections are read from its store and are always
+            returned as new (in-memory) catalogues. If it is a
+            :class: CatalogueView the selections are returned as views
+        :param bool create_copy:
+            Return the selections as new catalogues (True) or apply them
+            to the catalogue in place (False)
         """
         self.catalogue = catalogue
         self.copycat = create_copy
 
+    def _select_view(self, method, *args, **kwargs):
+        """
+        Applies a selection to a catalogue view, returning a view
+        """
+        return getattr(self.query(), method)(*args, **kwargs).execute()
+
+    def _get_event_selection(self, idx, table):
+        """
+        Returns the boolean arrays of the origins and of the magnitudes of
+        the events with at least one selected row in the given table. The
+        events are matched by their (cached) integer codes
+        """
+        origin_codes, magnitude_codes, number_events = \
+            self.catalogue.get_event_codes()
+        codes = origin_codes if table == "origins" else magnitude_codes
+        events = np.zeros(number_events, dtype=bool)
+        events[codes[np.asarray(idx, dtype=bool)]] = True
+        return events[origin_codes], events[magnitude_codes]
+
     def _select_by_origins(self, idx, select_type="any"):
         """
         Returns a catalogue selected from the original catalogue by
@@ -222,17 +873,12 @@ class CatalogueSelector(object):
             output_catalogue = CatalogueDB()
             output_catalogue.origins = self.catalogue.origins[idx]
             output_catalogue.magnitudes = self.catalogue.magnitudes[
-                self.catalogue.magnitudes["eventID"].isin(
-                output_catalogue.origins["eventID"].unique())]
+                self._get_event_selection(idx, "origins")[1]]
             return output_catalogue
         if not select_type == "any":
             raise ValueError(
                 "Selection Type must correspond to 'any' or 'all'")
-        
-        valid_origins = self.catalogue.origins.eventID[idx]
-        event_list = valid_origins.unique()
-        select_idx1 = self.catalogue.origins.eventID.isin(event_list)
-        select_idx2 = self.catalogue.magnitudes.eventID.isin(event_list)
+        select_idx1, select_idx2 = self._get_event_selection(idx, "origins")
         if self.copycat:
             output_catalogue = CatalogueDB()
             output_catalogue.origins = self.catalogue.origins[select_idx1]
@@ -255,18 +901,14 @@ class CatalogueSelector(object):
             output_catalogue = CatalogueDB()
             output_catalogue.magnitudes = self.catalogue.magnitudes[idx]
             output_catalogue.origins = self.catalogue.origins[
-                self.catalogue.origins["eventID"].isin(
-                output_catalogue.magnitudes["eventID"].unique())]
+                self._get_event_selection(idx, "magnitudes")[0]]
             return output_catalogue
 
         if not select_type == "any":
             raise ValueError(
                 "Selection Type must correspond to 'any' or 'all'")
-        valid_mags = self.catalogue.magnitudes.eventID[idx]
-        event_list = valid_mags.unique()
-            
-        select_idx1 = self.catalogue.magnitudes.eventID.isin(event_list)
-        select_idx2 = self.catalogue.origins.eventID.isin(event_list)
+        select_idx2, select_idx1 = self._get_event_selection(idx,
+                                                             "magnitudes")
         if self.copycat:
             output_catalogue = CatalogueDB()
             output_catalogue.magnitudes =\
@@ -282,6 +924,13 @@ class CatalogueSelector(object):
         """
         Selects by agency type
         """
+        if isinstance(self.catalogue, CatalogueView):
+            return self._select_view("select_by_agency", agency,
+                                     select_type=select_type)
+        if self.catalogue.lazy:
+            return self.catalogue.select_from_store(
+                "origins", [("Agency", "==", agency)],
+                select_type=select_type)
         idx = self.catalogue.origins.Agency == agency
         return self._select_by_origins(idx, select_type)
 
@@ -292,6 +941,12 @@ class CatalogueSelector(object):
         """
         if not mag_agency:
             mag_agency = agency
+        if isinstance(self.catalogue, CatalogueView):
+            return self._select_view("limit_to_agency", agency, mag_agency)
+        if self.catalogue.lazy:
+            return self.catalogue.limit_from_store(
+                [("Agency", "==", agency)],
+                [("magAgency", "==", mag_agency)])
         select_idx1 = self.catalogue.magnitudes.magAgency == mag_agency
         select_idx2 = self.catalogue.origins.Agency == agency
         if self.copycat:
@@ -314,6 +969,16 @@ class CatalogueSelector(object):
             upper_depth = 0.0
         if not lower_depth:
             lower_depth = np.inf
+        if isinstance(self.catalogue, CatalogueView):
+            return self._select_view("select_within_depth_range",
+                                     upper_depth, lower_depth,
+                                     select_type=select_type)
+        if self.catalogue.lazy:
+            terms = [("depth", ">=", float(upper_depth))]
+            if lower_depth < np.inf:
+                terms.append(("depth", "<=", float(lower_depth)))
+            return self.catalogue.select_from_store(
+                "origins", terms, select_type=select_type)
         idx = (self.catalogue.origins["depth"] >= upper_depth) &\
             (self.catalogue.origins["depth"] <= lower_depth) &\
             (self.catalogue.origins["depth"].notnull())
@@ -331,6 +996,18 @@ class CatalogueSelector(object):
             lower_mag = -np.inf
         if not upper_mag:
             upper_mag = np.inf
+        if isinstance(self.catalogue, CatalogueView):
+            return self._select_view("select_within_magnitude_range",
+                                     lower_mag, upper_mag,
+                                     select_type=select_type)
+        if self.catalogue.lazy:
+            terms = []
+            if lower_mag > -np.inf:
+                terms.append(("value", ">=", float(lower_mag)))
+            if upper_mag < np.inf:
+                terms.append(("value", "<=", float(upper_mag)))
+            return self.catalogue.select_from_store(
+                "magnitudes", terms, select_type=select_type)
         idx = (self.catalogue.magnitudes["value"] >= lower_mag) &\
             (self.catalogue.magnitudes["value"] <= upper_mag)
         return self._select_by_magnitudes(idx, select_type)
@@ -340,25 +1017,46 @@ class CatalogueSelector(object):
         Select within a polygon
         """
         polypath = Path(np.column_stack([poly_lons, poly_lats]))
-        idx = pd.Series(polypath.contains_points(np.column_stack([
-            self.catalogue.origins["longitude"].values,
-            self.catalogue.origins["latitude"].values])))
+        if isinstance(self.catalogue, CatalogueView):
+            return self._select_view("select_within_polygon", poly_lons,
+                                     poly_lats, select_type=select_type)
+        if self.catalogue.lazy:
+            # Only the origins within the bounding box of the polygon are
+            # read from the store
+            terms = [("longitude", ">=", float(np.min(poly_lons))),
+                     ("longitude", "<=", float(np.max(poly_lons))),
+                     ("latitude", ">=", float(np.min(poly_lats))),
+                     ("latitude", "<=", float(np.max(poly_lats)))]
+            return self.catalogue.select_from_store(
+                "origins", terms, polygon=polypath, select_type=select_type)
+        idx = np.zeros(len(self.catalogue.origins), dtype=bool)
+        idx[self.catalogue.get_spatial_index().query_polygon(polypath)] = True
+        idx = pd.Series(idx, index=self.catalogue.origins.index)
         #idx = idx & self.catalogue.origins["depth"].notnull()
         return self._select_by_origins(idx, select_type)
 
     def select_within_bounding_box(self, bounds, select_type="any"):
         """
-        Selects within a bounding box
-        """
-        llon = bounds[0]
-        ulon = bounds[2]
-        llat = bounds[1]
-        ulat = bounds[3]
-        bbox = np.array([[llon, ulat],
-                         [ulon, ulat],
-                         [ulon, llat],
-                         [llon, llat]])
-        return self.select_within_polygon(bbox[:, 0], bbox[:, 1], select_type)
+        Selects within a bounding box [llon, llat, ulon, ulat] (edges
+        included)
+        """
+        llon, llat, ulon, ulat = [float(val) for val in bounds[:4]]
+        if isinstance(self.catalogue, CatalogueView):
+            return self._select_view("select_within_bounding_box", bounds,
+                                     select_type=select_type)
+        if self.catalogue.lazy:
+            # Range scans on the location columns of the store
+            return self.catalogue.select_from_store(
+                "origins", [("longitude", ">=", llon),
+                            ("longitude", "<=", ulon),
+                            ("latitude", ">=", llat),
+                            ("latitude", "<=", ulat)],
+                select_type=select_type)
+        idx = np.zeros(len(self.catalogue.origins), dtype=bool)
+        idx[self.catalogue.get_spatial_index().query_bounding_box(
+            llon, llat, ulon, ulat)] = True
+        idx = pd.Series(idx, index=self.catalogue.origins.index)
+        return self._select_by_origins(idx, select_type)
 
     
     def select_within_date_range(self, start_date=None, end_date=None,
@@ -370,10 +1068,384 @@ class CatalogueSelector(object):
             start_date = 0
         if not end_date:
             end_date = 2015
+        if isinstance(self.catalogue, CatalogueView):
+            return self._select_view("select_within_date_range",
+                                     start_date, end_date,
+                                     select_type=select_type)
+        if self.catalogue.lazy:
+            # Years are integers, so fractional bounds are rounded inwards
+            return self.catalogue.select_from_store(
+                "origins", [("year", ">=", int(ceil(start_date))),
+                            ("year", "<=", int(floor(end_date)))],
+                select_type=select_type)
         idx = (self.catalogue.origins["year"] >= start_date) &\
             (self.catalogue.origins["year"] <= end_date)
         return self._select_by_origins(idx, select_type)
 
+    def _get_zone_rows(self, polygons):
+        """
+        Returns the zone labels and, for each zone, the sorted positions of
+        the origins inside the zone polygon
+        :param polygons:
+            Zone polygons as a list of (longitudes, latitudes), labelled by
+            their position in the list, or as a dictionary of
+            {label: (longitudes, latitudes)}
+        """
+        if isinstance(polygons, dict):
+            labels = list(polygons.keys())
+            polygons = list(polygons.values())
+        else:
+            labels = list(range(len(polygons)))
+        spatial_index = self.catalogue.get_spatial_index()
+        return labels, [
+            spatial_index.query_polygon(
+                Path(np.column_stack([poly_lons, poly_lats])))
+            for poly_lons, poly_lats in polygons]
+
+    def get_zone_labels(self, polygons, select_type=None):
+        """
+        Assigns the origins, or the events, to zones. Where zones overlap
+        the first zone (in the order given) is assigned
+        :param polygons:
+            Zone polygons as a list of (longitudes, latitudes), labelled by
+            their position in the list, or as a dictionary of
+            {label: (longitudes, latitudes)}
+        :param str select_type:
+            None to label each origin. Otherwise each event is labelled by
+            the first zone containing "any" of its origins, "all" of its
+            origins, or its "prime" origin (the first origin if the event
+            has no prime origin)
+        :returns:
+            Zone labels (nan where not assigned) as a categorical
+            pandas.Series indexed as the origins or by event ID
+        """
+        if not select_type in (None, "any", "all", "prime"):
+            raise ValueError("Selection Type must correspond to None, "
+                             "'any', 'all' or 'prime'")
+        labels, zone_rows = self._get_zone_rows(polygons)
+        origins = self.catalogue.origins
+        origin_codes, magnitude_codes, number_events = \
+            self.catalogue.get_event_codes()
+        # Zone of each origin (-1 if none) - the zones are assigned in
+        # reverse so that the first zone containing the origin prevails
+        origin_zones = -np.ones(len(origins), dtype=int)
+        for iloc in range(len(zone_rows) - 1, -1, -1):
+            origin_zones[zone_rows[iloc]] = iloc
+        if not select_type:
+            return pd.Series(pd.Categorical.from_codes(origin_zones, labels),
+                             index=origins.index)
+        event_zones = -np.ones(number_events, dtype=int)
+        if select_type == "any":
+            located = origin_zones >= 0
+            event_zones[:] = len(zone_rows)
+            np.minimum.at(event_zones, origin_codes[located],
+                          origin_zones[located])
+            event_zones[event_zones == len(zone_rows)] = -1
+        elif select_type == "all":
+            number_origins = np.bincount(origin_codes,
+                                         minlength=number_events)
+            for iloc in range(len(zone_rows) - 1, -1, -1):
+                codes, counts = np.unique(origin_codes[zone_rows[iloc]],
+                                          return_counts=True)
+                event_zones[codes[counts == number_origins[codes]]] = iloc
+        else:
+            # Prime origin of each event, or the first origin if none
+            prime_rows = -np.ones(number_events, dtype=int)
+            codes, first_rows = np.unique(origin_codes, return_index=True)
+            prime_rows[codes] = first_rows
+            is_prime = np.flatnonzero(origins["prime"].values == 1)
+            codes, first_rows = np.unique(origin_codes[is_prime],
+                                          return_index=True)
+            prime_rows[codes] = is_prime[first_rows]
+            has_origin = prime_rows >= 0
+            event_zones[has_origin] = origin_zones[prime_rows[has_origin]]
+        # Event IDs by code
+        event_ids = np.empty(number_events, dtype=object)
+        event_ids[magnitude_codes] = np.asarray(
+            self.catalogue.magnitudes["eventID"], dtype=object)
+        event_ids[origin_codes] = np.asarray(origins["eventID"],
+                                             dtype=object)
+        present = np.zeros(number_events, dtype=bool)
+        present[origin_codes] = True
+        present[magnitude_codes] = True
+        return pd.Series(pd.Categorical.from_codes(event_zones[present],
+                                                   labels),
+                         index=pd.Index(event_ids[present], name="eventID"))
+
+    def select_within_zones(self, polygons, select_type="any",
+                            as_view=False):
+        """
+        Selects the events within each of a set of zones, as
+        select_within_polygon does for a single zone, using one spatial
+        index for all of the zones
+        :param polygons:
+            Zone polygons as a list of (longitudes, latitudes), labelled by
+            their position in the list, or as a dictionary of
+            {label: (longitudes, latitudes)}
+        :param str select_type:
+            "any" or "all" (see select_within_polygon)
+        :param bool as_view:
+            Return the zone catalogues as views holding only the index
+            arrays of their rows (always the case for a view)
+        :returns:
+            Dictionary of the catalogue of each zone (by label), as
+            instances of :class: CatalogueDB or :class: CatalogueView
+        """
+        if not select_type in ("any", "all"):
+            raise ValueError(
+                "Selection Type must correspond to 'any' or 'all'")
+        if isinstance(self.catalogue, CatalogueView):
+            as_view = True
+        labels, zone_rows = self._get_zone_rows(polygons)
+        number_origins = len(self.catalogue.get_event_codes()[0])
+        output = OrderedDict()
+        for label, rows in zip(labels, zone_rows):
+            idx = np.zeros(number_origins, dtype=bool)
+            idx[rows] = True
+            origin_idx, magnitude_idx = self._get_event_selection(idx,
+                                                                  "origins")
+            if select_type == "all":
+                origin_idx = idx
+            if as_view:
+                output[label] = CatalogueView(self.catalogue,
+                                              np.flatnonzero(origin_idx),
+                                              np.flatnonzero(magnitude_idx))
+                continue
+            output[label] = CatalogueDB()
+            output[label].origins = self.catalogue.origins[origin_idx]
+            output[label].magnitudes = \
+                self.catalogue.magnitudes[magnitude_idx]
+            _ = output[label]._get_number_origins_magnitudes()
+        return output
+
+    def query(self):
+        """
+        Returns a lazy query on the catalogue, to which the selections are
+        added and then applied at once (see :class: CatalogueQuery)
+        """
+        return CatalogueQuery(self.catalogue)
+
+
+class CatalogueQuery(object):
+    """
+    Lazy selection of a sub-set of the catalogue. The selection methods,
+    with the same arguments and "any"/"all" semantics as those of
+    :class: CatalogueSelector, add a step to the query plan and return the
+    query, so that they can be chained. The plan is applied by
+    :meth: execute, which returns the same catalogue as the corresponding
+    chain of CatalogueSelector calls. The steps only update one row mask
+    per table, the events are matched by integer codes from a single
+    factorisation of the event IDs, and the tables are copied once.
+    :param catalogue:
+        Catalogue as instance of :class: CatalogueDB
+    :param list steps:
+        Query plan as a list of (table, select_type, predicate), where the
+        predicate returns the boolean selection of the given rows of the
+        table of a catalogue. "limit" steps apply a pair of (origin,
+        magnitude) predicates to the rows of each table
+    :param list calls:
+        The selection calls as (method name, arguments, keyword arguments)
+    """
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+        self.steps = []
+        self.calls = []
+
+    def _add_step(self, call, table, select_type, predicate):
+        """
+        Adds a step to the query plan
+        """
+        if not select_type in ("any", "all"):
+            raise ValueError(
+                "Selection Type must correspond to 'any' or 'all'")
+        self.steps.append((table, select_type, predicate))
+        self.calls.append(call)
+        return self
+
+    def select_by_agency(self, agency, select_type="any"):
+        """
+        Selects by agency type
+        """
+        return self._add_step(
+            ("select_by_agency", (agency,), {"select_type": select_type}),
+            "origins", select_type,
+            lambda catalogue, rows: np.asarray(
+                catalogue.origins["Agency"].values[rows] == agency))
+
+    def limit_to_agency(self, agency, mag_agency=None):
+        """
+        Limits the catalogue to just those origins and magnitudes reported by
+        the specific agency
+        """
+        if not mag_agency:
+            mag_agency = agency
+        return self._add_step(
+            ("limit_to_agency", (agency, mag_agency), {}),
+            "limit", "all",
+            (lambda catalogue, rows: np.asarray(
+                catalogue.origins["Agency"].values[rows] == agency),
+             lambda catalogue, rows: np.asarray(
+                catalogue.magnitudes["magAgency"].values[rows] ==
+                mag_agency)))
+
+    def select_within_depth_range(self, upper_depth=None, lower_depth=None,
+                                  select_type="any"):
+        """
+        Selects within a depth range
+        """
+        if not upper_depth:
+            upper_depth = 0.0
+        if not lower_depth:
+            lower_depth = np.inf
+
+        def predicate(catalogue, rows):
+            depth = catalogue.origins["depth"].values[rows]
+            return (depth >= upper_depth) & (depth <= lower_depth) &\
+                np.logical_not(np.isnan(depth))
+        return self._add_step(
+            ("select_within_depth_range", (upper_depth, lower_depth),
+             {"select_type": select_type}),
+            "origins", select_type, predicate)
+
+    def select_within_magnitude_range(self, lower_mag=None, upper_mag=None,
+                                      select_type="any"):
+        """
+        Selects within a magnitude range
+        """
+        if not lower_mag:
+            lower_mag = -np.inf
+        if not upper_mag:
+            upper_mag = np.inf
+
+        def predicate(catalogue, rows):
+            value = catalogue.magnitudes["value"].values[rows]
+            return (value >= lower_mag) & (value <= upper_mag)
+        return self._add_step(
+            ("select_within_magnitude_range", (lower_mag, upper_mag),
+             {"select_type": select_type}),
+            "magnitudes", select_type, predicate)
+
+    def select_within_polygon(self, poly_lons, poly_lats, select_type="any"):
+        """
+        Select within a polygon
+        """
+        polypath = Path(np.column_stack([poly_lons, poly_lats]))
+
+        def predicate(catalogue, rows):
+            idx = np.zeros(len(catalogue.origins), dtype=bool)
+            idx[catalogue.get_spatial_index().query_polygon(polypath)] = True
+            return idx[rows]
+        return self._add_step(
+            ("select_within_polygon", (poly_lons, poly_lats),
+             {"select_type": select_type}),
+            "origins", select_type, predicate)
+
+    def select_within_bounding_box(self, bounds, select_type="any"):
+        """
+        Selects within a bounding box [llon, llat, ulon, ulat] (edges
+        included)
+        """
+        llon, llat, ulon, ulat = [float(val) for val in bounds[:4]]
+
+        def predicate(catalogue, rows):
+            idx = np.zeros(len(catalogue.origins), dtype=bool)
+            idx[catalogue.get_spatial_index().query_bounding_box(
+                llon, llat, ulon, ulat)] = True
+            return idx[rows]
+        return self._add_step(
+            ("select_within_bounding_box", (bounds,),
+             {"select_type": select_type}),
+            "origins", select_type, predicate)
+
+    def select_within_date_range(self, start_date=None, end_date=None,
+                                 select_type="any"):
+        """
+        Selects within a date[years] range
+        """
+        if not start_date:
+            start_date = 0
+        if not end_date:
+            end_date = 2015
+
+        def predicate(catalogue, rows):
+            year = catalogue.origins["year"].values[rows]
+            return (year >= start_date) & (year <= end_date)
+        return self._add_step(
+            ("select_within_date_range", (start_date, end_date),
+             {"select_type": select_type}),
+            "origins", select_type, predicate)
+
+    def execute(self, as_view=False):
+        """
+        Applies the query plan to the catalogue
+        :param bool as_view:
+            Return the selection as a view of the catalogue (always the
+            case if the catalogue is itself a view)
+        :returns:
+            Selected catalogue as instance of :class: CatalogueDB (or of
+            :class: CatalogueView)
+        """
+        catalogue = self.catalogue
+        steps = self.steps
+        if catalogue.lazy and not len(steps):
+            # An empty plan selects the whole catalogue
+            catalogue = catalogue.limit_from_store([], [])
+            return catalogue.view() if as_view else catalogue
+        if catalogue.lazy:
+            # The first selection is read from the store, the others are
+            # applied to it in memory
+            name, args, kwargs = self.calls[0]
+            catalogue = getattr(CatalogueSelector(catalogue), name)(*args,
+                                                                     **kwargs)
+            steps = steps[1:]
+        if isinstance(catalogue, CatalogueView):
+            parent = catalogue.parent
+            as_view = True
+        else:
+            parent = catalogue
+        data = {"origins": parent.origins,
+                "magnitudes": parent.magnitudes}
+        # Integer codes of the events of the origins and magnitudes
+        origin_codes, magnitude_codes, number_events = \
+            parent.get_event_codes()
+        event_codes = {"origins": origin_codes,
+                       "magnitudes": magnitude_codes}
+        if isinstance(catalogue, CatalogueView):
+            keep = {"origins": np.zeros(len(origin_codes), dtype=bool),
+                    "magnitudes": np.zeros(len(magnitude_codes),
+                                           dtype=bool)}
+            keep["origins"][catalogue.origin_rows] = True
+            keep["magnitudes"][catalogue.magnitude_rows] = True
+        else:
+            keep = {"origins": np.ones(len(origin_codes), dtype=bool),
+                    "magnitudes": np.ones(len(magnitude_codes), dtype=bool)}
+        for table, select_type, predicate in steps:
+            if table == "limit":
+                for key, table_predicate in zip(["origins", "magnitudes"],
+                                                predicate):
+                    rows = np.flatnonzero(keep[key])
+                    keep[key][rows[np.logical_not(
+                        table_predicate(parent, rows))]] = False
+                continue
+            other = "magnitudes" if table == "origins" else "origins"
+            rows = np.flatnonzero(keep[table])
+            selected = rows[predicate(parent, rows)]
+            events = np.zeros(number_events, dtype=bool)
+            events[event_codes[table][selected]] = True
+            if select_type == "all":
+                keep[table] = np.zeros(len(keep[table]), dtype=bool)
+                keep[table][selected] = True
+            else:
+                keep[table] &= events[event_codes[table]]
+            keep[other] &= events[event_codes[other]]
+        if as_view:
+            return CatalogueView(parent, np.flatnonzero(keep["origins"]),
+                                 np.flatnonzero(keep["magnitudes"]))
+        output_catalogue = CatalogueDB()
+        output_catalogue.origins = data["origins"][keep["origins"]]
+        output_catalogue.magnitudes = data["magnitudes"][keep["magnitudes"]]
+        _ = output_catalogue._get_number_origins_magnitudes()
+        return output_catalogue
 
 
 def get_agency_origin_count(catalogue):
@@ -382,10 +1454,12 @@ def get_agency_origin_count(catalogue):
     agency
     """
     agency_count = catalogue.origins["Agency"].value_counts()
+    # Categorical columns also count the agencies not in the selection
+    agency_count = _sort_counts(agency_count[agency_count > 0])
     count_list = []
     agency_list = list(agency_count.keys())
     for iloc in range(0, len(agency_count)):
-        count_list.append((agency_list[iloc], agency_count[iloc]))
+        count_list.append((agency_list[iloc], agency_count.iloc[iloc]))
     return count_list
 
 
@@ -395,40 +1469,93 @@ def get_agency_magnitude_count(catalogue):
     agency
     """
     agency_count = catalogue.magnitudes["magAgency"].value_counts()
+    agency_count = _sort_counts(agency_count[agency_count > 0])
     count_list = []
     agency_list = list(agency_count.keys())
     for iloc in range(0, len(agency_count)):
-        count_list.append((agency_list[iloc], agency_count[iloc]))
+        count_list.append((agency_list[iloc], agency_count.iloc[iloc]))
     return count_list
 
 
-def get_agency_magtype_statistics(catalogue, pretty_print=True):
+def _get_magnitude_type_groups(magnitude_stats):
     """
-    Returns an analysis of the number of different magnitude types found for
-    each agency
+    Returns a dictionary of the magnitude statistics of each agency, in
+    decreasing order of the number of magnitudes
     """
-    agency_count = get_agency_origin_count(catalogue)
-    mag_group = catalogue.magnitudes.groupby("magAgency")
-    mag_group_keys = list(mag_group.groups.keys())
-    output = []
-    for agency, n_origins in agency_count:
+    return dict([
+        (agency, grp) for agency, grp in magnitude_stats.sort_values(
+            "n_magnitudes", ascending=False, kind="mergesort").groupby(
+                "agency", sort=False)])
+
+
+def format_agency_magtype_statistics(magnitude_stats, origin_stats,
+                                     agency_dict=None):
+    """
+    Formats the agency and magnitude type statistics (see
+    :meth: CatalogueDB.get_agency_statistics) as text, listing for each
+    agency the number of origins and the number of magnitudes of each type
+    :param dict agency_dict:
+        Optional dictionary of {agency code: {"name": ..., "country": ...}}
+        to include the names and countries of the agencies
+    :returns:
+        Text as a string
+    """
+    magnitude_groups = _get_magnitude_type_groups(magnitude_stats)
+    lines = []
+    for agency, n_origins in zip(origin_stats["agency"].values,
+                                 origin_stats["n_origins"].values):
+        if agency_dict is not None:
+            agency_info = agency_dict.get(agency, {})
+            lines.append("Agency: %s - %s - %s " % (
+                agency, agency_info.get("name", []),
+                agency_info.get("country", [])))
+            lines.append("Origins: %d " % n_origins)
+        else:
+            lines.append("Agency: %s - %d Origins" % (agency, n_origins))
+        if not agency in magnitude_groups:
+            lines.append("No magnitudes corresponding to this agency")
+        else:
+            grp = magnitude_groups[agency]
+            lines.append(" | ".join([
+                "{:s} ({:d})".format(mag_type, n_mags)
+                for mag_type, n_mags in zip(grp["magType"].values,
+                                            grp["n_magnitudes"].values)]))
+        lines.append("".join(["=" for iloc in range(0, 40)]))
+    return "\n".join(lines)
 
-        print("Agency: %s - %d Origins" % (agency, n_origins))
-        if not agency in mag_group_keys:
-            print("No magnitudes corresponding to this agency")
-            print("".join(["=" for iloc in range(0, 40)]))
-            continue
 
-        grp1 = mag_group.get_group(agency)
-        mag_counts = grp1["magType"].value_counts()
-        mag_counts = iter(mag_counts.items())
-        if pretty_print:
-            print("%s" % " | ".join(["{:s} ({:d})".format(val[0], val[1])
-                                     for val in mag_counts]))
-            print("".join(["=" for iloc in range(0, 40)]))
-        agency_dict = {"Origins": n_origins, "Magnitudes": dict(mag_counts)}
-        output.append((agency, agency_dict))
+def _get_agency_magtype_dict(catalogue):
+    """
+    Returns the number of origins and the number of magnitudes of each
+    type for each agency with magnitudes, in decreasing order of the
+    number of origins
+    """
+    magnitude_stats, origin_stats = catalogue.get_agency_statistics()
+    magnitude_groups = _get_magnitude_type_groups(magnitude_stats)
+    output = []
+    for agency, n_origins in zip(origin_stats["agency"].values,
+                                 origin_stats["n_origins"].values):
+        if not agency in magnitude_groups:
+            continue
+        grp = magnitude_groups[agency]
+        output.append((agency, {
+            "Origins": n_origins,
+            "Magnitudes": dict(zip(grp["magType"].values,
+                                   grp["n_magnitudes"].values))}))
     return OrderedDict(output)
+
+
+def get_agency_magtype_statistics(catalogue, pretty_print=True):
+    """
+    Returns an analysis of the number of different magnitude types found for
+    each agency
+    :param bool pretty_print:
+        Print the statistics (see :func: format_agency_magtype_statistics)
+    """
+    if pretty_print:
+        print(format_agency_magtype_statistics(
+            *catalogue.get_agency_statistics()))
+    return _get_agency_magtype_dict(catalogue)
     
 
 def get_agency_magtype_statistics_with_agency_code(catalogue,
@@ -437,41 +1564,72 @@ def get_agency_magtype_statistics_with_agency_code(catalogue,
     """
     Returns an analysis of the number of different magnitude types found for
     each agency
+    :param dict agency_dict:
+        Dictionary of {agency code: {"name": ..., "country": ...}}
+    :param bool pretty_print:
+        Print the statistics with the agency names and countries
     """
-    agency_count = get_agency_origin_count(catalogue)
-    mag_group = catalogue.magnitudes.groupby("magAgency")
-    mag_group_keys = mag_group.groups.keys()
-    output = []
-    agency_name = []
-    agency_country = []
-    agency_codes = agency_dict
-    
-    
-    for agency, n_origins in agency_count:
-        for key, value in sorted(agency_codes.iteritems()):
-               if key == agency:
-                  agency_name = value.get('name')
-                  agency_country = value.get('country')
-        print("Agency: %s - %s - %s " % (agency, agency_name, agency_country))
-        print("Origins: %d " % (n_origins))
-    
-        if not agency in mag_group_keys:
-            print("No magnitudes corresponding to this agency")
-            print("".join(["=" for iloc in range(0, 40)]))
-            continue
-
-        grp1 = mag_group.get_group(agency)
-        mag_counts = grp1["magType"].value_counts()
-        mag_counts = mag_counts.iteritems()
-        if pretty_print:
-            print("%s" % " | ".join(["{:s} ({:d})".format(val[0], val[1])
-                                     for val in mag_counts]))
-            print("".join(["=" for iloc in range(0, 40)]))
-        agency_dict = {"Origins": n_origins, "Magnitudes": dict(mag_counts)}
-        output.append((agency, agency_dict))
-    return OrderedDict(output)
+    if pretty_print:
+        print(format_agency_magtype_statistics(
+            *catalogue.get_agency_statistics(),
+            agency_dict=agency_dict or {}))
+    return _get_agency_magtype_dict(catalogue)
 
             
+def _get_first_rows(event_codes, keys):
+    """
+    Returns the first row of each event when the rows of each event are
+    ordered by the keys (primary key first, ties kept in row order), with
+    the events in the order of their codes. Rows without an event (code
+    -1) are ignored
+    """
+    order = np.lexsort([np.arange(len(event_codes))] + keys[::-1] +
+                       [event_codes])
+    sorted_codes = event_codes[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    return order[first & (sorted_codes >= 0)]
+
+
+def _get_pair_rows(values, rows1, codes1, origin_rank1, rows2, codes2):
+    """
+    Returns the magnitude rows of two (agency, magnitude type) pairs for
+    each of their common events, in the order of the event codes. For each
+    event the magnitude of the first pair with the largest origin ID (rank)
+    is taken, and the magnitude of the second pair with the largest value
+    (the first NaN, as for numpy.argmax, if there is one)
+    :param numpy.ndarray values:
+        Magnitude values of the catalogue
+    :returns:
+        Rows of the first pair and rows of the second pair
+    """
+    idx = np.isin(codes2, codes1)
+    rows2 = rows2[idx]
+    codes2 = codes2[idx]
+    values2 = values[rows2]
+    is_nan = np.isnan(values2)
+    keep2 = _get_first_rows(codes2, [~is_nan,
+                                     -np.where(is_nan, 0., values2)])
+    keep1 = _get_first_rows(codes1, [-origin_rank1])
+    keep1 = keep1[np.isin(codes1[keep1], codes2[keep2])]
+    return rows1[keep1], rows2[keep2]
+
+
+def _get_pair_data(magnitudes, pair1, pair2, rows1, rows2):
+    """
+    Returns the magnitude and sigma vectors of the magnitude rows of two
+    (agency, magnitude type) pairs, keyed as e.g. "mb(ISC)"
+    """
+    pair_1_key = "{:s}({:s})".format(pair1[1],pair1[0])
+    pair_2_key = "{:s}({:s})".format(pair2[1],pair2[0])
+    return OrderedDict([
+        (pair_1_key, magnitudes["value"].values[rows1].astype(float)),
+        (pair_1_key + " Sigma",
+         magnitudes["sigma"].values[rows1].astype(float)),
+        (pair_2_key, magnitudes["value"].values[rows2]),
+        (pair_2_key + " Sigma", magnitudes["sigma"].values[rows2])])
+
+
 def get_agency_magnitude_pairs(catalogue, pair1, pair2, no_case=False):
     """
     Returns a set of vectors corresponding to the common magnitudes
@@ -510,10 +1668,16 @@ def get_agency_magnitude_pairs(catalogue, pair1, pair2, no_case=False):
         print("Agency-Pair: (%s, %s) returned no magnitudes" %(pair2[0],
                                                                pair2[1]))
         return None, None
-    select_cat1 = catalogue.magnitudes[case1_select]
-    select_cat2 = catalogue.magnitudes[case2_select]
+    magnitudes = catalogue.magnitudes
+    rows1 = np.flatnonzero(np.asarray(case1_select))
+    rows2 = np.flatnonzero(np.asarray(case2_select))
+    # Event codes in the order of a groupby on the event IDs
+    codes = pd.Categorical(magnitudes["eventID"].values[
+        np.concatenate([rows1, rows2])]).codes
+    codes1 = codes[:len(rows1)]
+    codes2 = codes[len(rows1):]
     # See if any eventIDs in the second catalogues are in the first
-    idx = select_cat2.eventID.isin(select_cat1.eventID)
+    idx = np.isin(codes2, codes1)
     num_events = np.sum(idx)
     if np.any(idx):
         print("Agency-Pairs: (%s, %s) & (%s, %s) returned %d events" % (
@@ -525,46 +1689,201 @@ def get_agency_magnitude_pairs(catalogue, pair1, pair2, no_case=False):
             pair1[0], pair1[1], pair2[0], pair2[1]))
         return None, None
         
-    common_catalogue = select_cat2[idx]
-    cat1_groups = select_cat1.groupby("eventID")
-    mag1 = []
-    sigma1 = []
-    mag2 = []
-    sigma2 = []
-    for i, grp in common_catalogue.groupby("eventID"):
-        if len(grp) > 1:
-            # Find the event with the largest magnitude - some truncation
-            # may be occurring
-            mloc = np.argmax(grp["value"].values)
-            event0 = grp.iloc[mloc]
-        else:
-            event0 = grp.iloc[0]
-        mag2.append(event0.value)
-        sigma2.append(event0.sigma)
-  
-        event1 = cat1_groups.get_group(event0.eventID)
-        if len(event1) > 1:
-            # Also find the event with the largest magnitude
-            event1 = event1.iloc[np.argmax(event1["originID"].values)]
-            mag1.append(event1.value.tolist())
-            sigma1.append(event1.sigma.tolist())
-        else:
-            mag1.extend(event1.value.tolist())
-            sigma1.extend(event1.sigma.tolist())
-
+    origin_rank = pd.factorize(np.asarray(magnitudes["originID"].values[rows1],
+                                          dtype=object), sort=True)[0]
+    rows1, rows2 = _get_pair_rows(magnitudes["value"].values,
+                                  rows1, codes1, origin_rank,
+                                  rows2[idx], codes2[idx])
+    origin_codes, magnitude_codes, _ = catalogue.get_event_codes()
+    common_events = np.unique(magnitude_codes[rows2])
     output_catalogue = CatalogueDB()
     output_catalogue.origins = catalogue.origins[
-        catalogue.origins.eventID.isin(common_catalogue.eventID)]
-    output_catalogue.magnitudes = catalogue.magnitudes[
-        catalogue.magnitudes.eventID.isin(common_catalogue.eventID)]
+        np.isin(origin_codes, common_events)]
+    output_catalogue.magnitudes = magnitudes[
+        np.isin(magnitude_codes, common_events)]
     _, _ = output_catalogue._get_number_origins_magnitudes()
-    pair_1_key = "{:s}({:s})".format(pair1[1],pair1[0])
-    pair_2_key = "{:s}({:s})".format(pair2[1],pair2[0])
-    return OrderedDict([
-        (pair_1_key, np.array(mag1)),
-        (pair_1_key + " Sigma", np.array(sigma1)),                   
-        (pair_2_key, np.array(mag2)),
-        (pair_2_key + " Sigma", np.array(sigma2))]), output_catalogue
+    return _get_pair_data(magnitudes, pair1, pair2, rows1, rows2),\
+        output_catalogue
+
+
+class AgencyMagnitudeMiner(object):
+    """
+    Mining engine of the (agency, magnitude type) combinations of a
+    catalogue. The magnitude table is pivoted once into a sparse event x
+    combination incidence matrix, from which the number of common events of
+    every pair of combinations is found with a single sparse matrix
+    product. The data vectors are only extracted for the pairs of
+    combinations with enough common events
+    :param magnitudes:
+        Values and sigmas of the magnitudes as instance of
+        :class: pandas.DataFrame
+    :param bool no_case:
+        Ignore the case of the agencies and magnitude types (True)
+    :param dict combinations:
+        Column of the incidence matrix of each (agency, magnitude type)
+        combination (in lower case if no_case)
+    :param numpy.ndarray value_rows:
+        Magnitude row with the largest value for each combination and
+        event, sorted by combination and event
+    :param numpy.ndarray origin_rows:
+        Magnitude row with the largest origin ID for each combination and
+        event, sorted by combination and event
+    :param numpy.ndarray events:
+        Event code (in the order of a groupby on the event IDs) of the
+        reduced rows
+    :param numpy.ndarray offsets:
+        Start of the reduced rows of each combination, with a final entry
+        for the end of the last combination
+    """
+    def __init__(self, catalogue, no_case=False):
+        """
+        :param catalogue:
+            Catalogue as instance of :class: CatalogueDB
+        :param bool no_case:
+            Ignore the case of the agencies and magnitude types (True)
+        """
+        magnitudes = catalogue.magnitudes
+        # Only the values and sigmas are kept, to limit the size of the
+        # miner sent to the worker processes
+        self.magnitudes = magnitudes[["value", "sigma"]]
+        self.no_case = no_case
+        keys = []
+        for col in ["magAgency", "magType"]:
+            data = pd.Categorical(magnitudes[col])
+            names = np.asarray(data.categories, dtype=object)
+            if no_case:
+                names = np.array([name.lower() for name in names],
+                                 dtype=object)
+            codes, names = pd.factorize(names)
+            keys.append((np.where(data.codes >= 0, codes[data.codes], -1),
+                         names))
+        (agency_codes, agencies), (type_codes, mag_types) = keys
+        codes = np.where((agency_codes >= 0) & (type_codes >= 0),
+                         agency_codes * len(mag_types) + type_codes, -1)
+        valid = np.flatnonzero(codes >= 0)
+        combination_codes = -np.ones(len(codes), dtype=int)
+        combination_codes[valid], uniques = pd.factorize(codes[valid])
+        self.combinations = dict([
+            ((agencies[code // len(mag_types)],
+              mag_types[code % len(mag_types)]), iloc)
+            for iloc, code in enumerate(uniques)])
+        event_codes = pd.Categorical(magnitudes["eventID"]).codes
+        number_events = np.max(event_codes) + 1 if len(event_codes) else 0
+        valid = valid[event_codes[valid] >= 0]
+        origin_ids = pd.Categorical(magnitudes["originID"])
+        category_rank = pd.factorize(np.asarray(origin_ids.categories,
+                                                dtype=object), sort=True)[0]
+        origin_rank = np.where(origin_ids.codes >= 0,
+                               category_rank[origin_ids.codes], -1)[valid]
+        # Reduce each combination to one magnitude per event, once for
+        # either side of a pair (see get_agency_magnitude_pairs)
+        group_codes = combination_codes[valid].astype(np.int64) *\
+            number_events + event_codes[valid]
+        values = magnitudes["value"].values[valid]
+        is_nan = np.isnan(values)
+        self.value_rows = valid[_get_first_rows(
+            group_codes, [~is_nan, -np.where(is_nan, 0., values)])]
+        self.origin_rows = valid[_get_first_rows(group_codes,
+                                                 [-origin_rank])]
+        self.events = event_codes[self.value_rows]
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(
+            combination_codes[self.value_rows], minlength=len(uniques)))])
+        # Incidence matrix of the events and the combinations
+        self.incidence = sparse.csr_matrix(
+            (np.ones(len(self.value_rows), dtype=np.int64),
+             (self.events, combination_codes[self.value_rows])),
+            shape=(number_events, len(uniques)))
+        self.common_counts = None
+
+    def get_combination(self, agency, mag_type):
+        """
+        Returns the column of an (agency, magnitude type) combination, or
+        None if the catalogue has no such magnitudes
+        """
+        if self.no_case:
+            agency, mag_type = agency.lower(), mag_type.lower()
+        return self.combinations.get((agency, mag_type), None)
+
+    def get_common_event_counts(self):
+        """
+        Returns the number of common events of every pair of combinations,
+        as a sparse matrix (computed once)
+        """
+        if self.common_counts is None:
+            self.common_counts = (self.incidence.T * self.incidence).tocsr()
+        return self.common_counts
+
+    def get_candidate_pairs(self, agency_mag_data, threshold):
+        """
+        Returns the pairs of (agency, magnitude type) combinations with more
+        than a threshold number of common events, in the order in which
+        :func: mine_agency_magnitude_combinations has always tried them
+        :param dict agency_mag_data:
+            Number of magnitudes of each type for each agency, as returned
+            by :func: get_agency_magtype_statistics
+        :param int threshold:
+            Minimum number of magnitudes of a combination, and threshold on
+            the number of common events of a pair
+        :returns:
+            List of tuples of (pair1, pair2, number of common events)
+        """
+        entries = []
+        for iloc, agency in enumerate(agency_mag_data):
+            for mag_type in agency_mag_data[agency]["Magnitudes"]:
+                if agency_mag_data[agency]["Magnitudes"][mag_type] <\
+                        threshold:
+                    continue
+                column = self.get_combination(agency, mag_type)
+                if column is not None:
+                    entries.append(((agency, mag_type), iloc, column))
+        if not len(entries):
+            return []
+        agency_iloc = np.array([entry[1] for entry in entries])
+        columns = np.array([entry[2] for entry in entries])
+        counts = self.get_common_event_counts()[columns][:, columns].tocoo()
+        idx = (counts.data > threshold) &\
+            (agency_iloc[counts.col] >= agency_iloc[counts.row]) &\
+            (counts.col != counts.row)
+        first, second, number = counts.row[idx], counts.col[idx], \
+            counts.data[idx]
+        order = np.lexsort((second, first))
+        return [(entries[first[i]][0], entries[second[i]][0], number[i])
+                for i in order]
+
+    def get_pair_data(self, pair1, pair2):
+        """
+        Returns the magnitude vectors of the common events of two (agency,
+        magnitude type) combinations, as for :func:
+        get_agency_magnitude_pairs, or None if there are no common events
+        """
+        iloc1 = self.get_combination(*pair1)
+        iloc2 = self.get_combination(*pair2)
+        if (iloc1 is None) or (iloc2 is None):
+            return None
+        slice1 = slice(self.offsets[iloc1], self.offsets[iloc1 + 1])
+        slice2 = slice(self.offsets[iloc2], self.offsets[iloc2 + 1])
+        _, idx1, idx2 = np.intersect1d(self.events[slice1],
+                                       self.events[slice2],
+                                       assume_unique=True,
+                                       return_indices=True)
+        if not len(idx1):
+            return None
+        rows1 = self.origin_rows[slice1][idx1]
+        rows2 = self.value_rows[slice2][idx2]
+        return _get_pair_data(self.magnitudes, pair1, pair2, rows1, rows2)
+
+    def mine(self, agency_mag_data, threshold):
+        """
+        Yields the key (e.g. "mb(ISC)|Mw(GCMT)") and the magnitude vectors
+        of each pair of combinations with more than a threshold number of
+        common events
+        """
+        for pair1, pair2, _ in self.get_candidate_pairs(agency_mag_data,
+                                                        threshold):
+            print("Trying: (%s, %s) and (%s, %s)" % (pair1 + pair2))
+            data = self.get_pair_data(pair1, pair2)
+            data_keys = list(data.keys())
+            yield "|".join([data_keys[0], data_keys[2]]), data
 
 
 def mine_agency_magnitude_combinations(catalogue, agency_mag_data, threshold,
@@ -573,87 +1892,134 @@ def mine_agency_magnitude_combinations(catalogue, agency_mag_data, threshold,
     Return list of possible agency and magnitude combinations that would
     exceed a threshold number of points
     """
-    results_dict = []
-    for iloc, agency_1 in enumerate(agency_mag_data):
-        for mag_1 in agency_mag_data[agency_1]["Magnitudes"]:
-            if agency_mag_data[agency_1]["Magnitudes"][mag_1] < threshold:
-                continue
-            for agency_2 in list(agency_mag_data.keys())[iloc:]:
-                for mag_2 in agency_mag_data[agency_2]["Magnitudes"]:
-                    if (agency_1 == agency_2) and (mag_1 == mag_2):
-                        # Redundent
-                        continue
-                    if agency_mag_data[agency_2]["Magnitudes"][mag_2] <\
-                        threshold:
-                        # Skip
-                        continue
-                    print("Trying: (%s, %s) and (%s, %s)" % (agency_1, mag_1,
-                                                             agency_2, mag_2))
-                    data, _ = get_agency_magnitude_pairs(catalogue,
-                                                         (agency_1, mag_1),
-                                                         (agency_2, mag_2),
-                                                         no_case)
-                    if data:
-                        # Report number of values
-                        data_keys = data.keys()
-                        npairs = len(data[data_keys[0]])
-                        if npairs > threshold:
-                            results_dict.append(
-                                ("|".join([data_keys[0], data_keys[2]]),
-                                 data))
-                    else:
-                        print("----> No pairs found!")
-    return OrderedDict(results_dict)
+    miner = AgencyMagnitudeMiner(catalogue, no_case)
+    return OrderedDict(miner.mine(agency_mag_data, threshold))
+
+
+def get_combination_key(pair1, pair2):
+    """
+    Returns the key of a pair of (agency, magnitude type) combinations,
+    e.g. "mb(ISC)|Mw(GCMT)", as used for the mined datasets
+    """
+    return "{:s}({:s})|{:s}({:s})".format(pair1[1], pair1[0],
+                                          pair2[1], pair2[0])
+
+
+def _print_progress(action, number_done, number_total, start):
+    """
+    Prints the progress of a batch job with its estimated time to completion
+    :param str action:
+        Description of the task (e.g. "Mined")
+    :param start:
+        Start time of the job as instance of :class: datetime.datetime
+    """
+    elapsed = (datetime.now() - start).total_seconds()
+    print("%s %d of %d pairs (%.1f %%) - elapsed %.1f s - ETA %.1f s" % (
+        action, number_done, number_total,
+        100.0 * number_done / number_total, elapsed,
+        elapsed * (number_total - number_done) / number_done))
+
+
+# Attribute marking the datasets completely written by
+# mine_agency_magnitude_combinations_to_file
+COMPLETE_ATTRIBUTE = "complete"
+
+# Miner used by the worker processes of
+# mine_agency_magnitude_combinations_to_file
+_WORKER_MINER = None
+
+
+def _set_worker_miner(miner):
+    """
+    Sets the miner of a worker process
+    """
+    global _WORKER_MINER
+    _WORKER_MINER = miner
+
+
+def _mine_pair_batch(pairs):
+    """
+    Returns the key and the array of magnitudes (value and sigma of either
+    combination) of each of a batch of pairs of combinations. Used as the
+    worker function for :func: mine_agency_magnitude_combinations_to_file
+    """
+    output = []
+    for pair1, pair2 in pairs:
+        data = _WORKER_MINER.get_pair_data(pair1, pair2)
+        output.append((get_combination_key(pair1, pair2),
+                       np.column_stack(list(data.values())).astype("f")))
+    return output
 
 
 def mine_agency_magnitude_combinations_to_file(output_file, catalogue,
-        agency_mag_data, threshold, no_case=False):
+        agency_mag_data, threshold, no_case=False, processes=None,
+        batch_size=20):
     """
-    Return list of possible agency and magnitude combinations that would
-    exceed a threshold number of points
+    Mines the agency and magnitude combinations that exceed a threshold
+    number of points, writing the magnitudes of each pair of combinations to
+    a dataset of the hdf5 file. The pairs are shared among a pool of worker
+    processes, and the datasets are written by this process alone as the
+    results arrive. Each dataset is marked as complete once written. Pairs
+    with a complete dataset already in the file are skipped, and incomplete
+    datasets are written again, so an interrupted job can be resumed by
+    running it again
+    :param int processes:
+        Number of worker processes (defaults to the number of CPUs). With
+        one process the pairs are mined without a pool
+    :param int batch_size:
+        Number of pairs given to a worker at once
     """
-    results_dict = []
+    miner = AgencyMagnitudeMiner(catalogue, no_case)
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    pool = None
     fle = h5py.File(output_file, "a")
-    for iloc, agency_1 in enumerate(agency_mag_data):
-        for mag_1 in agency_mag_data[agency_1]["Magnitudes"]:
-            if agency_mag_data[agency_1]["Magnitudes"][mag_1] < threshold:
+    try:
+        pairs = [(pair1, pair2) for pair1, pair2, _ in
+                 miner.get_candidate_pairs(agency_mag_data, threshold)]
+        number_pairs = len(pairs)
+        remaining = []
+        for pair1, pair2 in pairs:
+            combo_key = get_combination_key(pair1, pair2)
+            if combo_key in fle:
+                if fle[combo_key].attrs.get(COMPLETE_ATTRIBUTE, False):
+                    continue
+                # Left incomplete by an interrupted job
+                del fle[combo_key]
+            remaining.append((pair1, pair2))
+        pairs = remaining
+        if len(pairs) < number_pairs:
+            print("Skipping %d pairs already in %s" % (
+                number_pairs - len(pairs), output_file))
+        batches = [pairs[i:(i + batch_size)]
+                   for i in range(0, len(pairs), batch_size)]
+        if processes > 1 and len(batches) > 1:
+            pool = multiprocessing.Pool(processes, _set_worker_miner,
+                                        (miner,))
+            results = pool.imap(_mine_pair_batch, batches)
+        else:
+            _set_worker_miner(miner)
+            results = map(_mine_pair_batch, batches)
+        report_step = max(len(batches) // 100, 1)
+        start = datetime.now()
+        number_mined = 0
+        for iloc, batch in enumerate(results):
+            for combo_key, data in batch:
+                dset = fle.create_dataset(combo_key, data=data, dtype="f")
+                dset.attrs[COMPLETE_ATTRIBUTE] = True
+            # Flush each batch, so that the datasets written so far survive
+            # an interruption
+            fle.flush()
+            number_mined += len(batch)
+            if ((iloc + 1) % report_step) and (iloc + 1 < len(batches)):
                 continue
-            for agency_2 in list(agency_mag_data.keys())[iloc:]:
-                for mag_2 in agency_mag_data[agency_2]["Magnitudes"]:
-                    if (agency_1 == agency_2) and (mag_1 == mag_2):
-                        # Redundent
-                        continue
-                    if agency_mag_data[agency_2]["Magnitudes"][mag_2] <\
-                        threshold:
-                        # Skip
-                        continue
-                    print("Trying: (%s, %s) and (%s, %s)" % (agency_1, mag_1,
-                                                             agency_2, mag_2))
-                    data, _ = get_agency_magnitude_pairs(catalogue,
-                                                         (agency_1, mag_1),
-                                                         (agency_2, mag_2),
-                                                         no_case)
-                    if data:
-                        # Report number of values
-                        data_keys = list(data.keys())
-                        npairs = len(data[data_keys[0]])
-                        if npairs > threshold:
-                            combo_key = "|".join([data_keys[0],
-                                                  data_keys[2]])
-
-                            results_dict.append(
-                                ("|".join([data_keys[0], data_keys[2]]),
-                                 data))
-                            dset = fle.create_dataset(combo_key,
-                                                      (npairs, 4),
-                                                      dtype="f")
-                            dset[:] = np.column_stack([data[data_keys[0]],
-                                                       data[data_keys[1]],
-                                                       data[data_keys[2]],
-                                                       data[data_keys[3]]])
-                    else:
-                        print("----> No pairs found!")
-    fle.close()
+            _print_progress("Mined", number_mined, len(pairs), start)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+        _set_worker_miner(None)
+        fle.close()
 
 
 def join_query_results(data1, data2):
@@ -880,6 +2246,21 @@ def extract_scale_agency(key):
         raise ValueError("Badly formatted key %s" % key)
 
 
+def get_regression_function(model_type):
+    """
+    Returns the regression function of a model type
+    :param str model_type:
+        Model type. Choose from {"polynomial", "piecewise", "exponential",
+        "2segmentM#.#"} where M#.# is the corner magnitude
+    """
+    if "2segment" in model_type:
+        model_type, mag = model_type.split("M")
+        return function_map[model_type](float(mag))
+    if not model_type in function_map:
+        raise ValueError("Model type %s not supported!" % model_type)
+    return function_map[model_type]()
+
+
 class CatalogueRegressor(object):
     """
     Class to perform an orthodonal distance regression on a pair of magnitude
@@ -969,7 +2350,8 @@ class CatalogueRegressor(object):
             figure_size, lognorm, filetype, resolution, filename)
 
 
-    def run_regression(self, model_type, initial_params, setup_parameters={}):
+    def run_regression(self, model_type, initial_params, setup_parameters={},
+                       verbose=True):
         """
         Runs the regression analysis on the retreived data
         :param str model_type:
@@ -985,16 +2367,11 @@ class CatalogueRegressor(object):
                 of slope 1 and 2, respectively, and c_1 is the intercept
         :param dict setup_parameters:
             Optionl parameters to control how to define missing uncertainties
+        :param bool verbose:
+            Print the final report of the regression
 
         """
-        if "2segment" in model_type:
-            model_type, mag = model_type.split("M")
-            mag = float(mag)
-            self.model_type = function_map[model_type](mag)
-        else:
-            if not model_type in function_map:
-                raise ValueError("Model type %s not supported!" % model_type)
-            self.model_type = function_map[model_type]()
+        self.model_type = get_regression_function(model_type)
         self.model = odr.Model(self.model_type.run)
         if (model_type=="exponential") and (len(initial_params) != 3):
             raise ValueError("Exponential model requires three initial "
@@ -1029,7 +2406,8 @@ class CatalogueRegressor(object):
         regressor = odr.ODR(self.regression_data,
                             self.model,
                             initial_params)
-        regressor.set_iprint(final=2)
+        if verbose:
+            regressor.set_iprint(final=2)
         self.results = regressor.run()
         return self.results
     
@@ -1119,22 +2497,23 @@ class CatalogueRegressor(object):
             idx = self.data[self.keys[0]] < self.model_type.corner_magnitude
             data_xl = self.data[self.keys[0]][idx]
             data_yl = self.data[self.keys[2]][idx]
-            sigma_l = np.std(data_yl -
-                             self.model_type.run(self.results.beta, data_xl))
+            sigma_l = float(np.std(data_yl - self.model_type.run(
+                self.results.beta, data_xl)))
             idx = self.data[self.keys[0]] >= self.model_type.corner_magnitude
             data_xu = self.data[self.keys[0]][idx]
             data_yu = self.data[self.keys[2]][idx]
-            sigma_u = np.std(data_yu -
-                             self.model_type.run(self.results.beta, data_xu))
+            sigma_u = float(np.std(data_yu - self.model_type.run(
+                self.results.beta, data_xu)))
             standard_deviation = [sigma_l, sigma_u]
         elif default and isinstance(self.model_type,
                                     function_map["piecewise"]):
             standard_deviation = []
             npar = len(self.results.beta)
             corner_magnitudes = [-np.inf]
-            corner_magnitudes.extend(self.results.beta[(npar / 2):(npar - 1)])
-            corner_magnitudes.extend(np.inf)
-            for iloc, m_c in range(0, len(corner_magnitudes) - 1):
+            corner_magnitudes.extend(
+                self.results.beta[int(npar / 2):(npar - 1)])
+            corner_magnitudes.append(np.inf)
+            for iloc, m_c in enumerate(corner_magnitudes[:-1]):
             
                 idx = np.logical_and(
                     self.data[self.keys[0]] >= m_c,
@@ -1142,13 +2521,13 @@ class CatalogueRegressor(object):
                 data_x = self.data[self.keys[0]][idx]
                 data_y = self.data[self.keys[2]][idx]
                 standard_deviation.append(
-                        np.std(data_y - self.model_type.run(self.results.beta,
-                                                            data_x)))
+                        float(np.std(data_y - self.model_type.run(
+                            self.results.beta, data_x))))
         else:
-            standard_deviation = np.std(
+            standard_deviation = float(np.std(
                 self.data[self.keys[2]] -
                 self.model_type.run(self.results.beta, self.data[self.keys[0]])
-                )
+                ))
         return standard_deviation
 
     def get_magnitude_conversion_model(self):
@@ -1171,8 +2550,8 @@ class CatalogueRegressor(object):
 
         rule = self.get_magnitude_conversion_model()
         # Group magnitudes and origins by event ID
-        mag_grps = catalogue.magnitudes.groupby("eventID")
-        orig_grps = catalogue.origins.groupby("eventID")
+        mag_grps = catalogue.magnitudes.groupby("eventID", observed=True)
+        orig_grps = catalogue.origins.groupby("eventID", observed=True)
         output = []
         for event_id, event in mag_grps:
             input_x, observed_y, input_x_origin, observed_y_origin,\
@@ -1211,7 +2590,7 @@ class CatalogueRegressor(object):
         observed_y_origin = None
         input_x_row = None
         observed_y_row = None
-        orig_grps = orig_grp.groupby("originID")
+        orig_grps = orig_grp.groupby("originID", observed=True)
         for _, row in event.iterrows():
             if row.magAgency == self.y_agency and\
                 row.magType.lower() == self.y_scale.lower():
@@ -1443,6 +2822,182 @@ class CatalogueRegressor(object):
                         bbox_inches="tight")
 
 
+# Models fitted to each pair of combinations by
+# regress_agency_magnitude_combinations_from_file, as (model name, model
+# type, initial parameters). The name identifies the model in the results
+# table and in the conversion rules, so must be unique within the grid
+DEFAULT_REGRESSION_MODELS = [
+    ("polynomial1", "polynomial", [0.0, 1.0]),
+    ("polynomial2", "polynomial", [0.0, 1.0, 0.0]),
+    ("piecewise", "piecewise", [1.0, 1.0, 6.0, 0.0]),
+    ("2segmentM5.5", "2segmentM5.5", [1.0, 1.0, 0.0]),
+    ("2segmentM6.0", "2segmentM6.0", [1.0, 1.0, 0.0]),
+    ("2segmentM6.5", "2segmentM6.5", [1.0, 1.0, 0.0])]
+
+
+def _get_named_models(models):
+    """
+    Returns the grid of models as a list of (model name, model type,
+    initial parameters), naming the models given only as (model type,
+    initial parameters) after their type (and degree, for polynomials)
+    """
+    named_models = []
+    for model in models:
+        if len(model) == 3:
+            named_models.append(tuple(model))
+            continue
+        model_type, initial_params = model
+        if model_type == "polynomial":
+            model_name = "polynomial%d" % (len(initial_params) - 1)
+        else:
+            model_name = model_type
+        named_models.append((model_name, model_type, initial_params))
+    model_names = [model[0] for model in named_models]
+    if len(set(model_names)) != len(model_names):
+        raise ValueError("Model names must be unique: %s"
+                         % ", ".join(model_names))
+    return named_models
+
+
+def _fit_regression_models(args):
+    """
+    Fits each of a list of models to the magnitudes of a pair of
+    combinations, returning a row of results per model. Used as the worker
+    function for :func: regress_agency_magnitude_combinations_from_file
+    """
+    combo_key, data, models, setup_parameters = args
+    regressor = CatalogueRegressor.from_array(data, combo_key)
+    number = len(data)
+    output = []
+    for model_name, model_type, initial_params in models:
+        row = OrderedDict([("key", combo_key),
+                           ("model_name", model_name),
+                           ("model_type", model_type),
+                           ("initial_params", list(initial_params)),
+                           ("n", number)])
+        try:
+            results = regressor.run_regression(model_type, initial_params,
+                                               dict(setup_parameters),
+                                               verbose=False)
+            standard_deviation = regressor.get_standard_deviation()
+        except Exception as error:
+            # A failed fit does not stop the batch
+            row["error"] = "%s: %s" % (type(error).__name__, str(error))
+            output.append(row)
+            continue
+        row.update([("beta", results.beta.tolist()),
+                    ("sd_beta", results.sd_beta.tolist()),
+                    ("res_var", results.res_var),
+                    ("stddev", standard_deviation)])
+        if not results.sum_square > 0.0:
+            # Exact fit - the AIC and BIC are undefined, so the model is
+            # not considered in the selection
+            row["error"] = "Degenerate fit: zero residual sum of squares"
+            output.append(row)
+            continue
+        npar = len(results.beta)
+        log_likelihood = number * np.log(results.sum_square / number)
+        row.update([("aic", log_likelihood + 2.0 * npar),
+                    ("bic", log_likelihood + npar * np.log(number)),
+                    ("error", None)])
+        output.append(row)
+    return output
+
+
+def regress_agency_magnitude_combinations_from_file(input_file, models=None,
+        output_file=None, keys=None, setup_parameters={}, criterion="bic",
+        processes=None):
+    """
+    Fits a set of orthogonal distance regression models to each pair of
+    agency and magnitude combinations mined to an hdf5 file (see
+    :func: mine_agency_magnitude_combinations_to_file), sharing the pairs
+    among a pool of worker processes
+    :param str input_file:
+        Path to the hdf5 file of mined pairs
+    :param list models:
+        Models to fit as tuples of (model name, model type, initial
+        parameters) (see :meth: CatalogueRegressor.run_regression). Tuples
+        of (model type, initial parameters) are named after their type
+        (and degree, for polynomials). Defaults to
+        DEFAULT_REGRESSION_MODELS
+    :param str output_file:
+        Path to a csv file to write the results table to (optional)
+    :param list keys:
+        Keys of the pairs to fit (defaults to every dataset in the file)
+    :param dict setup_parameters:
+        Parameters to control how to define missing uncertainties (see
+        :meth: CatalogueRegressor.run_regression)
+    :param str criterion:
+        Criterion to select the best model of each pair ("aic" or "bic")
+    :param int processes:
+        Number of worker processes (defaults to the number of CPUs). With
+        one process the models are fitted without a pool
+    :returns:
+        results - Results table as instance of :class: pandas.DataFrame,
+                  with a row for each pair and model (by name and type)
+                  giving the parameters (beta) and their standard errors
+                  (sd_beta), the residual variance (res_var), the AIC and
+                  BIC of the fit (computed from the weighted sum of
+                  squared orthogonal residuals), the number of data (n),
+                  the standard deviation of the model and whether the
+                  model is the best of the pair. Failed and exact (zero
+                  residual) fits are described in the error column and
+                  are not selected
+        rules   - Best model of each pair as an ordered dictionary of
+                  instances of :class:
+                  eqcat.isc_homogenisor.MagnitudeConversionRule
+    """
+    if not criterion in ("aic", "bic"):
+        raise ValueError("Model selection criterion must be 'aic' or 'bic'")
+    models = _get_named_models(models or DEFAULT_REGRESSION_MODELS)
+    if not processes:
+        processes = multiprocessing.cpu_count()
+    with h5py.File(input_file, "r") as fle:
+        if keys is None:
+            keys = list(fle.keys())
+        tasks = [(combo_key, fle[combo_key][:], models, setup_parameters)
+                 for combo_key in keys]
+    rows = []
+    pool = None
+    try:
+        if processes > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(processes)
+            results = pool.imap(_fit_regression_models, tasks)
+        else:
+            results = map(_fit_regression_models, tasks)
+        report_step = max(len(tasks) // 100, 1)
+        start = datetime.now()
+        for iloc, pair_rows in enumerate(results):
+            rows.extend(pair_rows)
+            if ((iloc + 1) % report_step) and (iloc + 1 < len(tasks)):
+                continue
+            _print_progress("Fitted", iloc + 1, len(tasks), start)
+    finally:
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+    results = pd.DataFrame(rows, columns=[
+        "key", "model_name", "model_type", "initial_params", "n", "beta",
+        "sd_beta", "res_var", "aic", "bic", "stddev", "error"])
+    results["best"] = False
+    fitted = results[results["error"].isnull() &
+                     results[criterion].notnull()]
+    best = fitted.groupby("key", sort=False)[criterion].idxmin()
+    results.loc[best.values, "best"] = True
+    rules = []
+    for combo_key, iloc in best.items():
+        row = results.loc[iloc]
+        scale, agency = extract_scale_agency(combo_key.split("|")[0])
+        rules.append((combo_key,
+                      get_regression_function(
+                          row["model_type"]).to_conversion_rule(
+                              agency, scale, row["beta"], row["stddev"],
+                              key=combo_key, model_name=row["model_name"])))
+    if output_file:
+        results.to_csv(output_file, index=False)
+    return results, OrderedDict(rules)
+
+
 def plot_catalogue_map(config, catalogue, magnitude_scale=False,
         color_norm=None, overlay=False, figure_size=(7,8), filename=None,
         filetype="png", dpi=300):
@@ -1476,7 +3031,7 @@ def plot_catalogue_map(config, catalogue, magnitude_scale=False,
                     catalogue.origins["latitude"].values)
     if magnitude_scale:
         magnitudes = []
-        mag_grps = catalogue.magnitudes.groupby("originID")
+        mag_grps = catalogue.magnitudes.groupby("originID", observed=True)
         for key in catalogue.origins.originID.values:
             if key in catalogue.magnitudes.originID.values:
                 grp = mag_grps.get_group(key)
@@ -23,6 +23,7 @@ import datetime
 from math import fabs, floor, sqrt, pi
 import numpy as np
 import eqcat.gcmt_utils as utils
+from eqcat.utils import EventIndex
 from collections import OrderedDict
 # Adding on an exporter to Geojson, but only if geojson package exists
 try:
@@ -453,7 +454,28 @@ class GCMTCatalogue(object):
         self.number_gcmts = len(gcmts)
         self.start_year = start_year
         self.end_year = end_year
-        self.ids = [gcmt.identifier for gcmt in self.gcmts]
+        # Index of event IDs to positions in the list of moment tensors
+        self.index = EventIndex("identifier")
+
+    @property
+    def ids(self):
+        """
+        List of event IDs
+        """
+        return [gcmt.identifier for gcmt in self.gcmts]
+
+    @ids.setter
+    def ids(self, ids):
+        """
+        Assigns the IDs to the moment tensors, in order, and re-indexes them
+        """
+        if len(ids) != len(self.gcmts):
+            raise ValueError("Number of IDs (%d) does not match number of "
+                             "moment tensors (%d)" % (len(ids),
+                                                      len(self.gcmts)))
+        for gcmt, identifier in zip(self.gcmts, ids):
+            gcmt.identifier = identifier
+        self.index.rebuild(self.gcmts)
 
     def number_events(self):
         '''
@@ -471,10 +493,10 @@ class GCMTCatalogue(object):
         """
         Returns a specific event by event ID
         """
-        if key in self.ids:
-            return self.gcmts[self.ids.index(key)]
-        else:
+        iloc = self.index.get(self.gcmts, key)
+        if iloc is None:
             raise KeyError("Event %s not found" % key)
+        return self.gcmts[iloc]
 
     def __iter__(self):
         """
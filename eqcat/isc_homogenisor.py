@@ -41,6 +41,7 @@ from scipy.misc import derivative
 from datetime import date
 from math import exp, sqrt, sin, cos, atan2, pi
 from eqcat.utils import haversine, _prepare_coords
+from eqcat.isf_columnar import EventView
 
 #from openquake.hazardlib.geo import geodetic
 #from openquake.hazardlib.geo.geodetic import _prepare_coords
@@ -820,11 +821,16 @@ class DuplicateFinder(object):
         '''
         # Get event key list
         ref_keys = self.reference.get_event_key_list()
-        ref_times = self.reference.get_decimal_dates()
+        ref_times = self.reference.get_prime_origin_times()[1]
         cat_keys = catalogue.get_event_key_list()
-        cat_times = catalogue.get_decimal_dates()
+        cat_times = catalogue.get_prime_origin_times()[1]
+        merged = set()
 
         for iloc, event in enumerate(catalogue.events):
+            if isinstance(event, EventView):
+                # Event of a columnar catalogue - the reference catalogue
+                # needs event objects that can be modified
+                event = event.to_event()
             # Check the time difference
             dtime = np.fabs(cat_times[iloc] - ref_times)
             idx = dtime < self.time_window
@@ -841,6 +847,7 @@ class DuplicateFinder(object):
                     # Merge origins of new catalogue into origin of reference
                     self.reference.events[dup_event].merge_secondary_origin(
                         event.origins)
+                    merged.add(dup_event)
                 else:
                     self.reference.events.append(event)
                     if self.logging:
@@ -851,11 +858,10 @@ class DuplicateFinder(object):
         # Sort reference events
         print("After duplicate finding: %g events (%g)" %\
             (self.reference.get_number_events(), len(self.reference.events)))
-        ref_times = self.reference.get_decimal_dates()
-        ascend_time = np.argsort(ref_times)
-        event_list = [self.reference.events[ascend_time[i]]
-                      for i in range(0, self.reference.get_number_events())]
-        self.reference.events = event_list
+        # Only the times of the appended events and of those that received
+        # new origins need to be computed
+        self.reference.reset_prime_origin_times(merged)
+        self.reference.sort_by_time()
         return self.reference
 
     def tensor_check(self, event, dup_event):
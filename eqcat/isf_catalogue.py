@@ -21,11 +21,12 @@ General class for an earthquame catalogue in ISC (ISF) format
 """
 from __future__ import print_function
 import datetime
+import operator
 import numpy as np
 import h5py
 import pandas as pd
 from math import fabs
-from eqcat.utils import decimal_time
+from eqcat.utils import decimal_time, epoch_time, EventIndex
 
 
 DATAMAP = [("eventID", "U20"), ("originID", "U20"), ("Agency", "U14"), 
@@ -38,6 +39,115 @@ DATAMAP = [("eventID", "U20"), ("originID", "U20"), ("Agency", "U14"),
 MAGDATAMAP = [("eventID", "U20"), ("originID", "U20"), ("magnitudeID", "U40"), 
     ("value", "f4"), ("sigma", "f4"), ("magType", "U6"), ("magAgency", "U14")]
 
+def get_min_itemsize(datamap):
+    """
+    Returns the dictionary of the widths of the string columns of a table
+    definition (e.g. DATAMAP), for use as the min_itemsize of a
+    pandas.HDFStore table
+    """
+    return dict([(name, int(dtype[1:])) for name, dtype in datamap
+                 if dtype.startswith("U")])
+
+# Columns of the hdf5 origin and magnitude tables that are indexed for
+# queries
+HDF5_DATA_COLUMNS = ["eventID", "year", "Agency", "longitude", "latitude",
+                     "depth", "magType", "magAgency", "value"]
+
+
+class CatalogueHDF5Writer(object):
+    """
+    Writes origin and magnitude tables (as numpy structured arrays with the
+    DATAMAP and MAGDATAMAP dtypes, or as pandas DataFrames) to the
+    "catalogue/origins" and "catalogue/magnitudes" tables of an hdf5 store.
+    The tables are appended in blocks of at most chunk_size rows and are
+    compressed. The data columns can be queried with `where=` and are
+    indexed once, when the writer is closed. Rows appended to a table
+    already in the store keep the data columns of that table.
+    :param str hdf5_file:
+        Path to the hdf5 store
+    :param int chunk_size:
+        Maximum number of rows appended at once
+    :param str complib:
+        Compression library ("blosc", "zlib", "lzo" or "bzip2"), or None
+        for no compression
+    :param int complevel:
+        Compression level (0 to 9)
+    :param list data_columns:
+        Columns (of either table) to store as indexed data columns
+    """
+    def __init__(self, hdf5_file, chunk_size=100000, complib="blosc",
+                 complevel=5, data_columns=HDF5_DATA_COLUMNS):
+        self.store = pd.HDFStore(hdf5_file)
+        self.chunk_size = chunk_size
+        self.complib = complib
+        self.complevel = complevel if complib else None
+        self.data_columns = data_columns or []
+        self.written = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def append(self, origins, magnitudes):
+        """
+        Appends the origin and magnitude tables to the store
+        """
+        self._append("catalogue/origins", origins, DATAMAP)
+        self._append("catalogue/magnitudes", magnitudes, MAGDATAMAP)
+
+    def _append(self, key, data, datamap):
+        """
+        Appends a table to the store in blocks of chunk_size rows
+        """
+        if not isinstance(data, pd.DataFrame):
+            data = pd.DataFrame(data, columns=[val[0] for val in datamap])
+        if not len(data):
+            return
+        # Categorical columns are stored as strings
+        categorical = dict([(col, object) for col in data.columns
+                            if isinstance(data[col].dtype,
+                                          pd.CategoricalDtype)])
+        if categorical:
+            data = data.astype(categorical)
+        if ("/" + key) in self.store.keys():
+            # Appends to an existing table keep its data columns
+            table_columns = self.store.get_storer(key).data_columns
+        else:
+            table_columns = self.data_columns
+        data_columns = [col for col in table_columns if col in data.columns]
+        # String widths from the table definition - the data columns are
+        # sized individually and the other strings share the widest size
+        widths = get_min_itemsize(datamap)
+        min_itemsize = dict([(col, widths[col]) for col in data_columns
+                             if col in widths])
+        values = [widths[col] for col in data.columns
+                  if (col in widths) and not (col in data_columns)]
+        if len(values):
+            min_itemsize["values"] = max(values)
+        for start in range(0, len(data), self.chunk_size):
+            self.store.append(key, data.iloc[start:(start + self.chunk_size)],
+                              data_columns=data_columns,
+                              min_itemsize=min_itemsize,
+                              complib=self.complib,
+                              complevel=self.complevel,
+                              index=False)
+        self.written[key] = data_columns
+
+    def close(self):
+        """
+        Indexes the data columns of the tables written and closes the store
+        """
+        try:
+            for key, data_columns in self.written.items():
+                if len(data_columns):
+                    self.store.create_table_index(key, columns=data_columns,
+                                                  optlevel=6, kind="medium")
+        finally:
+            self.store.close()
+
+
 def datetime_to_decimal_time(date, time):
     '''
     Converts a datetime object to decimal time
@@ -53,6 +163,85 @@ def datetime_to_decimal_time(date, time):
                         np.array([time.minute]), 
                         np.array([seconds]))
 
+def get_magnitude_id(origin_id, author, value, scale):
+    """
+    Returns the magnitude ID string from the origin ID, author, value and
+    scale of the magnitude
+    """
+    if value > 10.0:
+        # Probably a moment magnitude
+        return "|".join(["{:s}".format(origin_id), author,
+                         "{:.6e}".format(value), scale])
+    else:
+        return "|".join(["{:s}".format(origin_id), author,
+                         "{:.2f}".format(value), scale])
+
+def get_prime_origin_times(events):
+    """
+    Returns the time of the prime origin of each event (or of the first
+    origin if the event has no prime origin) as seconds since 1970-01-01
+    and as decimal years
+    :param list events:
+        Events as instances of :class: Event
+    """
+    fields = []
+    for event in events:
+        prime = event.origins[0]
+        for origin in event.origins:
+            if origin.is_prime:
+                prime = origin
+                break
+        fields.append((prime.date.year, prime.date.month, prime.date.day,
+                       prime.time.hour, prime.time.minute,
+                       float(prime.time.second) +
+                       (float(prime.time.microsecond) / 1.0E6)))
+    if not len(fields):
+        return np.array([]), np.array([])
+    year, month, day, hour, minute, second = [np.array(vals)
+                                              for vals in zip(*fields)]
+    return epoch_time(year, month, day, hour, minute, second),\
+        decimal_time(year, month, day, hour, minute, second)
+
+def get_origin_mag_tables(events):
+    """
+    Returns the origin and magnitude tables (with the DATAMAP and MAGDATAMAP
+    dtypes) of a list of events
+    :param list events:
+        Events as instances of :class: Event
+    """
+    origin_data = np.zeros((sum([len(eq.origins) for eq in events]),),
+                           dtype=DATAMAP)
+    mag_data = np.zeros((sum([len(eq.magnitudes) for eq in events]),),
+                        dtype=MAGDATAMAP)
+    o_counter = 0
+    m_counter = 0
+    for eq in events:
+        for orig in eq.origins:
+            loc = orig.location
+            # Error ellipse only if the semi-major axis is given
+            if loc.semimajor90:
+                ellipse = (loc.semimajor90, loc.semiminor90,
+                           loc.error_strike)
+            else:
+                ellipse = (0.0, 0.0, 0.0)
+            date = orig.date
+            time = orig.time
+            origin_data[o_counter] = (eq.id, orig.id, orig.author,
+                date.year, date.month, date.day, time.hour, time.minute,
+                float(time.second) + float(time.microsecond) / 1.0E6,
+                orig.time_error or 0.0, loc.longitude, loc.latitude,
+                loc.depth, loc.depthSolution, ellipse[0], ellipse[1],
+                ellipse[2], loc.depth_error or 0.0,
+                1 if orig.is_prime else 0)
+            o_counter += 1
+        for mag in eq.magnitudes:
+            mag_data[m_counter] = (mag.event_id, mag.origin_id,
+                mag.magnitude_id, mag.value, mag.sigma or 0.0, mag.scale,
+                mag.author)
+            m_counter += 1
+    return origin_data, mag_data
+
+
 class Magnitude(object):
     '''
     Stores an instance of a magnitude
@@ -84,17 +273,8 @@ class Magnitude(object):
         self.sigma = sigma
         self.stations = stations
         # Createa ID string from attributes
-        if self.value > 10.0:
-            # Probably a moment magnitude
-            self.magnitude_id = "|".join(["{:s}".format(self.origin_id),
-                                          self.author,
-                                          "{:.6e}".format(self.value),
-                                          self.scale])
-        else: 
-            self.magnitude_id = "|".join(["{:s}".format(self.origin_id),
-                                          self.author,
-                                          "{:.2f}".format(self.value),
-                                          self.scale])
+        self.magnitude_id = get_magnitude_id(self.origin_id, self.author,
+                                             self.value, self.scale)
     
     def compare_magnitude(self, magnitude, tol=1E-3):
         '''
@@ -404,14 +584,16 @@ class Event(object):
         Merges an instance of an isf_catalogue.Origin class into the set 
         of origins. 
         '''
-        current_id_list = self.get_origin_id_list()
+        current_ids = {}
+        for iloc, origin_id in enumerate(self.get_origin_id_list()):
+            current_ids.setdefault(origin_id, iloc)
         for origin2 in origin2set:
             if not isinstance(origin2, Origin):
                 raise ValueError('Secondary origins must be instance of '
                                  'isf_catalogue.Origin class')
-            if origin2.id in current_id_list:
+            if origin2.id in current_ids:
                 # Origin is already in list - process magnitudes
-                location = current_id_list.index(origin2.id)
+                location = current_ids[origin2.id]
                 origin = self.origins[location]
                 new_magnitudes = origin.merge_secondary_magnitudes(
                     origin2.magnitudes, self.id)
@@ -466,8 +648,30 @@ class ISFCatalogue(object):
             self.events = events
         else:
             self.events = []
-        self.ids = [event.id for event in self.events]
+        # Index of event IDs to positions in the list of events
+        self.index = EventIndex("id")
+        # Cache of the prime origin times
+        self._prime_times = None
+        self._stale_times = set()
 
+    @property
+    def ids(self):
+        """
+        List of event IDs
+        """
+        return self.get_event_key_list()
+
+    @ids.setter
+    def ids(self, ids):
+        """
+        Assigns the IDs to the events, in order, and re-indexes the events
+        """
+        if len(ids) != len(self.events):
+            raise ValueError("Number of IDs (%d) does not match number of "
+                             "events (%d)" % (len(ids), len(self.events)))
+        for event, event_id in zip(self.events, ids):
+            event.id = event_id
+        self.index.rebuild(self.events)
 
     def __iter__(self):
         """
@@ -486,12 +690,10 @@ class ISFCatalogue(object):
         """
         Returns the event corresponding to the specific key
         """
-        if not len(self.ids):
-            self.ids = [event.id for event in self.events]
-        if key in self.ids:
-            return self.events[self.ids.index(key)]
-        else:
+        iloc = self.index.get(self.events, key)
+        if iloc is None:
             raise KeyError("Event %s not found" % key)
+        return self.events[iloc]
 
     def get_number_events(self):
         """
@@ -517,53 +719,79 @@ class ISFCatalogue(object):
             raise ValueError('Input catalogue must be instance of ISF '
                              'Catalogue')
 
-        native_keys = self.get_event_key_list()
-        new_keys = catalogue.get_event_key_list()
-        for iloc, key in enumerate(new_keys):
-            if key in native_keys:
+        for event2 in catalogue.events:
+            location = self.index.get(self.events, event2.id)
+            if location is not None:
                 # Add secondary to primary
-                location = native_keys.index(key)
                 # Merge origins into catalogue
                 event = self.events[location]
-                event.merge_secondary_origin(catalogue.events[iloc].origins)
+                event.merge_secondary_origin(event2.origins)
                 self.events[location] = event
 
+    def get_prime_origin_times(self):
+        """
+        Returns the time of the prime origin of each event (or of the first
+        origin if the event has no prime origin), both as seconds since
+        1970-01-01 and as decimal years. The times are cached: they are
+        computed only for events added since the previous call, or for all
+        events if events have been removed or reordered. Call
+        :meth: reset_prime_origin_times after changing the origins of
+        events. The arrays returned should not be modified.
+        :returns:
+            epoch - Times as seconds since 1970-01-01 (numpy.ndarray)
+            decimal_time - Times as decimal years (numpy.ndarray)
+        """
+        nevents = len(self.events)
+        if self._prime_times is not None:
+            events, epoch, dtime = self._prime_times
+            if (len(events) > nevents) or\
+                    not all(map(operator.is_, events, self.events)):
+                # Events removed or reordered
+                self._prime_times = None
+        if self._prime_times is None:
+            events, epoch, dtime = [], np.array([]), np.array([])
+            self._stale_times = set()
+        if len(events) < nevents:
+            # Events added
+            new_epoch, new_dtime = get_prime_origin_times(
+                self.events[len(events):])
+            epoch = np.concatenate([epoch, new_epoch])
+            dtime = np.concatenate([dtime, new_dtime])
+        if len(self._stale_times):
+            epoch = epoch.copy()
+            dtime = dtime.copy()
+            stale = sorted(self._stale_times)
+            epoch[stale], dtime[stale] = get_prime_origin_times(
+                [self.events[iloc] for iloc in stale])
+            self._stale_times = set()
+        self._prime_times = (list(self.events), epoch, dtime)
+        return epoch, dtime
+
+    def reset_prime_origin_times(self, locations=None):
+        """
+        Clears the cached prime origin times of the events at the given
+        locations (or of all events if None)
+        """
+        if locations is None:
+            self._prime_times = None
+        else:
+            self._stale_times.update(locations)
+
     def get_decimal_dates(self):
         """
         Returns dates and time as a vector of decimal dates
         """
-        neq = self.get_number_events()
-        year = np.zeros(neq, dtype=int)
-        month = np.zeros(neq, dtype=int)
-        day = np.zeros(neq, dtype=int)
-        hour = np.zeros(neq, dtype=int)
-        minute = np.zeros(neq, dtype=int)
-        second = np.zeros(neq, dtype=float)
-        for iloc, event in enumerate(self.events):
-            is_selected = False
-            for origin in event.origins:
-                if is_selected:
-                    continue
-                if origin.is_prime:
-                    year[iloc] = origin.date.year
-                    month[iloc] = origin.date.month
-                    day[iloc] = origin.date.day
-                    hour[iloc] = origin.time.hour
-                    minute[iloc] = origin.time.minute
-                    second[iloc] = float(origin.time.second) + \
-                        (float(origin.time.microsecond) / 1.0E6)
-                    is_selected = True
-            if not is_selected:
-                # No prime origins - take the first
-                year[iloc] = event.origins[0].date.year
-                month[iloc] = event.origins[0].date.month
-                day[iloc] = event.origins[0].date.day
-                hour[iloc] = event.origins[0].time.hour
-                minute[iloc] = event.origins[0].time.minute
-                second[iloc] = float(event.origins[0].time.second) + \
-                    (float(event.origins[0].time.microsecond) / 1.0E6)
-        return decimal_time(year, month, day, hour, minute, second)
-                    
+        return self.get_prime_origin_times()[1].copy()
+
+    def sort_by_time(self):
+        """
+        Sorts the events in ascending order of their prime origin time
+        """
+        epoch, dtime = self.get_prime_origin_times()
+        ascend_time = np.argsort(dtime)
+        self.events = [self.events[iloc] for iloc in ascend_time]
+        self._prime_times = (list(self.events), epoch[ascend_time],
+                             dtime[ascend_time])
 
     def render_to_simple_numpy_array(self):
         '''
@@ -596,93 +824,63 @@ class ISFCatalogue(object):
         containing only the origins, the second containing the
         magnitudes
         """
-        #Find out size of tables
-        n_origins = 0
-        n_mags = 0
-        for eq in self.events:
-            n_origins += len(eq.origins)
-            n_mags += len(eq.magnitudes)
-        # Pre-allocate data to zeros
-        origin_data = np.zeros((n_origins,), dtype=DATAMAP)
-        mag_data = np.zeros((n_mags,), dtype=MAGDATAMAP)
-        o_counter = 0
-        m_counter = 0
-        for eq in self.events:
-            for orig in eq.origins:
-                # Convert seconds fromd datetime to float
-                seconds = float(orig.time.second) +\
-                    float(orig.time.microsecond) / 1.0E6
-                # Optional defaults
-                if orig.time_error:
-                    time_error = orig.time_error
-                else:    
-                    time_error = 0.0
-                if orig.location.semimajor90:
-                    semimajor90 = orig.location.semimajor90
-                    semiminor90 = orig.location.semiminor90
-                    error_strike = orig.location.error_strike
-                else:
-                    semimajor90 = 0.0
-                    semiminor90 = 0.0
-                    error_strike = 0.0
-
-                if orig.location.depth_error:
-                    depth_error = orig.location.depth_error
-                else: 
-                    depth_error = 0.0
-                
-                if orig.location.depthSolution:
-                    depthSolution = orig.location.depthSolution
-                else: 
-                    depthSolution = ""               
-
-                
-                if orig.is_prime:
-                    prime = 1
-                else:
-                    prime = 0
-                origin_data[o_counter] = (eq.id, orig.id, orig.author,
-                    orig.date.year, orig.date.month, orig.date.day,
-                    orig.time.hour, orig.time.minute, seconds, time_error,
-                    orig.location.longitude, orig.location.latitude, 
-                    orig.location.depth, orig.location.depthSolution,
-                    semimajor90, semiminor90, 
-                    error_strike, depth_error, prime)
-                o_counter += 1
-
-            for mag in eq.magnitudes:
-                if mag.sigma:
-                    sigma = mag.sigma
-                else:
-                    sigma = 0.0
-                mag_data[m_counter] = (mag.event_id, mag.origin_id, 
-                    mag.magnitude_id, mag.value, sigma, mag.scale, mag.author)
-                m_counter += 1
-        return origin_data, mag_data
-    
-    
-    
-    def build_dataframe(self, hdf5_file=None):
+        return get_origin_mag_tables(self.events)
+
+    def iter_origin_mag_tables(self, chunk_size=100000):
+        """
+        Yields the ISF catalogue as pairs of origin and magnitude tables
+        (as returned by :meth: get_origin_mag_tables), each for a block of
+        chunk_size events
+        :param int chunk_size:
+            Number of events per block
+        """
+        for start in range(0, self.get_number_events(), chunk_size):
+            yield get_origin_mag_tables(
+                self.events[start:(start + chunk_size)])
+
+    def build_dataframe(self, hdf5_file=None, chunk_size=None,
+                        complib="blosc", complevel=5,
+                        data_columns=HDF5_DATA_COLUMNS):
         """
         Renders the catalogue into two Pandas Dataframe objects, one
         representing the full list of origins, the other the full list
         of magnitudes
         :param str hd5_file:
             Path to the hdf5 for writing
+        :param int chunk_size:
+            If given, the tables are streamed to the hdf5 file in blocks
+            of chunk_size events and are not returned
+        :param str complib:
+            Compression library of the hdf5 tables (see
+            :class: CatalogueHDF5Writer)
+        :param int complevel:
+            Compression level of the hdf5 tables
+        :param list data_columns:
+            Columns of the hdf5 tables to index for queries
         :returns:
-            orig_df - Origin dataframe
-            mag_df  - Magnitude dataframe
-        """
+            orig_df - Origin dataframe (or None if chunk_size is given)
+            mag_df  - Magnitude dataframe (or None if chunk_size is given)
+        """
+        if chunk_size:
+            if not hdf5_file:
+                raise ValueError("Chunked rendering requires an hdf5 file")
+            with CatalogueHDF5Writer(hdf5_file, complib=complib,
+                                     complevel=complevel,
+                                     data_columns=data_columns) as writer:
+                for origin_data, mag_data in self.iter_origin_mag_tables(
+                        chunk_size):
+                    writer.append(origin_data, mag_data)
+            return None, None
         origin_data, mag_data = self.get_origin_mag_tables()
         orig_df = pd.DataFrame(origin_data,
                                columns=[val[0] for val in DATAMAP])
         mag_df = pd.DataFrame(mag_data,
                               columns=[val[0] for val in MAGDATAMAP])
         if hdf5_file:
-            store = pd.HDFStore(hdf5_file)
-            store.append("catalogue/origins", orig_df)
-            store.append("catalogue/magnitudes", mag_df)
-            store.close()
+            with CatalogueHDF5Writer(hdf5_file, complib=complib,
+                                     complevel=complevel,
+                                     data_columns=data_columns) as writer:
+                writer.append(orig_df, mag_df)
         return orig_df, mag_df
 
     def render_to_xyzm(self, filename, frmt='%.3f'):
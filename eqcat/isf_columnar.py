@@ -0,0 +1,726 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+#!/usr/bin/env/python
+
+"""
+Columnar (struct-of-arrays) variant of the ISF catalogue. The events,
+origins and magnitudes are held as dictionaries of numpy arrays and are
+accessed through lightweight views that present the same interface as the
+isf_catalogue.Event, Origin, Location and Magnitude classes
+"""
+import datetime
+import numpy as np
+from eqcat.utils import decimal_time, epoch_time
+from eqcat.isf_catalogue import (Magnitude, Location, Origin, Event,
+                                 ISFCatalogue, DATAMAP, MAGDATAMAP,
+                                 get_magnitude_id)
+
+
+# Columns of the event, origin and magnitude tables as (name, dtype). Empty
+# (None) values of the float columns are held as nan, and of the string
+# columns as empty strings. String columns ("U") are sized to the data.
+EVENT_COLUMNS = [("eventID", "U"), ("description", "O"), ("comment", "O"),
+                 ("induced_flag", "U"), ("number_origins", "i8"),
+                 ("number_magnitudes", "i8")]
+
+ORIGIN_COLUMNS = [("originID", "U"), ("Agency", "U"), ("year", "i2"),
+                  ("month", "i1"), ("day", "i1"), ("hour", "i1"),
+                  ("minute", "i1"), ("second", "i1"), ("microsecond", "i4"),
+                  ("time_error", "f8"), ("time_rms", "f8"),
+                  ("longitude", "f8"), ("latitude", "f8"), ("depth", "f8"),
+                  ("depthSolution", "U"), ("semimajor90", "f8"),
+                  ("semiminor90", "f8"), ("error_strike", "f8"),
+                  ("depth_error", "f8"), ("is_prime", "?"),
+                  ("is_centroid", "?"), ("has_metadata", "?"),
+                  ("Nphases", "f4"), ("Nstations", "f4"),
+                  ("AzimuthGap", "f8"), ("minDist", "f8"), ("maxDist", "f8"),
+                  ("FixedTime", "U"), ("DepthSolution", "U"),
+                  ("AnalysisType", "U"), ("LocationMethod", "U"),
+                  ("EventType", "U")]
+
+MAGNITUDE_COLUMNS = [("originID", "U"), ("value", "f8"), ("sigma", "f8"),
+                     ("stations", "f4"), ("magType", "U"), ("magAgency", "U")]
+
+# Origin metadata keys and the types of their values
+METADATA_KEYS = [("Nphases", int), ("Nstations", int), ("AzimuthGap", float),
+                 ("minDist", float), ("maxDist", float), ("FixedTime", str),
+                 ("DepthSolution", str), ("AnalysisType", str),
+                 ("LocationMethod", str), ("EventType", str)]
+
+
+def _to_float_or_none(value):
+    """
+    Returns the value as a float, or None if it is nan
+    """
+    value = float(value)
+    if np.isnan(value):
+        return None
+    return value
+
+def _to_int_or_none(value):
+    """
+    Returns the value as an integer, or None if it is nan
+    """
+    if np.isnan(value):
+        return None
+    return int(value)
+
+def _to_object(value):
+    """
+    Returns the value unchanged
+    """
+    return value
+
+def build_table(columns, data):
+    """
+    Returns the table (as a dictionary of arrays) with the given columns
+    from a dictionary of sequences of values. Columns not found in the
+    data are returned empty
+    :param list columns:
+        Column definitions as list of (name, dtype) (e.g. ORIGIN_COLUMNS)
+    :param dict data:
+        Values of the columns
+    """
+    table = {}
+    for name, dtype in columns:
+        values = data.get(name, [])
+        if dtype == "U":
+            table[name] = np.asarray(values, dtype=str)
+        elif dtype == "O":
+            table[name] = np.empty(len(values), dtype=object)
+            table[name][:] = values
+        else:
+            table[name] = np.asarray(values, dtype=dtype)
+    return table
+
+def concatenate_tables(columns, tables):
+    """
+    Concatenates a list of tables with the given columns into a single table
+    """
+    if not len(tables):
+        return build_table(columns, {})
+    return dict([(name, np.concatenate([table[name] for table in tables]))
+                 for name, _ in columns])
+
+
+class _ColumnView(object):
+    """
+    Base class of the views of a row of one of the tables of a
+    ColumnarISFCatalogue. Attributes listed in _columns are read from, and
+    written to, the table. Any other attributes set on a view are held by
+    the catalogue so that they persist between views of the same row.
+    """
+    __slots__ = ("catalogue", "index")
+    _table = None
+    _columns = {}
+
+    def __init__(self, catalogue, index):
+        object.__setattr__(self, "catalogue", catalogue)
+        object.__setattr__(self, "index", index)
+
+    def __getattr__(self, name):
+        if name in _ColumnView.__slots__:
+            raise AttributeError(name)
+        if name in self._columns:
+            column, converter = self._columns[name]
+            return converter(
+                getattr(self.catalogue, self._table)[column][self.index])
+        attributes = self.catalogue.attributes.get(
+            (type(self).__name__, self.index))
+        if attributes and name in attributes:
+            return attributes[name]
+        raise AttributeError("%s has no attribute %s" %
+                             (type(self).__name__, name))
+
+    def __setattr__(self, name, value):
+        if name in self._columns:
+            self.catalogue.set_value(self._table, self._columns[name][0],
+                                     self.index, value)
+        elif hasattr(type(self), name):
+            raise AttributeError("Attribute %s of %s is read-only" %
+                                 (name, type(self).__name__))
+        else:
+            self.catalogue.attributes.setdefault(
+                (type(self).__name__, self.index), {})[name] = value
+
+
+class MagnitudeView(_ColumnView):
+    """
+    View of a magnitude of a ColumnarISFCatalogue, with the interface of
+    :class: eqcat.isf_catalogue.Magnitude
+    """
+    __slots__ = ()
+    _table = "magnitude_data"
+    _columns = {"origin_id": ("originID", str),
+                "value": ("value", float),
+                "author": ("magAgency", str),
+                "scale": ("magType", str),
+                "sigma": ("sigma", _to_float_or_none),
+                "stations": ("stations", _to_int_or_none)}
+
+    @property
+    def event_id(self):
+        return str(self.catalogue.event_data["eventID"][
+            self.catalogue.get_magnitude_event(self.index)])
+
+    @property
+    def magnitude_id(self):
+        return get_magnitude_id(self.origin_id, self.author, self.value,
+                                self.scale)
+
+    def to_magnitude(self):
+        """
+        Returns the magnitude as an instance of
+        :class: eqcat.isf_catalogue.Magnitude
+        """
+        return Magnitude(self.event_id, self.origin_id, self.value,
+                         self.author, scale=self.scale, sigma=self.sigma,
+                         stations=self.stations)
+
+    compare_magnitude = Magnitude.compare_magnitude
+    __repr__ = Magnitude.__repr__
+    __eq__ = Magnitude.__eq__
+
+
+class LocationView(_ColumnView):
+    """
+    View of the location of an origin of a ColumnarISFCatalogue, with the
+    interface of :class: eqcat.isf_catalogue.Location
+    """
+    __slots__ = ()
+    _table = "origin_data"
+    _columns = {"identifier": ("originID", str),
+                "longitude": ("longitude", float),
+                "latitude": ("latitude", float),
+                "depth": ("depth", _to_float_or_none),
+                "depthSolution": ("depthSolution", str),
+                "semimajor90": ("semimajor90", _to_float_or_none),
+                "semiminor90": ("semiminor90", _to_float_or_none),
+                "error_strike": ("error_strike", _to_float_or_none),
+                "depth_error": ("depth_error", _to_float_or_none)}
+
+    def to_location(self):
+        """
+        Returns the location as an instance of
+        :class: eqcat.isf_catalogue.Location
+        """
+        return Location(self.identifier, self.longitude, self.latitude,
+                        self.depth, self.depthSolution, self.semimajor90,
+                        self.semiminor90, self.error_strike, self.depth_error)
+
+    __str__ = Location.__str__
+    __eq__ = Location.__eq__
+
+
+class OriginView(_ColumnView):
+    """
+    View of an origin of a ColumnarISFCatalogue, with the interface of
+    :class: eqcat.isf_catalogue.Origin. The magnitudes of the origin are
+    those of the event with the same origin ID.
+    """
+    __slots__ = ()
+    _table = "origin_data"
+    _columns = {"id": ("originID", str),
+                "author": ("Agency", str),
+                "time_error": ("time_error", _to_float_or_none),
+                "time_rms": ("time_rms", _to_float_or_none),
+                "is_prime": ("is_prime", bool),
+                "is_centroid": ("is_centroid", bool)}
+
+    @property
+    def date(self):
+        data = self.catalogue.origin_data
+        return datetime.date(int(data["year"][self.index]),
+                             int(data["month"][self.index]),
+                             int(data["day"][self.index]))
+
+    @property
+    def time(self):
+        data = self.catalogue.origin_data
+        return datetime.time(int(data["hour"][self.index]),
+                             int(data["minute"][self.index]),
+                             int(data["second"][self.index]),
+                             int(data["microsecond"][self.index]))
+
+    @property
+    def date_time_str(self):
+        return "|".join([str(self.date).replace("-", "|"),
+                         str(self.time).replace(":", "|")])
+
+    @property
+    def location(self):
+        return LocationView(self.catalogue, self.index)
+
+    @property
+    def metadata(self):
+        data = self.catalogue.origin_data
+        if not data["has_metadata"][self.index]:
+            return None
+        metadata = {}
+        for key, dtype in METADATA_KEYS:
+            if dtype is int:
+                metadata[key] = _to_int_or_none(data[key][self.index])
+            elif dtype is float:
+                metadata[key] = _to_float_or_none(data[key][self.index])
+            else:
+                metadata[key] = str(data[key][self.index])
+        return metadata
+
+    @property
+    def magnitudes(self):
+        catalogue = self.catalogue
+        ievent = catalogue.get_origin_event(self.index)
+        start, stop = catalogue.magnitude_ptr[ievent:ievent + 2]
+        idx = np.where(catalogue.magnitude_data["originID"][start:stop] ==
+                       catalogue.origin_data["originID"][self.index])[0]
+        return tuple([MagnitudeView(catalogue, start + i)
+                      for i in idx.tolist()])
+
+    def to_origin(self, magnitudes=None):
+        """
+        Returns the origin as an instance of
+        :class: eqcat.isf_catalogue.Origin
+        :param list magnitudes:
+            Magnitudes (as :class: eqcat.isf_catalogue.Magnitude) to assign
+            to the origin. If not supplied these are built from the views
+        """
+        origin = Origin(self.id, self.date, self.time,
+                        self.location.to_location(), self.author,
+                        is_prime=self.is_prime, is_centroid=self.is_centroid,
+                        time_error=self.time_error, time_rms=self.time_rms,
+                        metadata=self.metadata)
+        if magnitudes is None:
+            magnitudes = [mag.to_magnitude() for mag in self.magnitudes]
+        origin.magnitudes = [mag for mag in magnitudes
+                             if mag.origin_id == origin.id]
+        return origin
+
+    get_number_magnitudes = Origin.get_number_magnitudes
+    get_magnitude_scales = Origin.get_magnitude_scales
+    get_magnitude_values = Origin.get_magnitude_values
+    get_magnitude_tuple = Origin.get_magnitude_tuple
+    __str__ = Origin.__str__
+    __eq__ = Origin.__eq__
+
+
+class EventView(_ColumnView):
+    """
+    View of an event of a ColumnarISFCatalogue, with the interface of
+    :class: eqcat.isf_catalogue.Event. The origins and magnitudes are
+    returned as tuples of views, so they cannot be modified in place.
+    """
+    __slots__ = ()
+    _table = "event_data"
+    _columns = {"id": ("eventID", str),
+                "description": ("description", _to_object),
+                "comment": ("comment", _to_object),
+                "induced_flag": ("induced_flag", str)}
+
+    @property
+    def origins(self):
+        start, stop = self.catalogue.origin_ptr[self.index:self.index + 2]
+        return tuple([OriginView(self.catalogue, i)
+                      for i in range(start, stop)])
+
+    @property
+    def magnitudes(self):
+        start, stop = self.catalogue.magnitude_ptr[self.index:self.index + 2]
+        return tuple([MagnitudeView(self.catalogue, i)
+                      for i in range(start, stop)])
+
+    def to_event(self):
+        """
+        Returns the event as an instance of
+        :class: eqcat.isf_catalogue.Event
+        """
+        magnitudes = [mag.to_magnitude() for mag in self.magnitudes]
+        origins = [orig.to_origin(magnitudes) for orig in self.origins]
+        event = Event(self.id, origins, magnitudes, self.description)
+        event.comment = self.comment
+        event.induced_flag = self.induced_flag
+        attributes = self.catalogue.attributes.get(("EventView", self.index))
+        if attributes:
+            for key, value in attributes.items():
+                setattr(event, key, value)
+        return event
+
+    number_origins = Event.number_origins
+    get_origin_id_list = Event.get_origin_id_list
+    get_author_list = Event.get_author_list
+    number_magnitudes = Event.number_magnitudes
+    magnitude_string = Event.magnitude_string
+    get_origin_mag_vals = Event.get_origin_mag_vals
+    __str__ = Event.__str__
+    __eq__ = Event.__eq__
+
+
+class _EventSequence(object):
+    """
+    Read-only sequence of the event views of a ColumnarISFCatalogue
+    """
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+
+    def __len__(self):
+        return self.catalogue.get_number_events()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [EventView(self.catalogue, i)
+                    for i in range(*key.indices(len(self)))]
+        key = int(key)
+        if key < 0:
+            key += len(self)
+        if (key < 0) or (key >= len(self)):
+            raise IndexError("Event index out of range")
+        return EventView(self.catalogue, key)
+
+    def __iter__(self):
+        for iloc in range(len(self)):
+            yield EventView(self.catalogue, iloc)
+
+
+class ColumnarISFCatalogue(ISFCatalogue):
+    """
+    Earthquake catalogue in ISF format held as columns (struct-of-arrays)
+    rather than as Event, Origin and Magnitude objects. The events,
+    origins and magnitudes are accessed as views (EventView, OriginView
+    and MagnitudeView) that read from the arrays on demand.
+
+    The catalogue cannot be merged into: use :meth: to_isf_catalogue for a
+    catalogue that can be modified.
+    :param dict event_data:
+        Event table (see EVENT_COLUMNS), with the origins and magnitudes of
+        each event stored consecutively in the origin and magnitude tables
+    :param dict origin_data:
+        Origin table (see ORIGIN_COLUMNS)
+    :param dict magnitude_data:
+        Magnitude table (see MAGNITUDE_COLUMNS)
+    """
+    def __init__(self, identifier, name, event_data=None, origin_data=None,
+                 magnitude_data=None):
+        """
+        Instantiate the catalogue with a name and identifier
+        """
+        self.id = identifier
+        self.name = name
+        self.event_data = event_data or build_table(EVENT_COLUMNS, {})
+        self.origin_data = origin_data or build_table(ORIGIN_COLUMNS, {})
+        self.magnitude_data = magnitude_data or\
+            build_table(MAGNITUDE_COLUMNS, {})
+        self.origin_ptr = np.concatenate(
+            [[0], np.cumsum(self.event_data["number_origins"])]).astype(int)
+        self.magnitude_ptr = np.concatenate(
+            [[0], np.cumsum(self.event_data["number_magnitudes"])]).astype(
+                int)
+        if (self.origin_ptr[-1] != len(self.origin_data["originID"])) or\
+                (self.magnitude_ptr[-1] !=
+                 len(self.magnitude_data["originID"])):
+            raise ValueError("Number of origins or magnitudes inconsistent "
+                             "with event table")
+        # Attributes set on the views that are not held in the tables
+        self.attributes = {}
+        # Index of event IDs to positions in the event table (built on the
+        # first lookup)
+        self.positions = None
+        # Cache of the prime origin times
+        self._prime_times = None
+
+    @classmethod
+    def from_catalogue(cls, catalogue):
+        """
+        Builds the columnar catalogue from an instance of
+        :class: eqcat.isf_catalogue.ISFCatalogue
+        """
+        events = dict([(name, []) for name, _ in EVENT_COLUMNS])
+        origins = dict([(name, []) for name, _ in ORIGIN_COLUMNS])
+        magnitudes = dict([(name, []) for name, _ in MAGNITUDE_COLUMNS])
+        for event in catalogue.events:
+            events["eventID"].append(event.id)
+            events["description"].append(event.description)
+            events["comment"].append(event.comment)
+            events["induced_flag"].append(event.induced_flag)
+            events["number_origins"].append(len(event.origins))
+            events["number_magnitudes"].append(len(event.magnitudes))
+            for orig in event.origins:
+                _append_origin(origins, orig)
+            for mag in event.magnitudes:
+                magnitudes["originID"].append(mag.origin_id)
+                magnitudes["value"].append(mag.value)
+                magnitudes["sigma"].append(_none_to_nan(mag.sigma))
+                magnitudes["stations"].append(_none_to_nan(mag.stations))
+                magnitudes["magType"].append(mag.scale)
+                magnitudes["magAgency"].append(mag.author)
+        return cls(catalogue.id, catalogue.name,
+                   build_table(EVENT_COLUMNS, events),
+                   build_table(ORIGIN_COLUMNS, origins),
+                   build_table(MAGNITUDE_COLUMNS, magnitudes))
+
+    def to_isf_catalogue(self):
+        """
+        Returns the catalogue as an instance of
+        :class: eqcat.isf_catalogue.ISFCatalogue
+        """
+        return ISFCatalogue(self.id, self.name,
+                            [event.to_event() for event in self.events])
+
+    @property
+    def events(self):
+        return _EventSequence(self)
+
+    @property
+    def ids(self):
+        """
+        List of event IDs
+        """
+        return self.get_event_key_list()
+
+    @ids.setter
+    def ids(self, ids):
+        """
+        Assigns the IDs to the events, in order
+        """
+        if len(ids) != self.get_number_events():
+            raise ValueError("Number of IDs (%d) does not match number of "
+                             "events (%d)" % (len(ids),
+                                              self.get_number_events()))
+        self.event_data["eventID"] = np.asarray(
+            [str(event_id) for event_id in ids], dtype=str)
+        self.positions = None
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def __getitem__(self, key):
+        """
+        Returns the event corresponding to the specific key
+        """
+        if self.positions is None:
+            self.positions = {}
+            for iloc, event_id in enumerate(self.get_event_key_list()):
+                self.positions.setdefault(event_id, iloc)
+        if not key in self.positions:
+            raise KeyError("Event %s not found" % key)
+        return EventView(self, self.positions[key])
+
+    def get_number_events(self):
+        """
+        Return number of events
+        """
+        return len(self.event_data["eventID"])
+
+    def get_number_origins(self):
+        """
+        Return number of origins
+        """
+        return len(self.origin_data["originID"])
+
+    def get_number_magnitudes(self):
+        """
+        Return number of magnitudes
+        """
+        return len(self.magnitude_data["originID"])
+
+    def get_event_key_list(self):
+        """
+        Returns list event IDs
+        """
+        return self.event_data["eventID"].tolist()
+
+    def get_origin_event(self, index):
+        """
+        Returns the location of the event of the origin at index
+        """
+        return np.searchsorted(self.origin_ptr, index, side="right") - 1
+
+    def get_magnitude_event(self, index):
+        """
+        Returns the location of the event of the magnitude at index
+        """
+        return np.searchsorted(self.magnitude_ptr, index, side="right") - 1
+
+    def set_value(self, table, column, index, value):
+        """
+        Sets the value of a column of one of the tables at index, widening
+        string columns if necessary
+        """
+        data = getattr(self, table)
+        values = data[column]
+        if values.dtype.kind == "U":
+            value = "" if value is None else str(value)
+            if len(value) > (values.dtype.itemsize // 4):
+                values = data[column] = values.astype(
+                    "U{:d}".format(len(value)))
+        elif (values.dtype.kind == "f") and (value is None):
+            value = np.nan
+        values[index] = value
+        if (table == "event_data") and (column == "eventID"):
+            self.positions = None
+        elif (table == "origin_data") and (column == "is_prime"):
+            self._prime_times = None
+
+    def merge_second_catalogue(self, catalogue):
+        """
+        Not supported - convert to an ISFCatalogue before merging
+        """
+        raise ValueError("Cannot merge into a columnar catalogue - use "
+                         "to_isf_catalogue() first")
+
+    def get_prime_origins(self):
+        """
+        Returns the location in the origin table of the prime origin of each
+        event, or of the first origin of events with no prime origin
+        """
+        if not self.get_number_events():
+            return np.array([], dtype=int)
+        if np.any(self.event_data["number_origins"] == 0):
+            raise ValueError("Catalogue contains events without origins")
+        n_origins = self.get_number_origins()
+        locations = np.where(self.origin_data["is_prime"],
+                             np.arange(n_origins), n_origins)
+        prime = np.minimum.reduceat(locations, self.origin_ptr[:-1])
+        return np.where(prime < n_origins, prime, self.origin_ptr[:-1])
+
+    def get_prime_origin_times(self):
+        """
+        Returns the time of the prime origin of each event (or of the first
+        origin if the event has no prime origin), both as seconds since
+        1970-01-01 and as decimal years. The times are computed from the
+        origin table on the first call and then cached.
+        :returns:
+            epoch - Times as seconds since 1970-01-01 (numpy.ndarray)
+            decimal_time - Times as decimal years (numpy.ndarray)
+        """
+        if self._prime_times is None:
+            idx = self.get_prime_origins()
+            data = self.origin_data
+            fields = [data[key][idx].astype(int)
+                      for key in ["year", "month", "day", "hour", "minute"]]
+            fields.append(data["second"][idx].astype(float) +
+                          (data["microsecond"][idx].astype(float) / 1.0E6))
+            self._prime_times = (epoch_time(*fields), decimal_time(*fields))
+        return self._prime_times
+
+    def reset_prime_origin_times(self, locations=None):
+        """
+        Clears the cached prime origin times
+        """
+        self._prime_times = None
+
+    def sort_by_time(self):
+        """
+        Not supported - convert to an ISFCatalogue before sorting
+        """
+        raise ValueError("Cannot reorder a columnar catalogue - use "
+                         "to_isf_catalogue() first")
+
+    def get_origin_mag_tables(self):
+        """
+        Returns the full ISF catalogue as a pair of tables, the first
+        containing only the origins, the second containing the
+        magnitudes
+        """
+        return self._get_event_tables(0, self.get_number_events())
+
+    def iter_origin_mag_tables(self, chunk_size=100000):
+        """
+        Yields the ISF catalogue as pairs of origin and magnitude tables
+        (as returned by :meth: get_origin_mag_tables), each for a block of
+        chunk_size events
+        :param int chunk_size:
+            Number of events per block
+        """
+        nevents = self.get_number_events()
+        for start in range(0, nevents, chunk_size):
+            yield self._get_event_tables(start,
+                                         min(start + chunk_size, nevents))
+
+    def _get_event_tables(self, start, stop):
+        """
+        Returns the origin and magnitude tables of the events from start to
+        stop
+        """
+        events = slice(start, stop)
+        idx = slice(self.origin_ptr[start], self.origin_ptr[stop])
+        data = self.origin_data
+        origin_data = np.zeros((idx.stop - idx.start,), dtype=DATAMAP)
+        origin_data["eventID"] = np.repeat(
+            self.event_data["eventID"][events],
+            self.event_data["number_origins"][events])
+        for key in ["originID", "Agency", "year", "month", "day", "hour",
+                    "minute", "longitude", "latitude", "depth",
+                    "depthSolution"]:
+            origin_data[key] = data[key][idx]
+        origin_data["second"] = data["second"][idx].astype(float) +\
+            data["microsecond"][idx].astype(float) / 1.0E6
+        origin_data["time_error"] = np.nan_to_num(data["time_error"][idx])
+        has_ellipse = np.nan_to_num(data["semimajor90"][idx]) != 0.0
+        for key in ["semimajor90", "semiminor90", "error_strike"]:
+            origin_data[key] = np.where(has_ellipse, data[key][idx], 0.0)
+        origin_data["depth_error"] = np.nan_to_num(data["depth_error"][idx])
+        origin_data["prime"] = data["is_prime"][idx]
+
+        idx = slice(self.magnitude_ptr[start], self.magnitude_ptr[stop])
+        data = self.magnitude_data
+        mag_data = np.zeros((idx.stop - idx.start,), dtype=MAGDATAMAP)
+        mag_data["eventID"] = np.repeat(
+            self.event_data["eventID"][events],
+            self.event_data["number_magnitudes"][events])
+        for key in ["originID", "value", "magType", "magAgency"]:
+            mag_data[key] = data[key][idx]
+        mag_data["sigma"] = np.nan_to_num(data["sigma"][idx])
+        mag_data["magnitudeID"] = [
+            get_magnitude_id(*args) for args in zip(
+                data["originID"][idx].tolist(),
+                data["magAgency"][idx].tolist(),
+                data["value"][idx].tolist(), data["magType"][idx].tolist())]
+        return origin_data, mag_data
+
+def _none_to_nan(value):
+    """
+    Returns nan for None values
+    """
+    if value is None:
+        return np.nan
+    return value
+
+def _append_origin(origins, orig):
+    """
+    Appends the attributes of an instance of :class: Origin to the lists of
+    the values of the origin columns
+    """
+    origins["originID"].append(orig.id)
+    origins["Agency"].append(orig.author)
+    for key in ["year", "month", "day"]:
+        origins[key].append(getattr(orig.date, key))
+    for key in ["hour", "minute", "second", "microsecond"]:
+        origins[key].append(getattr(orig.time, key))
+    origins["time_error"].append(_none_to_nan(orig.time_error))
+    origins["time_rms"].append(_none_to_nan(orig.time_rms))
+    for key in ["longitude", "latitude", "depth", "semimajor90",
+                "semiminor90", "error_strike", "depth_error"]:
+        origins[key].append(_none_to_nan(getattr(orig.location, key)))
+    origins["depthSolution"].append(orig.location.depthSolution or "")
+    origins["is_prime"].append(bool(orig.is_prime))
+    origins["is_centroid"].append(bool(orig.is_centroid))
+    origins["has_metadata"].append(orig.metadata is not None)
+    metadata = orig.metadata or {}
+    for key, dtype in METADATA_KEYS:
+        if dtype is str:
+            origins[key].append(metadata.get(key) or "")
+        else:
+            origins[key].append(_none_to_nan(metadata.get(key)))
@@ -16,7 +16,21 @@
 #!/usr/bin/env/python
 
 import abc
+import io
 import os
+import bz2
+import gzip
+try:
+    import lzma
+except ImportError:
+    # xz compression is unavailable in Python 2
+    lzma = None
+
+
+# Magic numbers of the supported compression formats
+COMPRESSION_MAGIC = [(b"\x1f\x8b", "gzip"),
+                     (b"BZh", "bz2"),
+                     (b"\xfd7zXZ\x00", "xz")]
 
 
 def with_metaclass(meta, *bases):
@@ -62,6 +76,42 @@ def _to_str(string):
     return string.strip(' ')
 
 
+def get_compression(filename):
+    """
+    Returns the compression format of the file ("gzip", "bz2" or "xz")
+    identified from its magic number, or None if the file is not compressed
+    """
+    with io.open(filename, "rb") as f:
+        header = f.read(6)
+    for magic, compression in COMPRESSION_MAGIC:
+        if header.startswith(magic):
+            return compression
+    return None
+
+
+def open_catalogue_file(filename, mode="rt"):
+    """
+    Opens a catalogue file for reading. Files compressed with gzip, bzip2
+    or xz are decompressed on the fly as they are read
+    :param str filename:
+        Path to catalogue file
+    :param str mode:
+        Mode in which to open the file ("rt" or "rb")
+    """
+    compression = get_compression(filename)
+    if compression == "gzip":
+        return gzip.open(filename, mode)
+    elif compression == "bz2":
+        return bz2.open(filename, mode)
+    elif compression == "xz":
+        if lzma is None:
+            raise IOError("xz compressed file %s requires the lzma module"
+                          % filename)
+        return lzma.open(filename, mode)
+    else:
+        return io.open(filename, mode)
+
+
 class BaseCatalogueDatabaseReader(with_metaclass(abc.ABCMeta)):
     """
     Abstract base class for reading an earthquake database file
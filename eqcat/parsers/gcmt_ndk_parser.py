@@ -22,8 +22,8 @@ import re
 import datetime
 import numpy as np
 from math import floor, fabs
-from linecache import getlines
 import eqcat.gcmt_utils as utils
+from eqcat.parsers.base import open_catalogue_file
 from eqcat.gcmt_catalogue import (GCMTHypocentre, GCMTCentroid, 
                                   GCMTPrincipalAxes, GCMTNodalPlanes,
                                   GCMTMomentTensor, GCMTEvent, GCMTCatalogue)
@@ -110,21 +110,20 @@ class ParseNDKtoGCMT(object):
 
     def read_file(self, start_year=None, end_year=None):
         '''
-        Reads the file
+        Reads the file (which may be compressed with gzip, bzip2 or xz)
         '''
-        raw_data = getlines(self.filename)
-        num_lines = len(raw_data)
-        if ((float(num_lines) / 5.) - float(num_lines // 5)) > 1E-9:
+        data_gcmts = []
+        raw_data = []
+        print('Parsing catalogue ...')
+        with open_catalogue_file(self.filename, 'rt') as f:
+            for row in f:
+                raw_data.append(row)
+                if len(raw_data) == 5:
+                    data_gcmts.append(self.read_ndk_event(raw_data, 0))
+                    raw_data = []
+        if len(raw_data):
             raise IOError('GCMT represented by 5 lines - number in file not'
                           ' a multiple of 5!')
-        number_gcmts = num_lines // 5
-        # Pre-allocates list
-        data_gcmts = [None for i in range(number_gcmts)]
-        id0 = 0
-        print('Parsing catalogue ...')
-        for iloc in range(number_gcmts):
-            data_gcmts[iloc] = self.read_ndk_event(raw_data, id0)
-            id0 += 5
         print('complete. Contains %s moment tensors' % len(data_gcmts))
         if not start_year:
             start_year = data_gcmts[0].centroid.date.year
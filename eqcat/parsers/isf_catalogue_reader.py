@@ -20,19 +20,35 @@ Reader for the catalogue in a reduced ISF Format considering only
 headers
 '''
 #import pdb
+import io
 import os
 import re
+import mmap
+import hashlib
+import multiprocessing
 import datetime
 import numpy as np
+import pandas as pd
 from io import open
 from math import floor, ceil, fabs
+from eqcat.utils import decimal_time
 from eqcat.parsers.base import (BaseCatalogueDatabaseReader,
+                                get_compression, open_catalogue_file,
                                 _to_int, _to_str, _to_float)
 from eqcat.isf_catalogue import (Magnitude,
                                  Location,
                                  Origin,
                                  Event,
-                                 ISFCatalogue)
+                                 ISFCatalogue,
+                                 DATAMAP,
+                                 MAGDATAMAP,
+                                 get_magnitude_id,
+                                 get_min_itemsize,
+                                 CatalogueHDF5Writer,
+                                 HDF5_DATA_COLUMNS)
+from eqcat.isf_columnar import (ColumnarISFCatalogue, EVENT_COLUMNS,
+                                ORIGIN_COLUMNS, MAGNITUDE_COLUMNS,
+                                build_table, concatenate_tables)
 
 
 origin_header = '   Date       Time        Err   RMS Latitude Longitude  '\
@@ -151,6 +167,355 @@ def get_event_magnitude(row, event_id,
                      scale=scale, sigma=sigma, stations=nstations) 
 
 
+# Fixed-width fields of the origin rows as (name, start, stop, type)
+ORIGIN_FIELDS = [
+    ("year", 0, 4, int), ("month", 5, 7, int), ("day", 8, 10, int),
+    ("hour", 11, 13, int), ("minute", 14, 16, int), ("second", 17, 22, float),
+    ("FixedTime", 22, 23, str), ("time_error", 24, 29, float),
+    ("time_rms", 30, 35, float), ("latitude", 36, 44, float),
+    ("longitude", 45, 54, float), ("semimajor90", 55, 60, float),
+    ("semiminor90", 61, 66, float), ("error_strike", 67, 70, float),
+    ("depth", 71, 75, float), ("depthSolution", 76, 78, str),
+    ("depth_error", 78, 82, float), ("Nphases", 83, 87, float),
+    ("Nstations", 88, 92, float), ("AzimuthGap", 93, 96, float),
+    ("minDist", 97, 103, float), ("maxDist", 104, 110, float),
+    ("DepthSolution", 54, 55, str),
+    ("AnalysisType", 111, 112, str), ("LocationMethod", 113, 114, str),
+    ("EventType", 115, 117, str), ("Agency", 118, 127, str),
+    ("originID", 128, 136, str)]
+
+# Fixed-width fields of the magnitude rows as (name, start, stop, type)
+MAGNITUDE_FIELDS = [
+    ("magType", 0, 5, str), ("value", 6, 10, float), ("sigma", 11, 14, float),
+    ("Nstations", 15, 19, float), ("magAgency", 20, 29, str),
+    ("originID", 30, 38, str)]
+
+
+def _decode_fixed_width(rows, width, fields, names=None):
+    """
+    Decodes a block of fixed-width rows into a dictionary of column arrays
+    by viewing the block as a two-dimensional array of bytes. Empty float
+    fields are returned as nan and string fields are stripped of whitespace
+    """
+    nrows = len(rows)
+    chars = np.frombuffer("".join(rows).encode("ascii", "replace"),
+                          dtype="S1").reshape(nrows, width)
+    columns = {}
+    for name, start, stop, dtype in fields:
+        if names and not name in names:
+            continue
+        field = np.ascontiguousarray(chars[:, start:stop]).view(
+            "S{:d}".format(stop - start))[:, 0]
+        if dtype is str:
+            columns[name] = np.char.strip(field).astype(str)
+        elif dtype is int:
+            columns[name] = field.astype(int)
+        else:
+            idx = np.logical_not(np.all(chars[:, start:stop] == b" ",
+                                        axis=1))
+            values = np.full(nrows, np.nan)
+            values[idx] = field[idx].astype(float)
+            columns[name] = values
+    return columns
+
+
+def decode_origin_rows(rows, names=None):
+    """
+    Decodes a block of ISF origin rows (each 136 characters long) in a
+    single pass
+    :param list rows:
+        Origin rows as strings
+    :param list names:
+        Names of the fields to decode (defaults to all of ORIGIN_FIELDS)
+    :returns:
+        Dictionary of column arrays keyed by the names in ORIGIN_FIELDS
+    """
+    return _decode_fixed_width(rows, 136, ORIGIN_FIELDS, names)
+
+
+def decode_magnitude_rows(rows, names=None):
+    """
+    Decodes a block of ISF magnitude rows (each 38 characters long) in a
+    single pass
+    :param list rows:
+        Magnitude rows as strings
+    :param list names:
+        Names of the fields to decode (defaults to all of MAGNITUDE_FIELDS)
+    :returns:
+        Dictionary of column arrays keyed by the names in MAGNITUDE_FIELDS
+    """
+    return _decode_fixed_width(rows, 38, MAGNITUDE_FIELDS, names)
+
+
+class _GrowableTable(object):
+    """
+    Preallocated structured array that grows (by doubling its capacity) as
+    rows are added
+    """
+    def __init__(self, dtype, capacity=1024):
+        self.data = np.zeros((capacity,), dtype=dtype)
+        self.size = 0
+
+    def extend(self, rows):
+        """
+        Appends a structured array (or a list of row tuples) to the table
+        """
+        nrows = len(rows)
+        if (self.size + nrows) > len(self.data):
+            capacity = max(2 * len(self.data), self.size + nrows)
+            data = np.zeros((capacity,), dtype=self.data.dtype)
+            data[:self.size] = self.data[:self.size]
+            self.data = data
+        self.data[self.size:(self.size + nrows)] = rows
+        self.size += nrows
+
+    def to_array(self):
+        """
+        Returns the filled part of the table
+        """
+        self.data.resize((self.size,), refcheck=False)
+        return self.data
+
+
+def _is_event_header(row):
+    """
+    Returns True if the row would be parsed as an event header row by the
+    ISFReader, False otherwise
+    """
+    if not row.startswith("Event"):
+        return False
+    for key in ["DATA_TYPE EVENT IMS1.0", "ISC Bulletin", "STOP",
+                "(#PRIME)", "(#CENTROID)"]:
+        if key in row:
+            return False
+    return True
+
+
+def get_event_boundaries(filename, nchunks):
+    """
+    Splits an ISF file into (at most) nchunks byte ranges, each of which
+    starts at an event header row (or the start of the file)
+    :param str filename:
+        Path to ISF file
+    :param int nchunks:
+        Target number of byte ranges
+    :returns:
+        Sorted list of byte offsets, beginning with 0 and ending with the
+        size of the file
+    """
+    size = os.path.getsize(filename)
+    boundaries = [0]
+    with open(filename, "rb") as f:
+        for i in range(1, nchunks):
+            position = max((i * size) // nchunks, boundaries[-1])
+            if position >= size:
+                break
+            # Move to the start of the next full row
+            f.seek(position)
+            if position > 0:
+                f.readline()
+            position = f.tell()
+            while position < size:
+                row = f.readline()
+                if _is_event_header(row.decode("latin-1")):
+                    break
+                position += len(row)
+            if position > boundaries[-1] and position < size:
+                boundaries.append(position)
+    boundaries.append(size)
+    return boundaries
+
+
+def _read_byte_range(args):
+    """
+    Parses the rows of the file between two byte offsets, returning the
+    accepted and rejected events. Used as the worker function for
+    :meth: ISFReader.read_file_parallel
+    """
+    reader, start, end = args
+    reader.rejected_catalogue = []
+    with open(reader.filename, "rb") as f:
+        f.seek(start)
+        raw = f.read(end - start)
+    rows = io.TextIOWrapper(io.BytesIO(raw))
+    events = list(reader._parse_rows(rows))
+    return events, reader.rejected_catalogue
+
+
+# Entries of the event index: byte range of the event block, decimal time
+# and location of the prime origin, and extent of all origins in the event.
+# Locations are kept in double precision so that the index selection agrees
+# exactly with the bounding box criteria of the reader
+EVENT_INDEX_DTYPE = [("eventID", "U20"), ("offset", "i8"), ("length", "i8"),
+    ("decimal_time", "f8"), ("longitude", "f8"), ("latitude", "f8"),
+    ("min_longitude", "f8"), ("max_longitude", "f8"),
+    ("min_latitude", "f8"), ("max_latitude", "f8")]
+
+
+def build_event_index(filename, index_file=None):
+    """
+    Memory-maps an ISF file and builds an index of its event blocks,
+    containing the byte offset and length, the event ID, the decimal time
+    and location of the prime origin (or the first origin if no prime is
+    indicated) and the extent of all of the origins of each event. The
+    index is stored in a sidecar file.
+    :param str filename:
+        Path to ISF file
+    :param str index_file:
+        Path to the index file (defaults to the ISF file with the suffix
+        ".idx.npy")
+    :returns:
+        Index as a structured array with the EVENT_INDEX_DTYPE dtype
+    """
+    if get_compression(filename):
+        raise ValueError("Cannot build event index of compressed file %s"
+                         % filename)
+    if not index_file:
+        index_file = filename + ".idx.npy"
+    offsets = []
+    event_ids = []
+    origin_rows = []
+    origin_event = []
+    prime = []
+    is_origin = False
+    position = 0
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for raw_row in iter(data.readline, b""):
+                row = raw_row.decode("latin-1").rstrip("\r\n")
+                if _is_event_header(row):
+                    offsets.append(position)
+                    event_ids.append(row.split()[1])
+                    is_origin = False
+                elif row == origin_header:
+                    is_origin = True
+                elif row == magnitude_header:
+                    is_origin = False
+                elif '(#PRIME)' in row:
+                    if len(origin_event) and\
+                            origin_event[-1] == (len(offsets) - 1):
+                        prime[-1] = True
+                elif is_origin and len(row) == 136 and len(offsets):
+                    origin_rows.append(row)
+                    origin_event.append(len(offsets) - 1)
+                    prime.append(False)
+                position += len(raw_row)
+        finally:
+            data.close()
+    nevents = len(offsets)
+    index = np.zeros((nevents,), dtype=EVENT_INDEX_DTYPE)
+    index["eventID"] = event_ids
+    index["offset"] = offsets
+    index["length"] = np.diff(np.hstack([offsets, position]))
+    for key in ["decimal_time", "longitude", "latitude", "min_longitude",
+                "max_longitude", "min_latitude", "max_latitude"]:
+        index[key] = np.nan
+    if len(origin_rows):
+        origins = decode_origin_rows(origin_rows, ["year", "month", "day",
+                                                   "hour", "minute", "second",
+                                                   "longitude", "latitude"])
+        origin_event = np.array(origin_event)
+        prime = np.array(prime)
+        dtime = decimal_time(origins["year"], origins["month"],
+                             origins["day"], origins["hour"],
+                             origins["minute"], origins["second"])
+        # Select the first prime origin of each event, else the first origin
+        locations = np.arange(len(origin_event))
+        selected = np.full(nevents, -1, dtype=int)
+        selected[origin_event[::-1]] = locations[::-1]
+        first_prime = np.full(nevents, -1, dtype=int)
+        first_prime[origin_event[prime][::-1]] = locations[prime][::-1]
+        selected = np.where(first_prime >= 0, first_prime, selected)
+        idx = selected >= 0
+        index["decimal_time"][idx] = dtime[selected[idx]]
+        index["longitude"][idx] = origins["longitude"][selected[idx]]
+        index["latitude"][idx] = origins["latitude"][selected[idx]]
+        # Origins are sorted by event, so extents are reduced per group
+        starts = np.searchsorted(origin_event, np.arange(nevents))[idx]
+        for key in ["longitude", "latitude"]:
+            index["min_" + key][idx] = np.minimum.reduceat(origins[key],
+                                                           starts)
+            index["max_" + key][idx] = np.maximum.reduceat(origins[key],
+                                                           starts)
+    np.save(index_file, index)
+    return index
+
+
+def get_event_index(filename, index_file=None, rebuild=False):
+    """
+    Returns the event index of an ISF file, loading it from the sidecar
+    file if this exists, is newer than the ISF file and has the current
+    EVENT_INDEX_DTYPE, or building it otherwise
+    """
+    if not index_file:
+        index_file = filename + ".idx.npy"
+    if not rebuild and os.path.exists(index_file) and\
+            os.path.getmtime(index_file) >= os.path.getmtime(filename):
+        index = np.load(index_file)
+        if index.dtype == np.dtype(EVENT_INDEX_DTYPE):
+            return index
+    return build_event_index(filename, index_file)
+
+
+def _iter_byte_ranges(filename, index, selected):
+    """
+    Memory-maps the file and yields the rows of the selected events of the
+    event index, merging consecutive events into contiguous byte ranges
+    """
+    if not len(selected):
+        return
+    breaks = np.where(np.diff(selected) > 1)[0] + 1
+    starts = selected[np.hstack([0, breaks])]
+    stops = selected[np.hstack([breaks - 1, len(selected) - 1])]
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for start, stop in zip(starts, stops):
+                offset = index["offset"][start]
+                end = index["offset"][stop] + index["length"][stop]
+                yield io.TextIOWrapper(io.BytesIO(data[offset:end]))
+        finally:
+            data.close()
+
+
+# Columns of the "catalogue/events" table of the checksums of the ingested
+# events (see :meth: ISFReader.ingest_to_hdf5)
+CHECKSUM_DATAMAP = [("eventID", "U20"), ("checksum", "U32")]
+
+
+def get_event_checksums(filename, index):
+    """
+    Returns the list of md5 checksums of the block of each event in the
+    event index
+    """
+    checksums = []
+    with open(filename, "rb") as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            for offset, length in zip(index["offset"].tolist(),
+                                      index["length"].tolist()):
+                # Ignore trailing blank rows and the footer of the last event
+                block = data[offset:(offset + length)].rstrip()
+                if block.endswith(b"STOP"):
+                    block = block[:-4].rstrip()
+                checksums.append(hashlib.md5(block).hexdigest())
+        finally:
+            data.close()
+    return checksums
+
+
+def _select_event_ids(store, key):
+    """
+    Returns the event IDs of all the rows of a table in an hdf5 store
+    """
+    try:
+        return store.select_column(key, "eventID").values
+    except KeyError:
+        # eventID is not a data column of the table
+        return store.select(key, columns=["eventID"])["eventID"].values
+
+
 class ISFReader(BaseCatalogueDatabaseReader):
     '''
     Class to read an ISF formatted earthquake catalogue considering only
@@ -199,12 +564,581 @@ class ISFReader(BaseCatalogueDatabaseReader):
         Reads the catalogue from the file and assigns the identifier and name
         """
         self.catalogue = ISFCatalogue(identifier, name)
-        f = open(self.filename, 'rt')
-        counter = 0
+        for event in self.iter_events():
+            self.catalogue.events.append(event)
+        if len(self.rejected_catalogue):
+            # Turn list of rejected events into its own instance of
+            # ISFCatalogue
+            self.rejected_catalogue = ISFCatalogue(
+                identifier + "-R",
+                name + " - Rejected",
+                events=self.rejected_catalogue)
+        return self.catalogue
+
+    def read_file_columnar(self, identifier, name, batch_size=10000,
+                           collect_rejected=True):
+        """
+        Reads the catalogue from the file into an instance of
+        :class: eqcat.isf_columnar.ColumnarISFCatalogue, decoding the rows
+        in batches of events without building the intermediate Event,
+        Origin and Magnitude objects. The same selection criteria as
+        :meth: read_file are applied.
+        :param int batch_size:
+            Number of events to decode at once
+        :param bool collect_rejected:
+            Build the events rejected on keyword criteria into the rejected
+            catalogue (the only events for which objects are built)
+        """
+        tables = ([], [], [])
+        blocks = []
+        with open_catalogue_file(self.filename, 'rt') as f:
+            for block in self._iter_event_blocks(f):
+                if not len(block[1]) or not len(block[2]):
+                    continue
+                blocks.append(block)
+                if len(blocks) >= batch_size:
+                    for table, data in zip(tables, self._get_block_columns(
+                            blocks, collect_rejected)):
+                        table.append(data)
+                    blocks = []
+        if len(blocks):
+            for table, data in zip(tables, self._get_block_columns(
+                    blocks, collect_rejected)):
+                table.append(data)
+        self.catalogue = ColumnarISFCatalogue(
+            identifier, name,
+            concatenate_tables(EVENT_COLUMNS, tables[0]),
+            concatenate_tables(ORIGIN_COLUMNS, tables[1]),
+            concatenate_tables(MAGNITUDE_COLUMNS, tables[2]))
+        if len(self.rejected_catalogue):
+            self.rejected_catalogue = ISFCatalogue(
+                identifier + "-R",
+                name + " - Rejected",
+                events=self.rejected_catalogue)
+        return self.catalogue
+
+    def read_file_parallel(self, identifier, name, processes=None,
+                           chunks=None):
+        """
+        Reads the catalogue from the file using a pool of processes. The
+        file is split into byte ranges at event header boundaries, each
+        range is parsed independently and the resulting events are merged
+        in file order, giving the same catalogue (and rejected catalogue)
+        as :meth: read_file. Compressed files cannot be split into byte
+        ranges and are read serially with :meth: read_file
+        :param int processes:
+            Number of worker processes (defaults to the number of CPUs)
+        :param int chunks:
+            Number of byte ranges to split the file into (defaults to four
+            times the number of processes)
+        """
+        if get_compression(self.filename):
+            return self.read_file(identifier, name)
+        if not processes:
+            processes = multiprocessing.cpu_count()
+        if not chunks:
+            chunks = 4 * processes
+        boundaries = get_event_boundaries(self.filename, chunks)
+        tasks = [(self, boundaries[i], boundaries[i + 1])
+                 for i in range(len(boundaries) - 1)]
+        self.catalogue = ISFCatalogue(identifier, name)
+        rejected = []
+        pool = multiprocessing.Pool(processes)
+        try:
+            for events, rejected_events in pool.imap(_read_byte_range,
+                                                     tasks):
+                self.catalogue.events.extend(events)
+                rejected.extend(rejected_events)
+        finally:
+            pool.close()
+            pool.join()
+        self.rejected_catalogue.extend(rejected)
+        if len(self.rejected_catalogue):
+            self.rejected_catalogue = ISFCatalogue(
+                identifier + "-R",
+                name + " - Rejected",
+                events=self.rejected_catalogue)
+        return self.catalogue
+
+    def read_file_from_index(self, identifier, name, index=None,
+                             start_year=None, end_year=None):
+        """
+        Reads only those events whose entries in the event index pass the
+        time and bounding box criteria, parsing their blocks directly from
+        the memory-mapped file. The full set of selection criteria is then
+        applied to the parsed events, as for :meth: read_file
+        :param index:
+            Event index (as returned by :func: get_event_index). If not
+            supplied it is loaded from, or built into, the sidecar file
+        :param float start_year:
+            Earliest decimal time of the prime origin
+        :param float end_year:
+            Latest decimal time of the prime origin
+        """
+        if index is None:
+            index = get_event_index(self.filename)
+        idx = (index["max_longitude"] >= self.lower_long) &\
+            (index["min_longitude"] <= self.upper_long) &\
+            (index["max_latitude"] >= self.lower_lat) &\
+            (index["min_latitude"] <= self.upper_lat)
+        if start_year is not None:
+            idx &= index["decimal_time"] >= start_year
+        if end_year is not None:
+            idx &= index["decimal_time"] <= end_year
+        selected = np.where(idx)[0]
+        self.catalogue = ISFCatalogue(identifier, name)
+        for rows in _iter_byte_ranges(self.filename, index, selected):
+            self.catalogue.events.extend(self._parse_rows(rows))
+        if len(self.rejected_catalogue):
+            self.rejected_catalogue = ISFCatalogue(
+                identifier + "-R",
+                name + " - Rejected",
+                events=self.rejected_catalogue)
+        return self.catalogue
+
+    def iter_events(self):
+        """
+        Parses the file line by line and yields each event (as an instance
+        of :class: eqcat.isf_catalogue.Event) as soon as its block is
+        complete, so that the full catalogue is never held in memory. The
+        same agency, bounding box, magnitude and keyword criteria as
+        :meth: read_file are applied. Events rejected on keyword criteria
+        are not yielded but are appended to the rejected_catalogue list
+        """
+        with open_catalogue_file(self.filename, 'rt') as f:
+            for event in self._parse_rows(f):
+                yield event
+
+    def read_tables(self, as_dataframe=False, batch_size=10000):
+        """
+        Reads the file directly into the origin and magnitude tables (as
+        structured arrays with the eqcat.isf_catalogue.DATAMAP and
+        eqcat.isf_catalogue.MAGDATAMAP dtypes), without building the
+        intermediate Event, Origin and Magnitude objects. Rows are decoded
+        in batches of events using :func: decode_origin_rows and
+        :func: decode_magnitude_rows. The same selection criteria as
+        :meth: read_file are applied; events rejected on keyword criteria
+        are omitted from the tables.
+        :param bool as_dataframe:
+            Return the tables as pandas DataFrames (True) or as numpy
+            structured arrays (False)
+        :param int batch_size:
+            Number of events to decode at once
+        :returns:
+            origin_data - Origin table
+            mag_data - Magnitude table
+        """
+        with open_catalogue_file(self.filename, 'rt') as f:
+            origin_data, mag_data = self._get_tables([f], batch_size)
+        if as_dataframe:
+            origin_data = pd.DataFrame(origin_data,
+                                       columns=[val[0] for val in DATAMAP])
+            mag_data = pd.DataFrame(mag_data,
+                                    columns=[val[0] for val in MAGDATAMAP])
+        return origin_data, mag_data
+
+    def ingest_to_hdf5(self, hdf5_file, index=None, complib="blosc",
+                       complevel=5, data_columns=HDF5_DATA_COLUMNS):
+        """
+        Incrementally updates an hdf5 catalogue store (as written by
+        :meth: eqcat.isf_catalogue.ISFCatalogue.build_dataframe) from the
+        file. Only those events that are not already in the store, or whose
+        block in the file has changed since the previous ingest, are
+        parsed; the rows of changed events are replaced and those of new
+        events are appended. A checksum of the block of every event in the
+        store is kept in the "catalogue/events" table to identify changes;
+        only the rows of the new and changed events are written to it.
+        Events rejected by the selection criteria are not recorded, so they
+        are parsed again on the next ingest (e.g. with different criteria).
+        For stores without this table (i.e. not previously built by
+        ingest) only new events can be identified. The rows are written with
+        :class: eqcat.isf_catalogue.CatalogueHDF5Writer, so the tables have
+        the same layout as those of build_dataframe.
+        :param str hdf5_file:
+            Path to the hdf5 store (created if it does not exist)
+        :param index:
+            Event index (as returned by :func: get_event_index). If not
+            supplied it is loaded from, or built into, the sidecar file
+        :param str complib:
+            Compression library of new tables (see
+            :class: eqcat.isf_catalogue.CatalogueHDF5Writer)
+        :param int complevel:
+            Compression level of new tables
+        :param list data_columns:
+            Columns of new tables to index for queries
+        :returns:
+            Number of new events and number of changed events in the file
+        """
+        if index is None:
+            index = get_event_index(self.filename)
+        checksums = get_event_checksums(self.filename, index)
+        store = pd.HDFStore(hdf5_file)
+        try:
+            keys = store.keys()
+            has_checksums = "/catalogue/events" in keys
+            # Checksum rows can be replaced in tables indexed by event ID
+            # (older tables are rewritten once)
+            update_checksums = has_checksums and ("eventID" in
+                store.get_storer("catalogue/events").data_columns)
+            if has_checksums:
+                events = store.select("catalogue/events")
+                stored = dict(zip(events["eventID"].values,
+                                  events["checksum"].values))
+            elif "/catalogue/origins" in keys:
+                # Checksums unknown - consider only new events
+                stored = dict.fromkeys(
+                    _select_event_ids(store, "catalogue/origins"), "")
+            else:
+                stored = {}
+            is_new = np.zeros(len(index), dtype=bool)
+            is_changed = np.zeros(len(index), dtype=bool)
+            # Checksums to record, including those of events already in a
+            # store without checksums
+            updates = {}
+            for iloc, (event_id, checksum) in enumerate(
+                    zip(index["eventID"].tolist(), checksums)):
+                if not event_id in stored:
+                    is_new[iloc] = True
+                elif stored[event_id] and (stored[event_id] != checksum):
+                    is_changed[iloc] = True
+                elif not stored[event_id]:
+                    updates[event_id] = checksum
+            changed_ids = index["eventID"][is_changed]
+            if len(changed_ids):
+                # Remove the current rows of the changed events
+                for key in ["catalogue/origins", "catalogue/magnitudes"]:
+                    if not ("/" + key) in keys:
+                        continue
+                    coords = np.where(np.isin(_select_event_ids(store, key),
+                                             changed_ids))[0]
+                    if len(coords):
+                        store.remove(key, where=coords)
+        finally:
+            store.close()
+        selected = np.where(is_new | is_changed)[0]
+        origin_data, mag_data = self._get_tables(
+            _iter_byte_ranges(self.filename, index, selected))
+        # Record the checksums of the parsed events that were written, and
+        # forget those of the changed events that are now rejected
+        written = set(origin_data["eventID"].tolist())
+        removed = []
+        for iloc in selected.tolist():
+            event_id = index["eventID"][iloc]
+            if event_id in written:
+                updates[event_id] = checksums[iloc]
+            elif is_changed[iloc]:
+                removed.append(event_id)
+        if not update_checksums:
+            # Record all of the events of the store
+            stored.update(updates)
+            for event_id in removed:
+                del stored[event_id]
+            updates = stored
+        with CatalogueHDF5Writer(hdf5_file, complib=complib,
+                                 complevel=complevel,
+                                 data_columns=data_columns) as writer:
+            writer.append(origin_data, mag_data)
+            if has_checksums and not update_checksums:
+                writer.store.remove("catalogue/events")
+            elif update_checksums and (len(updates) or len(removed)):
+                # Replace the rows of the changed events
+                coords = np.where(np.isin(
+                    _select_event_ids(writer.store, "catalogue/events"),
+                    list(updates) + removed))[0]
+                if len(coords):
+                    writer.store.remove("catalogue/events", where=coords)
+            if len(updates):
+                writer.store.append(
+                    "catalogue/events",
+                    pd.DataFrame({"eventID": list(updates.keys()),
+                                  "checksum": list(updates.values())}),
+                    data_columns=["eventID"],
+                    min_itemsize=get_min_itemsize(CHECKSUM_DATAMAP),
+                    index=False)
+        return np.sum(is_new), np.sum(is_changed)
+
+    def _get_tables(self, sources, batch_size=10000):
+        """
+        Parses the event blocks from an iterable of sources of rows into the
+        origin and magnitude tables, decoding batch_size events at once
+        """
+        origin_table = _GrowableTable(DATAMAP)
+        mag_table = _GrowableTable(MAGDATAMAP)
+        blocks = []
+        for rows in sources:
+            for block in self._iter_event_blocks(rows):
+                if not len(block[1]) or not len(block[2]):
+                    continue
+                blocks.append(block)
+                if len(blocks) >= batch_size:
+                    origin_data, mag_data = self._get_block_tables(blocks)
+                    origin_table.extend(origin_data)
+                    mag_table.extend(mag_data)
+                    blocks = []
+        if len(blocks):
+            origin_data, mag_data = self._get_block_tables(blocks)
+            origin_table.extend(origin_data)
+            mag_table.extend(mag_data)
+        return origin_table.to_array(), mag_table.to_array()
+
+    def _decode_blocks(self, blocks, origin_names=None,
+                       magnitude_names=None):
+        """
+        Decodes the origin and magnitude rows of a list of event blocks
+        (each with at least one origin and one magnitude), returning the
+        event IDs, the acceptance of each event on the magnitude and
+        location criteria, the origin columns, the event of each origin,
+        the magnitude columns and the event of each magnitude
+        """
+        nevents = len(blocks)
+        event_ids = np.array([block[0].split()[1] for block in blocks])
+        origin_event = np.repeat(np.arange(nevents),
+                                 [len(block[1]) for block in blocks])
+        mag_event = np.repeat(np.arange(nevents),
+                              [len(block[2]) for block in blocks])
+        origins = decode_origin_rows([row for block in blocks
+                                      for row, _, _ in block[1]],
+                                     origin_names)
+        mags = decode_magnitude_rows([row for block in blocks
+                                      for row in block[2]],
+                                     magnitude_names)
+        # Magnitude and location acceptance - based on an "any" criterion
+        valid = (mags["value"] >= self.lower_mag) &\
+            (mags["value"] <= self.upper_mag)
+        accept = np.bincount(mag_event[valid], minlength=nevents) > 0
+        valid = (origins["longitude"] >= self.lower_long) &\
+            (origins["longitude"] <= self.upper_long) &\
+            (origins["latitude"] >= self.lower_lat) &\
+            (origins["latitude"] <= self.upper_lat)
+        accept &= np.bincount(origin_event[valid], minlength=nevents) > 0
+        return event_ids, accept, origins, origin_event, mags, mag_event
+
+    def _get_block_columns(self, blocks, collect_rejected=True):
+        """
+        Decodes a list of event blocks (each with at least one origin and
+        one magnitude) and returns the event, origin and magnitude tables
+        of the accepted events for a
+        :class: eqcat.isf_columnar.ColumnarISFCatalogue. Events rejected
+        on keyword criteria are added to the rejected catalogue if
+        collect_rejected is True.
+        """
+        event_ids, accept, origins, origin_event, mags, mag_event =\
+            self._decode_blocks(blocks)
+        if len(self.rejection_keywords):
+            for iloc, block in enumerate(blocks):
+                if accept[iloc] and self._get_rejection_keyword(block[3]):
+                    accept[iloc] = False
+                    if collect_rejected:
+                        self.rejected_catalogue.append(
+                            self._get_rejected_event(block))
+        # Events
+        idx = np.where(accept)[0]
+        comments = [blocks[iloc][3] for iloc in idx]
+        events = {
+            "eventID": event_ids[idx],
+            "description": [" ".join(blocks[iloc][0].split()[2:])
+                            for iloc in idx],
+            "comment": comments if self.store_comments else
+                       [""] * len(idx),
+            "induced_flag": [self._get_induced_flag(comment) or ""
+                             for comment in comments],
+            "number_origins": np.bincount(origin_event,
+                                          minlength=len(blocks))[idx],
+            "number_magnitudes": np.bincount(mag_event,
+                                             minlength=len(blocks))[idx]}
+        # Origins
+        idx = accept[origin_event]
+        data = dict([(name, origins[name][idx])
+                     for name, _ in ORIGIN_COLUMNS if name in origins])
+        data["originID"] = origins["originID"][idx]
+        # Seconds are truncated to microseconds as for datetime.time
+        seconds = np.floor(origins["second"][idx])
+        data["second"] = seconds
+        data["microsecond"] = (
+            (origins["second"][idx] - seconds) * 1000000.).astype(int)
+        data["is_prime"] = np.array([is_prime for block in blocks
+                                     for _, is_prime, _ in block[1]],
+                                    dtype=bool)[idx]
+        data["is_centroid"] = np.array([is_centroid for block in blocks
+                                        for _, _, is_centroid in block[1]],
+                                       dtype=bool)[idx]
+        data["has_metadata"] = np.ones(np.sum(idx), dtype=bool)
+        # Magnitudes
+        idx = accept[mag_event]
+        magnitudes = {"originID": mags["originID"][idx],
+                      "value": mags["value"][idx],
+                      "sigma": mags["sigma"][idx],
+                      "stations": mags["Nstations"][idx],
+                      "magType": np.where(mags["magType"][idx] == "", "UK",
+                                          mags["magType"][idx]),
+                      "magAgency": mags["magAgency"][idx]}
+        return build_table(EVENT_COLUMNS, events),\
+            build_table(ORIGIN_COLUMNS, data),\
+            build_table(MAGNITUDE_COLUMNS, magnitudes)
+
+    def _get_block_tables(self, blocks):
+        """
+        Decodes a list of event blocks (each with at least one origin and
+        one magnitude) and returns the origin and magnitude tables of the
+        accepted events
+        """
+        event_ids, accept, origins, origin_event, mags, mag_event =\
+            self._decode_blocks(blocks, [val[0] for val in DATAMAP],
+                                ["magType", "value", "sigma", "magAgency",
+                                 "originID"])
+        for iloc, block in enumerate(blocks):
+            if accept[iloc] and self._get_rejection_keyword(block[3]):
+                accept[iloc] = False
+        # Origins
+        idx = accept[origin_event]
+        origin_data = np.zeros((np.sum(idx),), dtype=DATAMAP)
+        origin_data["eventID"] = event_ids[origin_event[idx]]
+        for key in ["originID", "Agency", "year", "month", "day", "hour",
+                    "minute", "longitude", "latitude", "depth",
+                    "depthSolution"]:
+            origin_data[key] = origins[key][idx]
+        # Seconds are truncated to microseconds as for datetime.time
+        seconds = np.floor(origins["second"][idx])
+        origin_data["second"] = seconds + np.trunc(
+            (origins["second"][idx] - seconds) * 1000000.) / 1.0E6
+        origin_data["time_error"] = np.nan_to_num(origins["time_error"][idx])
+        has_ellipse = np.nan_to_num(origins["semimajor90"][idx]) != 0.0
+        for key in ["semimajor90", "semiminor90", "error_strike"]:
+            origin_data[key] = np.where(has_ellipse, origins[key][idx], 0.0)
+        origin_data["depth_error"] =\
+            np.nan_to_num(origins["depth_error"][idx])
+        origin_data["prime"] = np.array([is_prime for block in blocks
+                                         for _, is_prime, _ in block[1]],
+                                        dtype=bool)[idx]
+        # Magnitudes
+        idx = accept[mag_event]
+        mag_data = np.zeros((np.sum(idx),), dtype=MAGDATAMAP)
+        mag_data["eventID"] = event_ids[mag_event[idx]]
+        mag_data["originID"] = mags["originID"][idx]
+        mag_data["value"] = mags["value"][idx]
+        mag_data["sigma"] = np.nan_to_num(mags["sigma"][idx])
+        mag_data["magAgency"] = mags["magAgency"][idx]
+        scale = np.where(mags["magType"][idx] == "", "UK",
+                         mags["magType"][idx])
+        mag_data["magType"] = scale
+        mag_data["magnitudeID"] = [
+            get_magnitude_id(*args) for args in zip(
+                mags["originID"][idx].tolist(),
+                mags["magAgency"][idx].tolist(),
+                mags["value"][idx].tolist(),
+                scale.tolist())]
+        return origin_data, mag_data
+
+    def _parse_rows(self, rows):
+        """
+        Parses an iterable of ISF rows, yielding the accepted events
+        """
+        block_filter = self._get_block_filter()
+        for block in self._iter_event_blocks(rows):
+            if not len(block[1]) or not len(block[2]):
+                continue
+            if block_filter and not block_filter(block[1], block[2]):
+                # Event would be rejected - skip before building objects
+                continue
+            event = self._parse_block(block)
+            if event:
+                yield event
+
+    def _parse_block(self, block):
+        """
+        Builds the event from an event block, returning the event if it is
+        accepted or None otherwise
+        """
+        event, origins, magnitudes = self._get_block_objects(block)
+        return self._build_event(event, origins, magnitudes, block[3])
+
+    def _get_block_objects(self, block):
+        """
+        Returns the event, the list of origins and the list of magnitudes
+        of an event block
+        """
+        header, origin_rows, magnitude_rows, comment_str = block
+        event = get_event_header_row(header)
+        origins = []
+        for row, is_prime, is_centroid in origin_rows:
+            orig = get_event_origin_row(row)
+            orig.is_prime = is_prime
+            orig.is_centroid = is_centroid
+            origins.append(orig)
+        magnitudes = [get_event_magnitude(row, event.id)
+                      for row in magnitude_rows]
+        return event, origins, magnitudes
+
+    def _get_rejected_event(self, block):
+        """
+        Builds the event of a block already found to be rejected on keyword
+        criteria, as it would be added to the rejected catalogue by
+        :meth: _acceptance
+        """
+        event, origins, magnitudes = self._get_block_objects(block)
+        event.origins = origins
+        event.magnitudes = magnitudes
+        event.assign_magnitudes_to_origins()
+        event.comment = block[3]
+        induced_flag = self._get_induced_flag(block[3])
+        if induced_flag:
+            event.induced_flag = induced_flag
+        return event
+
+    def _get_block_filter(self):
+        """
+        Compiles the magnitude range and bounding box criteria into a single
+        predicate on the raw origin and magnitude rows of an event block,
+        so that events that will be rejected can be skipped before any
+        objects are built. Returns None if neither criterion is set.
+        """
+        lower_mag, upper_mag = self.lower_mag, self.upper_mag
+        lower_long, upper_long = self.lower_long, self.upper_long
+        lower_lat, upper_lat = self.lower_lat, self.upper_lat
+        check_magnitude = not (np.isinf(lower_mag) and np.isinf(upper_mag))
+        check_location = (lower_long, lower_lat, upper_long, upper_lat) !=\
+            (-180.0, -90.0, 180.0, 90.0)
+        if not check_magnitude and not check_location:
+            return None
+
+        def block_filter(origin_rows, magnitude_rows):
+            if check_magnitude:
+                for row in magnitude_rows:
+                    value = row[6:10].strip(' ')
+                    if value and (lower_mag <= float(value) <= upper_mag):
+                        break
+                else:
+                    return False
+            if check_location:
+                for row, _, _ in origin_rows:
+                    longitude = row[45:54].strip(' ')
+                    latitude = row[36:44].strip(' ')
+                    if longitude and latitude and\
+                            (lower_long <= float(longitude) <= upper_long) and\
+                            (lower_lat <= float(latitude) <= upper_lat):
+                        break
+                else:
+                    return False
+            return True
+        return block_filter
+
+    def _iter_event_blocks(self, rows):
+        """
+        Splits an iterable of ISF rows into event blocks, yielding for each
+        event a tuple of the header row, the list of [row, is_prime,
+        is_centroid] origin entries, the list of magnitude rows and the
+        comment string. Origin and magnitude rows are filtered by agency
+        on the raw author field.
+        """
+        header = None
+        origins = []
+        magnitudes = []
         is_origin = False
         is_magnitude = False
         comment_str = ""
-        for row in f.readlines():
+        origin_agencies = set(self.selected_origin_agencies)
+        magnitude_agencies = set(self.selected_magnitude_agencies)
+        for row in rows:
             # Strip newline carriage
             if row.endswith("\r\n"):
                 # If the file was compiled on windows machines
@@ -228,37 +1162,33 @@ class ISFReader(BaseCatalogueDatabaseReader):
                 continue
             else:
                 pass
-                
+
             if '(#PRIME)' in row:
                 # Previous origin block was the prime origin
                 if len(origins) > 0:
-                    origins[-1].is_prime = True
+                    origins[-1][1] = True
                 continue
-                
+
             if '(#CENTROID)' in row:
                 # Previous origin block is a centroid
                 if len(origins) > 0:
-                    origins[-1].is_centroid = True
+                    origins[-1][2] = True
                 continue
 
             comment_find = re.search("\((.*?)\)", row)
             if comment_find and not row.startswith("Event"):
-                comment_find.group(1)
                 comment_str += "{:s}\n".format(comment_find.group(1))
                 # Not sure - but sometimes this needs to be switched off
                 continue
 
             if row.startswith('Event'):
                 # Is an event header row
-                if counter > 0:
-                    self._build_event(event, origins, magnitudes, comment_str)
-                
-                # Get a new event
-                event = get_event_header_row(row)
+                if header is not None:
+                    yield header, origins, magnitudes, comment_str
+                header = row
                 comment_str = ""
                 origins = []
                 magnitudes = []
-                counter += 1
                 continue
             if row == origin_header:
                 is_origin = True
@@ -270,52 +1200,85 @@ class ISFReader(BaseCatalogueDatabaseReader):
                 continue
             else:
                 pass
-            
+
             if is_magnitude and len(row) == 38:
                 # Is a magnitude row
-                mag = get_event_magnitude(row,
-                                          event.id,
-                                          self.selected_magnitude_agencies)
-
-                if mag:
-                    magnitudes.append(mag)
+                if len(magnitude_agencies) and\
+                        not row[20:29].strip(' ') in magnitude_agencies:
+                    # Magnitude does not correspond to a selected agency
+                    continue
+                magnitudes.append(row)
                 continue
 
             if is_origin and len(row) == 136:
                 # Is an origin row
-                orig = get_event_origin_row(row,
-                                            self.selected_origin_agencies)
-                #pdb.set_trace()
-                if orig:
-                    origins.append(orig)
-        if event is not None:
-            self._build_event(event, origins, magnitudes, comment_str)
-        if len(self.rejected_catalogue):
-            # Turn list of rejected events into its own instance of
-            # ISFCatalogue
-            self.rejected_catalogue = ISFCatalogue(
-                identifier + "-R",
-                name + " - Rejected",
-                events=self.rejected_catalogue)
-        f.close()
-        return self.catalogue
+                if len(origin_agencies) and\
+                        not _to_str(row[118:127]) in origin_agencies:
+                    # Origin not authored by a selected agency
+                    continue
+                origins.append([row, False, False])
+        if header is not None:
+            yield header, origins, magnitudes, comment_str
 
     def _build_event(self, event, origins, magnitudes, comment_str):
         """
-        Add magnitudes and origins and event and append to the catalogue
+        Add magnitudes and origins to the event, returning the event if it
+        is accepted or None otherwise
         """
         event.origins = origins
         event.magnitudes = magnitudes
         if len(event.origins) and len(event.magnitudes):
             event.assign_magnitudes_to_origins()
             event.comment = comment_str
-            #print "%s - %s" % (Event.id, Event.description)
-            #print Event.comment
             if self._acceptance(event):
                 if not self.store_comments:
                     event.comment = ""
-                self.catalogue.events.append(event)
+                return event
+        return None
+
+    def _valid_magnitudes(self, values):
+        """
+        Returns True if any of the magnitude values are within the
+        magnitude range, False otherwise
+        """
+        for value in values:
+            if (value >= self.lower_mag) and (value <= self.upper_mag):
+                return True
+        return False
+
+    def _valid_locations(self, longitudes, latitudes):
+        """
+        Returns True if any of the locations are within the bounding box,
+        False otherwise
+        """
+        for longitude, latitude in zip(longitudes, latitudes):
+            if (longitude >= self.lower_long) and\
+                (longitude <= self.upper_long) and\
+                (latitude >= self.lower_lat) and\
+                (latitude <= self.upper_lat):
+                return True
+        return False
+
+    def _get_induced_flag(self, comment):
+        """
+        Returns the last of the anthropogenic keywords found in the comment
+        string, or None if no anthropogenic keywords are found
+        """
+        induced_flag = None
+        for keyword in self.ANTHROPOGENIC_KEYWORDS:
+            if keyword.lower() in comment.lower():
+                induced_flag = keyword
+        return induced_flag
 
+    def _get_rejection_keyword(self, comment):
+        """
+        Returns the first rejection keyword found in the comment string, or
+        None if no rejection keywords are found
+        """
+        for keyword in self.rejection_keywords:
+            if keyword.lower() in comment.lower():
+                return keyword
+        return None
 
     def _acceptance(self, event):
         """
@@ -327,31 +1290,17 @@ class ISFReader(BaseCatalogueDatabaseReader):
             True (if event is accepted), False otherwise
         """
         # Magnitude rejection - based on an "any" criterion
-        valid_magnitude = False
-        for mag in event.magnitudes:
-            if (mag.value >= self.lower_mag) and (mag.value <= self.upper_mag):
-                valid_magnitude = True
-                break
-        if not valid_magnitude:
+        if not self._valid_magnitudes([mag.value for mag in event.magnitudes]):
             return False
         # Location rejection
-        valid_location = False
-        for orig in event.origins:
-            valid_location = (orig.location.longitude >= self.lower_long) and\
-                (orig.location.longitude <= self.upper_long) and\
-                (orig.location.latitude >= self.lower_lat) and\
-                (orig.location.latitude <= self.upper_lat)
-            if valid_location:
-                break
-        if not valid_location:
+        if not self._valid_locations(
+                [orig.location.longitude for orig in event.origins],
+                [orig.location.latitude for orig in event.origins]):
+            return False
+        induced_flag = self._get_induced_flag(event.comment)
+        if induced_flag:
+            event.induced_flag = induced_flag
+        if self._get_rejection_keyword(event.comment):
+            self.rejected_catalogue.append(event)
             return False
-        for keyword in self.ANTHROPOGENIC_KEYWORDS:
-            if keyword.lower() in event.comment.lower():
-                event.induced_flag = keyword
-        for keyword in self.rejection_keywords:
-            if keyword.lower() in event.comment.lower():
-                self.rejected_catalogue.append(event)
-                return False
         return True
-
-
@@ -18,6 +18,7 @@
 
 import os
 import numpy as np
+from copy import deepcopy
 from math import fabs
 from eqcat.isc_homogenisor import MagnitudeConversionRule
 from eqcat.utils import _to_latex, _set_string
@@ -45,7 +46,7 @@ def piecewise_linear(params, xval):
         raise ValueError(
             'Piecewise Function requires 2 * nsegments parameters')
     
-    n_seg = n_params / 2
+    n_seg = int(n_params / 2)
     
     if n_seg == 1:
         return params[1] + params[0] * xval
@@ -129,7 +130,7 @@ class PiecewiseLinear(GeneralFunction):
             raise ValueError(
                 'Piecewise Function requires 2 * nsegments parameters')
         
-        n_seg = n_params / 2
+        n_seg = int(n_params / 2)
         
         if n_seg == 1:
             return params[1] + params[0] * xval
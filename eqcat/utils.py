@@ -112,6 +112,33 @@ def decimal_time(year, month, day, hour, minute, second):
     return decimal_time
 
 
+def epoch_time(year, month, day, hour, minute, second):
+    """
+    Returns the full time as seconds since 1970-01-01 00:00:00
+    :param year:
+        Year of events (integer numpy.ndarray)
+    :param month:
+        Month of events (integer numpy.ndarray)
+    :param day:
+        Days of event (integer numpy.ndarray)
+    :param hour:
+        Hour of event (integer numpy.ndarray)
+    :param minute:
+        Minute of event (integer numpy.ndarray)
+    :param second:
+        Second of event (float numpy.ndarray)
+    :returns epoch_time:
+        Seconds since 1970-01-01 (as float numpy.ndarray)
+    """
+    dates = (np.asarray(year) - 1970).astype("datetime64[Y]") +\
+        (np.asarray(month) - 1).astype("timedelta64[M]")
+    dates = dates.astype("datetime64[D]") +\
+        (np.asarray(day) - 1).astype("timedelta64[D]")
+    return dates.astype(np.int64).astype(float) * SECONDS_PER_DAY +\
+        (3600. * np.asarray(hour, dtype=float)) +\
+        (60. * np.asarray(minute, dtype=float)) + second
+
+
 def haversine(lon1, lat1, lon2, lat2, radians=False, earth_rad=6371.227):
     """
     Allows to calculate geographical distance
@@ -167,6 +194,166 @@ def haversine(lon1, lat1, lon2, lat2, radians=False, earth_rad=6371.227):
     return distance
 
 
+class EventIndex(object):
+    """
+    Hash index from event ID to the position of the event in a list of
+    events (the first position if an ID is repeated). The index follows
+    appends to the list and is rebuilt if the list is replaced or
+    shortened, or on a lookup that finds a different event. A lookup of a
+    missing ID returns None without re-indexing, so call rebuild() after
+    other in-place changes to the list, such as inserting events or
+    changing their IDs.
+    :param str attribute:
+        Name of the event attribute holding the ID
+    """
+    def __init__(self, attribute="id"):
+        self.attribute = attribute
+        self.positions = {}
+        self.events = None
+        self.number_events = 0
+
+    def rebuild(self, events=None):
+        """
+        Re-indexes all of the events
+        """
+        self.positions = {}
+        self.events = events
+        self.number_events = 0
+        if events is not None:
+            self.update(events)
+
+    def update(self, events):
+        """
+        Brings the index up to date with the list of events
+        """
+        if (events is not self.events) or\
+                (len(events) < self.number_events):
+            self.rebuild(events)
+            return
+        for iloc in range(self.number_events, len(events)):
+            self.positions.setdefault(
+                getattr(events[iloc], self.attribute), iloc)
+        self.number_events = len(events)
+
+    def get(self, events, key):
+        """
+        Returns the position of the event with the given ID in the list of
+        events, or None if not found
+        """
+        self.update(events)
+        iloc = self.positions.get(key)
+        if (iloc is not None) and\
+                (getattr(events[iloc], self.attribute) != key):
+            # Events modified in place - re-index
+            self.rebuild(events)
+            iloc = self.positions.get(key)
+        return iloc
+
+
+class SpatialGridIndex(object):
+    """
+    Index of points on a regular longitude-latitude grid. The points are
+    held sorted by cell (row by row), so that the points of a run of cells
+    along a row of the grid are a single slice. Points with nan
+    coordinates are not indexed.
+    :param float cell_size:
+        Size of the cells (decimal degrees)
+    :param numpy.ndarray order:
+        Positions of the indexed points, sorted by cell
+    :param numpy.ndarray offsets:
+        Start of the points of each cell in the order, with a final entry
+        for the end of the last cell
+    """
+    def __init__(self, longitude, latitude, cell_size=1.0):
+        """
+        :param longitude:
+            Longitudes of the points (numpy.ndarray)
+        :param latitude:
+            Latitudes of the points (numpy.ndarray)
+        :param float cell_size:
+            Size of the cells (decimal degrees)
+        """
+        self.longitude = np.asarray(longitude, dtype=float)
+        self.latitude = np.asarray(latitude, dtype=float)
+        self.cell_size = cell_size
+        valid = np.flatnonzero(np.isfinite(self.longitude) &
+                               np.isfinite(self.latitude))
+        if len(valid):
+            self.llon = np.floor(np.min(self.longitude[valid]) / cell_size) *\
+                cell_size
+            self.llat = np.floor(np.min(self.latitude[valid]) / cell_size) *\
+                cell_size
+            xloc, yloc = self._get_cell(self.longitude[valid],
+                                        self.latitude[valid])
+            self.nx = np.max(xloc) + 1
+            self.ny = np.max(yloc) + 1
+            cells = yloc * self.nx + xloc
+        else:
+            self.llon = self.llat = 0.0
+            self.nx = self.ny = 0
+            cells = np.array([], dtype=int)
+        self.order = valid[np.argsort(cells, kind="mergesort")]
+        self.offsets = np.concatenate([
+            [0], np.cumsum(np.bincount(cells, minlength=self.nx * self.ny))])
+
+    def _get_cell(self, longitude, latitude):
+        """
+        Returns the column and row of the cells of the locations
+        """
+        return (np.floor((longitude - self.llon) /
+                         self.cell_size).astype(int),
+                np.floor((latitude - self.llat) /
+                         self.cell_size).astype(int))
+
+    def get_candidates(self, llon, llat, ulon, ulat):
+        """
+        Returns the positions (unsorted) of the points in the cells
+        overlapping a bounding box
+        """
+        if not self.nx:
+            return np.array([], dtype=int)
+        xlocs, ylocs = self._get_cell(np.array([llon, ulon]),
+                                      np.array([llat, ulat]))
+        xloc0, xloc1 = max(xlocs[0], 0), min(xlocs[1], self.nx - 1)
+        yloc0, yloc1 = max(ylocs[0], 0), min(ylocs[1], self.ny - 1)
+        if (xloc0 > xloc1) or (yloc0 > yloc1):
+            return np.array([], dtype=int)
+        rows = np.arange(yloc0, yloc1 + 1) * self.nx
+        return np.concatenate([
+            self.order[self.offsets[row + xloc0]:self.offsets[row + xloc1 + 1]]
+            for row in rows])
+
+    def query_bounding_box(self, llon, llat, ulon, ulat):
+        """
+        Returns the sorted positions of the points inside a bounding box
+        (edges included)
+        """
+        idx = self.get_candidates(llon, llat, ulon, ulat)
+        lons = self.longitude[idx]
+        lats = self.latitude[idx]
+        return np.sort(idx[(lons >= llon) & (lons <= ulon) &
+                           (lats >= llat) & (lats <= ulat)])
+
+    def query_polygon(self, polygon):
+        """
+        Returns the sorted positions of the points inside a polygon. Only
+        the points in the cells overlapping the bounding box of the polygon
+        are tested
+        :param polygon:
+            Polygon as instance of :class: matplotlib.path.Path
+        """
+        vertices = polygon.vertices
+        idx = self.get_candidates(np.min(vertices[:, 0]),
+                                  np.min(vertices[:, 1]),
+                                  np.max(vertices[:, 0]),
+                                  np.max(vertices[:, 1]))
+        if not len(idx):
+            return idx
+        inside = polygon.contains_points(np.column_stack([
+            self.longitude[idx], self.latitude[idx]]))
+        return np.sort(idx[inside])
+
+
 def greg2julian(year, month, day, hour, minute, second):
     """ 
     Function to convert a date from Gregorian to Julian format
@@ -55,6 +55,9 @@ setup(
         'matplotlib',
         'basemap',
     ],
+    extras_require={
+        'parquet': ['pyarrow'],
+    },
     author='GEM Foundation',
     author_email='hazard@globalquakemodel.org',
     maintainer='GEM Foundation',
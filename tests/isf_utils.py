@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+"""
+Helpers to write small ISF bulletins for the tests
+"""
+import pandas as pd
+from eqcat.isf_catalogue import get_origin_mag_tables
+from eqcat.parsers.isf_catalogue_reader import (origin_header,
+                                                magnitude_header)
+
+
+def _fill(width, fields):
+    """
+    Returns a row of the given width with the strings of the list of
+    (start, string) fields placed at their start positions
+    """
+    row = [" "] * width
+    for start, string in fields:
+        row[start:(start + len(string))] = list(string)
+    return "".join(row)
+
+
+def origin_row(origin_id, author, longitude, latitude, year=2000, month=1,
+               day=1, depth=10.0, extra=()):
+    """
+    Returns an ISF origin row (136 characters), with any further (start,
+    string) fields of extra
+    """
+    return _fill(136, [
+        (0, "{:04d}/{:02d}/{:02d}".format(year, month, day)),
+        (11, "00:00:00.00"),
+        (36, "{:8.4f}".format(latitude)),
+        (45, "{:9.4f}".format(longitude)),
+        (71, "{:4.1f}".format(depth)),
+        (118, "{:9s}".format(author)),
+        (128, "{:>8s}".format(origin_id))] + list(extra))
+
+
+def magnitude_row(origin_id, author, value, scale="mb", extra=()):
+    """
+    Returns an ISF magnitude row (38 characters), with any further (start,
+    string) fields of extra
+    """
+    return _fill(38, [(0, scale), (6, "{:4.1f}".format(value)),
+                      (20, author), (30, "{:>8s}".format(origin_id))] +
+                 list(extra))
+
+
+# Fields of an origin row with all of the optional values given
+FULL_ORIGIN_FIELDS = [
+    (11, "12:34:56.78"), (22, "f"), (24, " 0.52"), (30, " 1.05"),
+    (54, "f"), (55, " 12.3"), (61, "  8.1"), (67, " 45"), (76, "f"),
+    (78, " 2.5"), (83, "  34"), (88, "  21"), (93, "120"),
+    (97, "  1.25"), (104, " 98.70"), (111, "m"), (113, "i"), (115, "ke")]
+
+# Fields of a magnitude row with all of the optional values given
+FULL_MAGNITUDE_FIELDS = [(11, "0.1"), (15, "  25")]
+
+
+def event_block(event_id, origins, magnitudes, description="Test region",
+                comment=None):
+    """
+    Returns the rows of an event from the lists of origin and magnitude
+    row arguments. The first origin is marked as prime.
+    """
+    rows = ["Event {:s} {:s}".format(event_id, description), origin_header]
+    if comment:
+        rows.insert(1, " ({:s})".format(comment))
+    for iloc, args in enumerate(origins):
+        rows.append(origin_row(*args))
+        if not iloc:
+            rows.append(" (#PRIME)")
+    rows.extend(["", magnitude_header])
+    rows.extend([magnitude_row(*args) for args in magnitudes])
+    rows.append("")
+    return rows
+
+
+def write_isf(filename, blocks):
+    """
+    Writes an ISF bulletin from a list of event blocks
+    """
+    rows = ["DATA_TYPE EVENT IMS1.0", "ISC Bulletin"]
+    for block in blocks:
+        rows.extend(block)
+    rows.append("STOP")
+    with open(filename, "w") as f:
+        f.write("\n".join(rows) + "\n")
+
+
+def get_test_blocks():
+    """
+    Returns the event blocks of a bulletin covering several agencies,
+    magnitude types and years, an event with a rejection keyword in its
+    comment, events on the edges of the selection criteria used in the tests
+    (magnitudes of 4.5 and locations on 35.0 N / 140.0 E) and an event
+    without magnitudes
+    """
+    return [
+        event_block("1001", [("101", "ISC", 140.5, 35.5, 2000),
+                             ("201", "NEIC", 140.6, 35.4, 2000)],
+                    [("101", "ISC", 5.0), ("101", "ISC", 5.2, "Ms"),
+                     ("201", "NEIC", 4.8)]),
+        event_block("1002", [("102", "NEIC", 20.0, 20.0, 2001)],
+                    [("102", "NEIC", 4.0)]),
+        event_block("1003", [("103", "ISC", 140.2, 36.0, 2002)],
+                    [("103", "ISC", 6.0, "Mw")], comment="Mining explosion"),
+        event_block("1004", [("104", "GCMT", 150.0, -30.0, 2003),
+                             ("204", "ISC", 150.1, -30.2, 2003)],
+                    [("104", "GCMT", 6.5, "Mw"), ("204", "ISC", 6.1)]),
+        event_block("1005", [("105", "ISC", 140.0, 35.0, 2004)],
+                    [("105", "ISC", 4.5), ("105", "NEIC", 4.4)]),
+        event_block("1006", [("106", "EHB", 141.0, 36.0, 2005)], []),
+        event_block("1007", [("107", "NEIC", 139.9, 35.2, 2006),
+                             ("207", "ISC", 140.1, 35.1, 2006)],
+                    [("107", "NEIC", 4.6), ("207", "ISC", 4.4)],
+                    comment="Felt widely")]
+
+
+def assert_catalogues_equal(catalogue, expected):
+    """
+    Asserts that two catalogues (or lists of events) hold the same events,
+    with the same origin and magnitude tables
+    """
+    events = [(event.id, event.description, event.comment,
+               event.induced_flag) for event in catalogue]
+    assert events == [(event.id, event.description, event.comment,
+                       event.induced_flag) for event in expected], events
+    if len(events):
+        for data, expected_data in zip(
+                get_origin_mag_tables(list(catalogue)),
+                get_origin_mag_tables(list(expected))):
+            pd.testing.assert_frame_equal(
+                pd.DataFrame(data), pd.DataFrame(expected_data))
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+"""
+Tests for eqcat.catalogue_parquet
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from eqcat.catalogue_parquet import (ParquetCatalogueStore,
+                                     write_parquet_dataset,
+                                     get_filter_expression, pa)
+from eqcat.catalogue_query_tools import CatalogueDB, CatalogueSelector
+from tests.isf_utils import write_isf, get_test_blocks
+
+
+def _sorted_rows(data, keys):
+    """
+    Returns the rows of a table sorted by the keys, with the categorical
+    columns as strings
+    """
+    data = data.astype(dict([(col, object) for col in data.columns
+                             if isinstance(data[col].dtype,
+                                           pd.CategoricalDtype)]))
+    return data.sort_values(keys).reset_index(drop=True)
+
+
+@unittest.skipIf(pa is None, "pyarrow is not installed")
+class ParquetRoundTripTestCase(unittest.TestCase):
+    """
+    Tests the writing of the catalogue tables to a parquet dataset and the
+    reading of selections from it
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        isf_file = os.path.join(self.tempdir, "catalogue.isf")
+        write_isf(isf_file, get_test_blocks())
+        self.hdf5_file = os.path.join(self.tempdir, "catalogue.hdf5")
+        ISFReader(isf_file).read_file("A", "A").build_dataframe(
+            self.hdf5_file)
+        self.db = CatalogueDB(self.hdf5_file)
+        self.path = os.path.join(self.tempdir, "catalogue.parquet")
+        self.db.export_current_selection_to_parquet(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _assert_tables_equal(self, catalogue, expected):
+        pd.testing.assert_frame_equal(
+            _sorted_rows(catalogue.origins, ["eventID", "originID"]),
+            _sorted_rows(expected.origins, ["eventID", "originID"]))
+        pd.testing.assert_frame_equal(
+            _sorted_rows(catalogue.magnitudes, ["eventID", "magnitudeID"]),
+            _sorted_rows(expected.magnitudes, ["eventID", "magnitudeID"]))
+
+    def test_round_trip(self):
+        self.assertListEqual(
+            sorted(os.listdir(os.path.join(self.path, "origins"))),
+            ["year=%d" % year for year in [2000, 2001, 2002, 2003, 2004,
+                                           2006]])
+        self._assert_tables_equal(CatalogueDB(self.path), self.db)
+        # Rewriting a year replaces its partition
+        origins = self.db.origins[self.db.origins["year"] == 2004]
+        magnitudes = self.db.magnitudes[self.db.magnitudes["eventID"] ==
+                                        "1005"]
+        write_parquet_dataset(self.path, origins, magnitudes)
+        self._assert_tables_equal(CatalogueDB(self.path), self.db)
+
+    def test_filter_pushdown(self):
+        store = ParquetCatalogueStore(self.path)
+        terms = [("year", ">=", 2003), ("Agency", "==", "ISC")]
+        # Partitions of earlier years are not read
+        fragments = list(store.datasets["origins"].get_fragments(
+            filter=get_filter_expression(terms)))
+        self.assertListEqual(
+            sorted([os.path.basename(os.path.dirname(fragment.path))
+                    for fragment in fragments]),
+            ["year=2003", "year=2004", "year=2006"])
+        data = store.read("origins", terms, columns=["eventID", "originID",
+                                                     "year"])
+        self.assertListEqual(list(data.columns),
+                             ["eventID", "originID", "year"])
+        self.assertEqual(data["year"].dtype, self.db.origins["year"].dtype)
+        self.assertListEqual(sorted(data["originID"]), ["105", "204", "207"])
+        # Magnitudes are partitioned by the year of their event
+        data = store.read("magnitudes", [("year", "==", 2003)])
+        self.assertListEqual(sorted(data["eventID"].unique()), ["1004"])
+
+    def test_lazy_selections(self):
+        hdf5_db = CatalogueDB(self.hdf5_file, lazy=True)
+        parquet_db = CatalogueDB(self.path, lazy=True)
+        try:
+            for method, args in [
+                    ("select_by_agency", ("ISC",)),
+                    ("select_within_date_range", (2001.5, 2004)),
+                    ("select_within_magnitude_range", (4.5, 5.0)),
+                    ("limit_to_agency", ("NEIC",))]:
+                self._assert_tables_equal(
+                    getattr(CatalogueSelector(parquet_db), method)(*args),
+                    getattr(CatalogueSelector(hdf5_db), method)(*args))
+        finally:
+            hdf5_db.close()
+            parquet_db.close()
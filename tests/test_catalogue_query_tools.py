@@ -0,0 +1,752 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+"""
+Tests for eqcat.catalogue_query_tools
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+import weakref
+from collections import OrderedDict
+from contextlib import redirect_stdout
+import h5py
+import numpy as np
+import pandas as pd
+from matplotlib.path import Path
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from eqcat.catalogue_query_tools import (
+    CatalogueDB, CatalogueSelector, CatalogueView, AgencyMagnitudeMiner,
+    get_agency_origin_count,
+    get_agency_magtype_statistics, get_agency_magnitude_pairs,
+    mine_agency_magnitude_combinations,
+    mine_agency_magnitude_combinations_to_file, COMPLETE_ATTRIBUTE,
+    _fit_regression_models, _get_where_clause)
+from tests.isf_utils import event_block, write_isf
+
+
+def build_catalogue_file(tempdir):
+    """
+    Writes a small ISF bulletin and builds its hdf5 catalogue, returning
+    the path to the hdf5 file
+    """
+    isf_file = os.path.join(tempdir, "catalogue.isf")
+    write_isf(isf_file, [
+        event_block("1001", [("101", "ISC", 10.0, 10.0),
+                             ("201", "NEIC", 10.5, 10.5)],
+                    [("101", "ISC", 5.0), ("201", "NEIC", 4.8)]),
+        event_block("1002", [("102", "NEIC", 20.0, 20.0)],
+                    [("102", "NEIC", 4.0)]),
+        event_block("1003", [("103", "ISC", 30.0, 30.0)],
+                    [("103", "ISC", 6.0, "Mw")])])
+    hdf5_file = os.path.join(tempdir, "catalogue.hdf5")
+    ISFReader(isf_file).read_file("A", "A").build_dataframe(hdf5_file)
+    return hdf5_file
+
+
+def build_random_catalogue(number_events=200, seed=1000):
+    """
+    Returns a random catalogue (as instance of CatalogueDB) in which each
+    agency reports an origin, and magnitudes of some of its types, for a
+    random subset of the events. Some events have repeated magnitudes of
+    the same agency and type. The origins of an event are scattered around
+    a random location in [-10, 10] degrees, some have no depth, and the
+    first origin of most events is marked as prime
+    """
+    rng = np.random.RandomState(seed)
+    agencies = [("ISC", ["mb", "Ms"], 0.9), ("NEIC", ["mb", "Mw"], 0.6),
+                ("GCMT", ["Mw"], 0.4), ("JMA", ["Mj", "mb"], 0.3)]
+    origins = []
+    magnitudes = []
+    for iloc in range(number_events):
+        event_id = str(1000 + iloc)
+        year = 1990 + (iloc % 30)
+        longitude, latitude = -10.0 + 20.0 * rng.rand(2)
+        # No prime origin for some events
+        prime = int(rng.rand() > 0.1)
+        for agency, mag_types, probability in agencies:
+            if rng.rand() > probability:
+                continue
+            origin_id = str(len(origins) + 1)
+            depth = np.nan if rng.rand() < 0.1 else 50.0 * rng.rand()
+            origins.append((event_id, origin_id, agency, year,
+                            longitude + rng.rand() - 0.5,
+                            latitude + rng.rand() - 0.5, depth, prime))
+            prime = 0
+            for mag_type in mag_types:
+                for _ in range(1 + (rng.rand() < 0.1)):
+                    magnitudes.append((event_id, origin_id,
+                                       round(4.0 + 3.0 * rng.rand(), 1),
+                                       round(0.1 + 0.2 * rng.rand(), 2),
+                                       mag_type, agency))
+    catalogue = CatalogueDB()
+    catalogue.origins = pd.DataFrame(
+        origins, columns=["eventID", "originID", "Agency", "year",
+                          "longitude", "latitude", "depth", "prime"])
+    catalogue.magnitudes = pd.DataFrame(
+        magnitudes, columns=["eventID", "originID", "value", "sigma",
+                             "magType", "magAgency"])
+    return catalogue
+
+
+class LazyCatalogueTestCase(unittest.TestCase):
+    """
+    Tests the selections of a lazy catalogue read from the store
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db = CatalogueDB(build_catalogue_file(self.tempdir), lazy=True)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.tempdir)
+
+    def test_where_clause_of_numpy_scalars(self):
+        self.assertEqual(
+            _get_where_clause([("value", ">=", np.float64(5.0)),
+                               ("Agency", "==", np.str_("ISC")),
+                               ("year", "<=", np.int64(2000))]),
+            "(value >= 5.0) & (Agency == 'ISC') & (year <= 2000)")
+
+    def test_select_with_numpy_scalars(self):
+        selector = CatalogueSelector(self.db)
+        output = selector.select_by_agency(np.str_("ISC"))
+        self.assertListEqual(sorted(output.origins["eventID"].unique()),
+                             ["1001", "1003"])
+        output = selector.select_within_magnitude_range(np.float64(5.0),
+                                                        np.float64(7.0))
+        self.assertListEqual(sorted(output.magnitudes["eventID"].unique()),
+                             ["1001", "1003"])
+        output = selector.limit_to_agency(np.str_("NEIC"))
+        self.assertListEqual(sorted(output.magnitudes["magAgency"].unique()),
+                             ["NEIC"])
+
+
+class ExportSelectionTestCase(unittest.TestCase):
+    """
+    Tests the export of a selection to an hdf5 file
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db = CatalogueDB(build_catalogue_file(self.tempdir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_export_current_selection(self):
+        output = CatalogueSelector(self.db).select_by_agency("ISC")
+        output_file = os.path.join(self.tempdir, "selection.hdf5")
+        output.export_current_selection(output_file, chunk_size=1)
+        db = CatalogueDB(output_file)
+        for data, expected in [(db.origins, output.origins),
+                               (db.magnitudes, output.magnitudes)]:
+            self.assertListEqual(list(data.columns), list(expected.columns))
+            for col in data.columns:
+                self.assertListEqual(data[col].tolist(),
+                                     expected[col].tolist())
+        with pd.HDFStore(output_file, "r") as store:
+            self.assertListEqual(
+                store.select("catalogue/origins",
+                             where="Agency == 'NEIC'")["eventID"].tolist(),
+                ["1001"])
+
+
+class CachedResultsTestCase(unittest.TestCase):
+    """
+    Tests the validation of the results cached from the tables of a
+    catalogue
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.db = CatalogueDB(build_catalogue_file(self.tempdir))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_event_codes_after_in_place_drop(self):
+        origin_codes, magnitude_codes, _ = self.db.get_event_codes()
+        self.assertEqual(len(origin_codes), 4)
+        self.db.origins.drop(self.db.origins.index[:2], inplace=True)
+        origin_codes, magnitude_codes, number_events = \
+            self.db.get_event_codes()
+        self.assertEqual(len(origin_codes), 2)
+        self.assertEqual(len(magnitude_codes), 4)
+        self.assertEqual(number_events, 3)
+
+    def test_event_codes_after_clear_cache(self):
+        _ = self.db.get_event_codes()
+        self.db.origins["eventID"] = self.db.origins["eventID"].astype(
+            object).replace({"1001": "1002"})
+        self.db.clear_cache()
+        origin_codes, magnitude_codes, _ = self.db.get_event_codes()
+        self.assertEqual(origin_codes[0], magnitude_codes[2])
+
+    def test_replaced_tables_are_released(self):
+        origins = weakref.ref(self.db.origins)
+        _ = self.db.get_event_codes()
+        self.db.origins = self.db.origins.iloc[:2]
+        self.assertIsNone(origins())
+        self.assertEqual(len(self.db.get_event_codes()[0]), 2)
+
+    def test_bounding_box_after_in_place_drop(self):
+        selector = CatalogueSelector(self.db)
+        output = selector.select_within_bounding_box([25.0, 25.0, 35.0, 35.0])
+        self.assertListEqual(list(output.origins["eventID"]), ["1003"])
+        # Drop the origins of the first event
+        self.db.origins.drop(self.db.origins.index[:2], inplace=True)
+        output = selector.select_within_bounding_box([25.0, 25.0, 35.0, 35.0])
+        self.assertListEqual(list(output.origins["eventID"]), ["1003"])
+        output = selector.select_within_bounding_box([15.0, 15.0, 25.0, 25.0])
+        self.assertListEqual(list(output.origins["eventID"]), ["1002"])
+
+    def test_agency_statistics_after_in_place_drop(self):
+        _, origin_stats = self.db.get_agency_statistics()
+        self.assertListEqual(list(origin_stats["n_origins"]), [2, 2])
+        self.db.origins.drop(self.db.origins.index[:1], inplace=True)
+        _, origin_stats = self.db.get_agency_statistics()
+        self.assertListEqual(list(origin_stats["agency"]), ["NEIC", "ISC"])
+        self.assertListEqual(list(origin_stats["n_origins"]), [2, 1])
+
+    def test_agency_order_of_equal_counts(self):
+        # Agencies with equal numbers of origins are sorted by name
+        _, origin_stats = self.db.get_agency_statistics()
+        self.assertListEqual(list(origin_stats["agency"]), ["ISC", "NEIC"])
+        self.assertListEqual(get_agency_origin_count(self.db),
+                             [("ISC", 2), ("NEIC", 2)])
+
+    def test_agency_order_of_equal_counts_by_first_appearance(self):
+        # The order does not depend on the order of the rows
+        db = CatalogueDB()
+        db.origins = pd.DataFrame({
+            "eventID": ["1", "2", "3", "4"], "originID": ["1", "2", "3", "4"],
+            "Agency": ["ZZZ", "ZZZ", "AAA", "AAA"], "year": [2000] * 4})
+        db.magnitudes = pd.DataFrame({
+            "eventID": ["1", "3"], "originID": ["1", "3"],
+            "magAgency": ["ZZZ", "AAA"], "magType": ["mb", "mb"],
+            "value": [5.0, 5.0]})
+        _, origin_stats = db.get_agency_statistics()
+        self.assertListEqual(list(origin_stats["agency"]), ["AAA", "ZZZ"])
+        self.assertListEqual(get_agency_origin_count(db),
+                             [("AAA", 2), ("ZZZ", 2)])
+
+
+class FitRegressionModelsTestCase(unittest.TestCase):
+    """
+    Tests the fitting of the regression models of a pair of magnitude
+    combinations
+    """
+    def test_exact_fit(self):
+        # A fit with zero residuals is reported as an error
+        values = np.array([4.0, 5.0, 6.0, 7.0])
+        data = np.column_stack([values, 0.1 * np.ones(4),
+                                values, 0.1 * np.ones(4)])
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", RuntimeWarning)
+            rows = _fit_regression_models((
+                "mb(ISC)|Mw(GCMT)", data,
+                [("polynomial1", "polynomial", [0.0, 1.0])], {}))
+        self.assertEqual(len(rows), 1)
+        self.assertIn("zero residual", rows[0]["error"])
+        self.assertNotIn("aic", rows[0])
+        np.testing.assert_array_almost_equal(rows[0]["beta"], [0.0, 1.0])
+
+
+class MineToFileTestCase(unittest.TestCase):
+    """
+    Tests the mining of the agency and magnitude combinations to an hdf5
+    file
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.catalogue = build_random_catalogue()
+        with redirect_stdout(io.StringIO()):
+            self.agency_mag_data = get_agency_magtype_statistics(
+                self.catalogue, pretty_print=False)
+            self.expected = mine_agency_magnitude_combinations(
+                self.catalogue, self.agency_mag_data, 20)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _mine(self, filename):
+        with redirect_stdout(io.StringIO()):
+            mine_agency_magnitude_combinations_to_file(
+                filename, self.catalogue, self.agency_mag_data, 20,
+                processes=1, batch_size=2)
+
+    def test_resume(self):
+        self.assertGreater(len(self.expected), 3)
+        filename = os.path.join(self.tempdir, "pairs.hdf5")
+        keys = list(self.expected)
+        with h5py.File(filename, "w") as fle:
+            # A complete dataset of a previous job is kept
+            dset = fle.create_dataset(keys[0], data=np.zeros([1, 4]),
+                                      dtype="f")
+            dset.attrs[COMPLETE_ATTRIBUTE] = True
+            # An incomplete dataset is written again
+            fle.create_dataset(keys[1], data=np.zeros([1, 4]), dtype="f")
+        self._mine(filename)
+        with h5py.File(filename, "r") as fle:
+            self.assertListEqual(sorted(fle.keys()), sorted(keys))
+            np.testing.assert_array_equal(fle[keys[0]][:], np.zeros([1, 4]))
+            for key in keys[1:]:
+                self.assertTrue(fle[key].attrs[COMPLETE_ATTRIBUTE])
+                np.testing.assert_array_almost_equal(
+                    fle[key][:],
+                    np.column_stack(list(self.expected[key].values())))
+
+
+def apply_selections(catalogue, calls):
+    """
+    Applies a chain of CatalogueSelector calls, given as (method name,
+    arguments, keyword arguments), to the catalogue
+    """
+    for name, args, kwargs in calls:
+        catalogue = getattr(CatalogueSelector(catalogue), name)(*args,
+                                                                **kwargs)
+    return catalogue
+
+
+# Chains of selections, as (method name, arguments, keyword arguments)
+SELECTION_CHAINS = [
+    [("select_by_agency", ("ISC",), {}),
+     ("select_within_magnitude_range", (5.0, 6.5), {})],
+    [("select_within_date_range", (1995, 2010), {"select_type": "all"}),
+     ("select_within_bounding_box", ([-5.0, -5.0, 5.0, 5.0],), {}),
+     ("limit_to_agency", ("NEIC",), {})],
+    [("select_within_depth_range", (0.0, 30.0), {}),
+     ("select_within_polygon", ([-8.0, 8.0, 0.0], [-8.0, -8.0, 8.0]),
+      {"select_type": "all"}),
+     ("select_within_magnitude_range", (4.5, None),
+      {"select_type": "all"})],
+    [("select_within_magnitude_range", (6.0, 7.0), {"select_type": "all"}),
+     ("select_by_agency", ("GCMT",), {"select_type": "all"})],
+    [("limit_to_agency", ("ISC", "NEIC"), {})]]
+
+
+class CatalogueQueryTestCase(unittest.TestCase):
+    """
+    Tests that the query plans give the same selections as the chains of
+    CatalogueSelector calls
+    """
+    def setUp(self):
+        self.db = build_random_catalogue()
+
+    def _query(self, catalogue, calls):
+        query = CatalogueSelector(catalogue).query()
+        for name, args, kwargs in calls:
+            query = getattr(query, name)(*args, **kwargs)
+        return query
+
+    def _assert_tables_equal(self, catalogue, expected):
+        pd.testing.assert_frame_equal(catalogue.origins, expected.origins)
+        pd.testing.assert_frame_equal(catalogue.magnitudes,
+                                      expected.magnitudes)
+
+    def test_execute(self):
+        for calls in SELECTION_CHAINS:
+            expected = apply_selections(self.db, calls)
+            self.assertGreater(len(expected.origins), 0)
+            self.assertLess(len(expected.origins), len(self.db.origins))
+            query = self._query(self.db, calls)
+            self.assertListEqual([call[0] for call in query.calls],
+                                 [call[0] for call in calls])
+            self._assert_tables_equal(query.execute(), expected)
+            self._assert_tables_equal(
+                query.execute(as_view=True).materialise(), expected)
+
+    def test_empty_plan(self):
+        self._assert_tables_equal(self._query(self.db, []).execute(),
+                                  self.db)
+
+    def test_execute_on_store(self):
+        tempdir = tempfile.mkdtemp()
+        try:
+            hdf5_file = os.path.join(tempdir, "catalogue.hdf5")
+            self.db.export_current_selection(hdf5_file)
+            db = CatalogueDB(hdf5_file, lazy=True)
+            try:
+                for calls in SELECTION_CHAINS:
+                    output = self._query(db, calls).execute()
+                    expected = apply_selections(self.db, calls)
+                    for data, expected_data in [
+                            (output.origins, expected.origins),
+                            (output.magnitudes, expected.magnitudes)]:
+                        self.assertListEqual(
+                            data["originID"].astype(str).tolist(),
+                            expected_data["originID"].tolist())
+            finally:
+                db.close()
+        finally:
+            shutil.rmtree(tempdir)
+
+
+class CatalogueViewTestCase(unittest.TestCase):
+    """
+    Tests that the selections on views, and on views of views, give the
+    same tables as the selections on the catalogue
+    """
+    def setUp(self):
+        self.db = build_random_catalogue()
+
+    def _assert_tables_equal(self, catalogue, expected):
+        pd.testing.assert_frame_equal(catalogue.origins, expected.origins)
+        pd.testing.assert_frame_equal(catalogue.magnitudes,
+                                      expected.magnitudes)
+
+    def test_nested_selections(self):
+        for calls in SELECTION_CHAINS:
+            view = self.db.view()
+            for iloc in range(len(calls)):
+                view = apply_selections(view, [calls[iloc]])
+                # Selections on views are views of the parent catalogue
+                self.assertIsInstance(view, CatalogueView)
+                self.assertIs(view.parent, self.db)
+                expected = apply_selections(self.db, calls[:(iloc + 1)])
+                self.assertEqual(view._get_number_origins_magnitudes(),
+                                 (len(expected.origins),
+                                  len(expected.magnitudes)))
+                output = view.materialise()
+                self.assertNotIsInstance(output, CatalogueView)
+                self._assert_tables_equal(output, expected)
+
+    def test_view_of_view(self):
+        view = CatalogueView(self.db, np.arange(10, 200),
+                             np.arange(5, 300, 2))
+        nested = CatalogueView(view, np.array([0, 3, 7]), np.array([1, 2]))
+        self.assertIs(nested.parent, self.db)
+        np.testing.assert_array_equal(nested.origin_rows, [10, 13, 17])
+        np.testing.assert_array_equal(nested.magnitude_rows, [7, 9])
+        pd.testing.assert_frame_equal(nested.origins,
+                                      self.db.origins.iloc[[10, 13, 17]])
+        pd.testing.assert_frame_equal(nested.magnitudes,
+                                      self.db.magnitudes.iloc[[7, 9]])
+        # Without rows the nested view covers its parent view
+        nested = CatalogueView(view)
+        np.testing.assert_array_equal(nested.origin_rows, view.origin_rows)
+        self.assertIs(view.view(), view)
+        # Changes to the materialised tables do not reach the parent
+        output = nested.materialise()
+        output.origins["depth"] = -1.0
+        self.assertFalse((self.db.origins["depth"] == -1.0).any())
+
+    def test_export(self):
+        view = apply_selections(self.db.view(), SELECTION_CHAINS[0])
+        tempdir = tempfile.mkdtemp()
+        try:
+            hdf5_file = os.path.join(tempdir, "catalogue.hdf5")
+            view.export_current_selection(hdf5_file)
+            db = CatalogueDB(hdf5_file)
+            expected = view.materialise()
+            for data, expected_data in [(db.origins, expected.origins),
+                                        (db.magnitudes,
+                                         expected.magnitudes)]:
+                self.assertListEqual(data["originID"].astype(str).tolist(),
+                                     expected_data["originID"].tolist())
+            # Views of lazy catalogues are not supported
+            lazy_db = CatalogueDB(hdf5_file, lazy=True)
+            try:
+                self.assertRaises(ValueError, CatalogueView, lazy_db)
+            finally:
+                lazy_db.close()
+        finally:
+            shutil.rmtree(tempdir)
+
+
+# Overlapping zones covering part of the region of the random catalogue
+ZONES = [([-10.0, 0.0, 0.0, -10.0], [-10.0, -10.0, 0.0, 0.0]),
+         ([-5.0, 5.0, 5.0, -5.0], [-5.0, -5.0, 5.0, 5.0]),
+         ([0.0, 9.0, 0.0], [0.0, 0.0, 9.0]),
+         ([-9.5, -2.0, -2.0], [2.0, 2.0, 9.5])]
+
+
+class ZoneLabelsTestCase(unittest.TestCase):
+    """
+    Tests the batch assignment of the origins and events to zones against
+    the point-in-polygon test of each origin in each zone
+    """
+    def setUp(self):
+        self.db = build_random_catalogue()
+        self.selector = CatalogueSelector(self.db)
+        origins = self.db.origins
+        points = np.column_stack([origins["longitude"].values,
+                                  origins["latitude"].values])
+        # Zones of each origin, in order
+        inside = np.column_stack([
+            Path(np.column_stack(zone)).contains_points(points)
+            for zone in ZONES])
+        self.origin_zones = [np.flatnonzero(row).tolist() for row in inside]
+
+    def _get_expected(self, select_type):
+        """
+        Returns the zone of each event (None if not assigned)
+        """
+        expected = {}
+        origins = self.db.origins.reset_index(drop=True)
+        for event_id, group in origins.groupby("eventID", sort=False):
+            zones = [self.origin_zones[iloc] for iloc in group.index]
+            if select_type == "any":
+                candidates = sorted(set(sum(zones, [])))
+            elif select_type == "all":
+                candidates = sorted(set.intersection(*[set(zone)
+                                                       for zone in zones]))
+            else:
+                prime = np.flatnonzero(group["prime"].values == 1)
+                candidates = zones[prime[0] if len(prime) else 0]
+            expected[event_id] = candidates[0] if candidates else None
+        return expected
+
+    def test_origin_labels(self):
+        labels = self.selector.get_zone_labels(ZONES)
+        self.assertTrue(labels.index.equals(self.db.origins.index))
+        self.assertListEqual(
+            [None if pd.isnull(label) else label for label in labels],
+            [zones[0] if zones else None for zones in self.origin_zones])
+        # Overlapping zones go to the first zone in the order given
+        self.assertTrue(any([len(zones) > 1 for zones in self.origin_zones]))
+
+    def test_event_labels(self):
+        for select_type in ["any", "all", "prime"]:
+            labels = self.selector.get_zone_labels(ZONES, select_type)
+            expected = self._get_expected(select_type)
+            self.assertListEqual(sorted(labels.index), sorted(expected))
+            self.assertDictEqual(
+                dict([(event_id, None if pd.isnull(label) else label)
+                      for event_id, label in labels.items()]),
+                expected)
+        self.assertRaises(ValueError, self.selector.get_zone_labels, ZONES,
+                          "first")
+
+    def test_labelled_zones(self):
+        zones = OrderedDict([("Z%d" % iloc, zone)
+                             for iloc, zone in enumerate(ZONES)])
+        labels = self.selector.get_zone_labels(zones, "any")
+        expected = self.selector.get_zone_labels(ZONES, "any")
+        self.assertListEqual(list(labels.cat.categories), list(zones))
+        self.assertListEqual(
+            labels.astype(object).fillna("").tolist(),
+            ["" if pd.isnull(label) else "Z%d" % label
+             for label in expected])
+
+    def test_select_within_zones(self):
+        for select_type in ["any", "all"]:
+            for as_view in [False, True]:
+                output = self.selector.select_within_zones(
+                    ZONES, select_type, as_view=as_view)
+                self.assertListEqual(list(output), list(range(len(ZONES))))
+                for label, zone in enumerate(ZONES):
+                    expected = self.selector.select_within_polygon(
+                        zone[0], zone[1], select_type=select_type)
+                    catalogue = output[label]
+                    self.assertEqual(isinstance(catalogue, CatalogueView),
+                                     as_view)
+                    pd.testing.assert_frame_equal(catalogue.origins,
+                                                  expected.origins)
+                    pd.testing.assert_frame_equal(catalogue.magnitudes,
+                                                  expected.magnitudes)
+
+
+def get_reference_pairs(catalogue, pair1, pair2, no_case=False):
+    """
+    Returns the magnitude vectors of two (agency, magnitude type) pairs by
+    grouping the magnitudes of each common event, as done before the
+    vectorised version of get_agency_magnitude_pairs: the largest value of
+    the second pair and the largest origin ID of the first pair are taken
+    """
+    magnitudes = catalogue.magnitudes
+    agencies = magnitudes["magAgency"].astype(str)
+    mag_types = magnitudes["magType"].astype(str)
+    if no_case:
+        agencies = agencies.str.lower()
+        mag_types = mag_types.str.lower()
+        pair1 = (pair1[0].lower(), pair1[1].lower())
+        pair2 = (pair2[0].lower(), pair2[1].lower())
+    select_cat1 = magnitudes[(agencies == pair1[0]) &
+                             (mag_types == pair1[1])]
+    select_cat2 = magnitudes[(agencies == pair2[0]) &
+                             (mag_types == pair2[1])]
+    common_catalogue = select_cat2[
+        select_cat2.eventID.isin(select_cat1.eventID)]
+    cat1_groups = select_cat1.groupby("eventID", observed=True)
+    mag1, sigma1, mag2, sigma2 = [], [], [], []
+    for _, grp in common_catalogue.groupby("eventID", observed=True):
+        event0 = grp.iloc[np.argmax(grp["value"].values)]
+        mag2.append(event0.value)
+        sigma2.append(event0.sigma)
+        event1 = cat1_groups.get_group(event0.eventID)
+        event1 = event1.iloc[np.argmax(np.asarray(event1["originID"]))]
+        mag1.append(event1.value)
+        sigma1.append(event1.sigma)
+    common_events = common_catalogue["eventID"]
+    return [np.array(mag1), np.array(sigma1), np.array(mag2),
+            np.array(sigma2)], \
+        catalogue.origins[catalogue.origins.eventID.isin(common_events)], \
+        magnitudes[magnitudes.eventID.isin(common_events)]
+
+
+def build_mixed_magnitude_catalogue(seed=1001):
+    """
+    Returns a random catalogue (see build_random_catalogue) with missing
+    magnitude values, some agencies and magnitude types in a different
+    case, and repeated magnitudes of some events
+    """
+    catalogue = build_random_catalogue()
+    magnitudes = catalogue.magnitudes
+    rng = np.random.RandomState(seed)
+    # Missing values, and agencies and types in a different case
+    magnitudes.loc[rng.rand(len(magnitudes)) < 0.05, "value"] = np.nan
+    lower = rng.rand(len(magnitudes)) < 0.1
+    magnitudes.loc[lower, "magAgency"] = \
+        magnitudes.loc[lower, "magAgency"].str.lower()
+    magnitudes.loc[lower, "magType"] = \
+        magnitudes.loc[lower, "magType"].str.upper()
+    # Repeated magnitudes with equal or missing values and different
+    # origins
+    repeats = magnitudes.iloc[::7].copy()
+    repeats["originID"] = [str(int(origin_id) * 11)
+                           for origin_id in repeats["originID"]]
+    repeats["sigma"] = 0.5
+    repeats.loc[repeats.index[::3], "value"] = np.nan
+    catalogue.magnitudes = pd.concat([magnitudes, repeats],
+                                     ignore_index=True)
+    return catalogue
+
+
+class AgencyMagnitudePairsTestCase(unittest.TestCase):
+    """
+    Tests the common magnitudes of pairs of (agency, magnitude type)
+    combinations against grouping the magnitudes of each event
+    """
+    def setUp(self):
+        self.db = build_mixed_magnitude_catalogue()
+
+    def _assert_pairs_equal(self, pair1, pair2, no_case):
+        with redirect_stdout(io.StringIO()):
+            data, catalogue = get_agency_magnitude_pairs(self.db, pair1,
+                                                         pair2, no_case)
+        vectors, origins, magnitudes = get_reference_pairs(self.db, pair1,
+                                                           pair2, no_case)
+        self.assertListEqual(list(data), [
+            "%s(%s)" % (pair1[1], pair1[0]),
+            "%s(%s) Sigma" % (pair1[1], pair1[0]),
+            "%s(%s)" % (pair2[1], pair2[0]),
+            "%s(%s) Sigma" % (pair2[1], pair2[0])])
+        self.assertGreater(len(vectors[0]), 0)
+        for output, expected in zip(data.values(), vectors):
+            np.testing.assert_array_equal(output, expected)
+        pd.testing.assert_frame_equal(catalogue.origins, origins)
+        pd.testing.assert_frame_equal(catalogue.magnitudes, magnitudes)
+
+    def test_pairs(self):
+        for pair1, pair2 in [(("ISC", "mb"), ("NEIC", "mb")),
+                             (("NEIC", "Mw"), ("GCMT", "Mw")),
+                             (("ISC", "Ms"), ("ISC", "mb")),
+                             (("JMA", "mb"), ("ISC", "mb"))]:
+            for no_case in [False, True]:
+                self._assert_pairs_equal(pair1, pair2, no_case)
+        self._assert_pairs_equal(("isc", "MB"), ("neic", "MW"), True)
+
+    def test_no_pairs(self):
+        with redirect_stdout(io.StringIO()):
+            self.assertTupleEqual(get_agency_magnitude_pairs(
+                self.db, ("ISC", "Mx"), ("NEIC", "mb")), (None, None))
+            self.assertTupleEqual(get_agency_magnitude_pairs(
+                self.db, ("ISC", "mb"), ("NEIC", "Mx")), (None, None))
+
+
+def get_reference_combinations(catalogue, agency_mag_data, threshold,
+                               no_case=False):
+    """
+    Returns the pairs of (agency, magnitude type) combinations with more
+    than a threshold number of common events and their magnitude vectors,
+    by trying every pair in turn as done before the sparse co-occurrence
+    matrix of AgencyMagnitudeMiner
+    """
+    output = []
+    agencies = list(agency_mag_data)
+    for iloc, agency_1 in enumerate(agencies):
+        for mag_1 in agency_mag_data[agency_1]["Magnitudes"]:
+            if agency_mag_data[agency_1]["Magnitudes"][mag_1] < threshold:
+                continue
+            for agency_2 in agencies[iloc:]:
+                for mag_2 in agency_mag_data[agency_2]["Magnitudes"]:
+                    if (agency_1 == agency_2) and (mag_1 == mag_2):
+                        continue
+                    if agency_mag_data[agency_2]["Magnitudes"][mag_2] <\
+                            threshold:
+                        continue
+                    vectors = get_reference_pairs(catalogue,
+                                                  (agency_1, mag_1),
+                                                  (agency_2, mag_2),
+                                                  no_case)[0]
+                    if len(vectors[0]) > threshold:
+                        output.append(((agency_1, mag_1), (agency_2, mag_2),
+                                       vectors))
+    return output
+
+
+class AgencyMagnitudeMinerTestCase(unittest.TestCase):
+    """
+    Tests the candidate pairs and the magnitude vectors of the miner
+    against trying every pair of combinations
+    """
+    def setUp(self):
+        self.db = build_mixed_magnitude_catalogue()
+        self.agency_mag_data = get_agency_magtype_statistics(
+            self.db, pretty_print=False)
+
+    def test_candidate_pairs(self):
+        for threshold in [1, 20]:
+            for no_case in [False, True]:
+                miner = AgencyMagnitudeMiner(self.db, no_case)
+                candidates = miner.get_candidate_pairs(self.agency_mag_data,
+                                                       threshold)
+                expected = get_reference_combinations(
+                    self.db, self.agency_mag_data, threshold, no_case)
+                self.assertGreater(len(expected), 0)
+                self.assertListEqual(
+                    [(pair1, pair2, int(number))
+                     for pair1, pair2, number in candidates],
+                    [(pair1, pair2, len(vectors[0]))
+                     for pair1, pair2, vectors in expected])
+                for (pair1, pair2, _), (_, _, vectors) in zip(candidates,
+                                                               expected):
+                    data = miner.get_pair_data(pair1, pair2)
+                    for output, expected_vector in zip(data.values(),
+                                                       vectors):
+                        np.testing.assert_array_equal(output,
+                                                      expected_vector)
+        self.assertListEqual(
+            AgencyMagnitudeMiner(self.db).get_candidate_pairs(
+                self.agency_mag_data, 10000), [])
+
+    def test_mine(self):
+        expected = get_reference_combinations(self.db, self.agency_mag_data,
+                                              5)
+        with redirect_stdout(io.StringIO()):
+            output = mine_agency_magnitude_combinations(
+                self.db, self.agency_mag_data, 5)
+        self.assertListEqual(list(output), [
+            "%s(%s)|%s(%s)" % (pair1[1], pair1[0], pair2[1], pair2[0])
+            for pair1, pair2, _ in expected])
+        for data, (_, _, vectors) in zip(output.values(), expected):
+            for output_vector, expected_vector in zip(data.values(),
+                                                      vectors):
+                np.testing.assert_array_equal(output_vector,
+                                              expected_vector)
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+"""
+Tests for eqcat.isf_catalogue
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import pandas as pd
+from eqcat.isf_catalogue import (Event, ISFCatalogue, CatalogueHDF5Writer,
+                                 HDF5_DATA_COLUMNS)
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from tests.isf_utils import (event_block, write_isf, get_test_blocks,
+                             FULL_ORIGIN_FIELDS, FULL_MAGNITUDE_FIELDS)
+
+
+def read_test_catalogue(tempdir, columnar=False):
+    """
+    Writes the test bulletin, with an event with all optional fields set,
+    and reads it as an ISFCatalogue (or a ColumnarISFCatalogue)
+    """
+    filename = os.path.join(tempdir, "catalogue.isf")
+    write_isf(filename, get_test_blocks() + [
+        event_block("1008", [("108", "ISC", 140.3, 35.3, 2007, 6, 15, 33.0,
+                              FULL_ORIGIN_FIELDS),
+                             ("208", "NEIC", 140.4, 35.2, 2007, 6, 15)],
+                    [("108", "ISC", 5.1, "mb", FULL_MAGNITUDE_FIELDS),
+                     ("208", "NEIC", 5.3, "")])])
+    reader = ISFReader(filename)
+    if columnar:
+        return reader.read_file_columnar("A", "A")
+    return reader.read_file("A", "A")
+
+
+class ISFCatalogueLookupTestCase(unittest.TestCase):
+    """
+    Tests the lookup of events by ID
+    """
+    def setUp(self):
+        self.catalogue = ISFCatalogue("A", "A", events=[
+            Event(str(event_id), [], [], "Test region")
+            for event_id in range(1001, 1004)])
+
+    def test_lookup(self):
+        self.assertIs(self.catalogue["1002"], self.catalogue.events[1])
+        self.assertRaises(KeyError, self.catalogue.__getitem__, "9999")
+
+    def test_missing_ids_do_not_rebuild(self):
+        _ = self.catalogue["1002"]
+        positions = self.catalogue.index.positions
+        for event_id in range(2001, 2010):
+            self.assertRaises(KeyError, self.catalogue.__getitem__,
+                              str(event_id))
+        self.assertIs(self.catalogue.index.positions, positions)
+        # Appended events are indexed without a rebuild
+        self.catalogue.events.append(Event("1004", [], [], "Test region"))
+        self.assertIs(self.catalogue["1004"], self.catalogue.events[3])
+        self.assertIs(self.catalogue.index.positions, positions)
+
+    def test_lookup_after_id_changed_in_place(self):
+        _ = self.catalogue["1002"]
+        self.catalogue.events[2].id = "2003"
+        # The old ID no longer finds the event
+        self.assertRaises(KeyError, self.catalogue.__getitem__, "1003")
+        self.catalogue.events[1].id = "2002"
+        self.catalogue.index.rebuild(self.catalogue.events)
+        self.assertIs(self.catalogue["2002"], self.catalogue.events[1])
+        self.assertIs(self.catalogue["2003"], self.catalogue.events[2])
+
+    def test_assign_ids(self):
+        _ = self.catalogue["1002"]
+        self.catalogue.ids = ["2001", "2002", "2003"]
+        self.assertListEqual(self.catalogue.ids, ["2001", "2002", "2003"])
+        self.assertIs(self.catalogue["2002"], self.catalogue.events[1])
+        self.assertRaises(KeyError, self.catalogue.__getitem__, "1002")
+        with self.assertRaises(ValueError):
+            self.catalogue.ids = ["3001"]
+
+
+class OriginMagTablesTestCase(unittest.TestCase):
+    """
+    Tests the export of the catalogue to origin and magnitude tables
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.catalogue = read_test_catalogue(self.tempdir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_tables(self):
+        origin_data, mag_data = self.catalogue.get_origin_mag_tables()
+        origins = [(event, orig) for event in self.catalogue
+                   for orig in event.origins]
+        self.assertEqual(len(origin_data), len(origins))
+        for row, (event, orig) in zip(origin_data, origins):
+            loc = orig.location
+            self.assertEqual(row["eventID"], event.id)
+            self.assertEqual(row["originID"], orig.id)
+            self.assertEqual(row["Agency"], orig.author)
+            self.assertListEqual(
+                [row[key] for key in ["year", "month", "day", "hour",
+                                      "minute"]],
+                [orig.date.year, orig.date.month, orig.date.day,
+                 orig.time.hour, orig.time.minute])
+            for key, value in [
+                    ("second",
+                     orig.time.second + orig.time.microsecond / 1.0E6),
+                    ("time_error", orig.time_error),
+                               ("longitude", loc.longitude),
+                               ("latitude", loc.latitude),
+                               ("depth", loc.depth),
+                               ("semimajor90", loc.semimajor90),
+                               ("semiminor90", loc.semiminor90),
+                               ("error_strike", loc.error_strike),
+                               ("depth_error", loc.depth_error)]:
+                # Empty values are exported as zero, and all values at the
+                # precision of the table
+                self.assertEqual(row[key], np.asarray(
+                    value or 0.0, dtype=origin_data.dtype[key]))
+            self.assertEqual(row["depthSolution"], loc.depthSolution)
+            self.assertEqual(row["prime"], int(orig.is_prime))
+        magnitudes = [mag for event in self.catalogue
+                      for mag in event.magnitudes]
+        self.assertEqual(len(mag_data), len(magnitudes))
+        for row, mag in zip(mag_data, magnitudes):
+            self.assertListEqual(
+                [row[key] for key in ["eventID", "originID", "magnitudeID",
+                                      "magType", "magAgency"]],
+                [mag.event_id, mag.origin_id, mag.magnitude_id, mag.scale,
+                 mag.author])
+            self.assertEqual(row["value"], np.float32(mag.value))
+            self.assertEqual(row["sigma"], np.float32(mag.sigma or 0.0))
+
+    def test_chunked_tables(self):
+        expected = self.catalogue.get_origin_mag_tables()
+        columnar = read_test_catalogue(self.tempdir, columnar=True)
+        for catalogue in [self.catalogue, columnar]:
+            for chunk_size in [1, 2, 100]:
+                chunks = list(catalogue.iter_origin_mag_tables(chunk_size))
+                self.assertEqual(len(chunks),
+                                 int(np.ceil(len(catalogue) / chunk_size)))
+                for iloc, data in enumerate(zip(*chunks)):
+                    np.testing.assert_array_equal(np.concatenate(data),
+                                                  expected[iloc])
+                # Each event is exported whole in a single chunk
+                event_ids = [np.unique(origin_data["eventID"])
+                             for origin_data, _ in chunks]
+                self.assertEqual(sum([len(ids) for ids in event_ids]),
+                                 len(catalogue))
+
+    def test_build_dataframe_in_chunks(self):
+        expected_origins, expected_magnitudes = \
+            self.catalogue.build_dataframe()
+        hdf5_file = os.path.join(self.tempdir, "catalogue.hdf5")
+        self.assertEqual(self.catalogue.build_dataframe(hdf5_file,
+                                                        chunk_size=2),
+                         (None, None))
+        for key, expected in [("origins", expected_origins),
+                              ("magnitudes", expected_magnitudes)]:
+            data = pd.read_hdf(hdf5_file, "catalogue/" + key)
+            pd.testing.assert_frame_equal(data.reset_index(drop=True),
+                                          expected)
+
+
+class CatalogueHDF5WriterTestCase(unittest.TestCase):
+    """
+    Tests the writing of the origin and magnitude tables to hdf5
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.origins, self.magnitudes = \
+            read_test_catalogue(self.tempdir).build_dataframe()
+        self.hdf5_file = os.path.join(self.tempdir, "catalogue.hdf5")
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_write_tables(self):
+        with CatalogueHDF5Writer(self.hdf5_file, chunk_size=2,
+                                 complib="zlib", complevel=3) as writer:
+            writer.append(self.origins, self.magnitudes)
+        with pd.HDFStore(self.hdf5_file, "r") as store:
+            for key, expected in [("catalogue/origins", self.origins),
+                                  ("catalogue/magnitudes", self.magnitudes)]:
+                pd.testing.assert_frame_equal(
+                    store.select(key).reset_index(drop=True), expected)
+                storer = store.get_storer(key)
+                data_columns = [col for col in HDF5_DATA_COLUMNS
+                                if col in expected.columns]
+                self.assertListEqual(storer.data_columns, data_columns)
+                self.assertTrue(all([storer.table.colindexed[col]
+                                     for col in data_columns]))
+                self.assertEqual(storer.table.filters.complib, "zlib")
+                self.assertEqual(storer.table.filters.complevel, 3)
+            # Queries on the data columns
+            data = store.select("catalogue/origins",
+                                where="(Agency == 'ISC') & (year > 2001)")
+            self.assertListEqual(
+                data["originID"].tolist(),
+                self.origins["originID"][(self.origins["Agency"] == "ISC") &
+                                         (self.origins["year"] > 2001)
+                                         ].tolist())
+
+    def test_append_to_existing_tables(self):
+        # Appended rows keep the data columns of the tables in the store,
+        # whatever those of the writer
+        with CatalogueHDF5Writer(self.hdf5_file, complib=None,
+                                 data_columns=["eventID"]) as writer:
+            writer.append(self.origins.iloc[:4], self.magnitudes.iloc[:5])
+        with CatalogueHDF5Writer(self.hdf5_file) as writer:
+            writer.append(self.origins.iloc[4:], self.magnitudes.iloc[5:])
+        with pd.HDFStore(self.hdf5_file, "r") as store:
+            storer = store.get_storer("catalogue/origins")
+            self.assertListEqual(storer.data_columns, ["eventID"])
+            self.assertEqual(storer.table.filters.complevel, 0)
+            pd.testing.assert_frame_equal(
+                store.select("catalogue/origins").reset_index(drop=True),
+                self.origins)
+            pd.testing.assert_frame_equal(
+                store.select("catalogue/magnitudes").reset_index(drop=True),
+                self.magnitudes)
@@ -0,0 +1,535 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+"""
+Tests for eqcat.parsers.isf_catalogue_reader
+"""
+import bz2
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+import types
+import unittest
+import numpy as np
+import pandas as pd
+from eqcat.isf_catalogue import get_origin_mag_tables
+from eqcat.parsers.base import get_compression, open_catalogue_file
+from eqcat.parsers.isf_catalogue_reader import (
+    ISFReader, get_event_index, get_event_origin_row, get_event_magnitude,
+    decode_origin_rows, decode_magnitude_rows)
+from tests.isf_utils import (event_block, write_isf, get_test_blocks,
+                             assert_catalogues_equal, origin_row,
+                             magnitude_row, FULL_ORIGIN_FIELDS,
+                             FULL_MAGNITUDE_FIELDS)
+
+
+class ReadFileFromIndexTestCase(unittest.TestCase):
+    """
+    Tests the index-based reading of an ISF file
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "catalogue.isf")
+        write_isf(self.filename, [
+            # On the lower latitude edge of the bounding box
+            event_block("1001", [("101", "ISC", 140.0, 35.1)],
+                        [("101", "ISC", 5.0)]),
+            # Inside the bounding box
+            event_block("1002", [("102", "ISC", 140.5, 35.5)],
+                        [("102", "ISC", 5.2)]),
+            # Outside the bounding box
+            event_block("1003", [("103", "ISC", 140.5, 35.0)],
+                        [("103", "ISC", 5.4)])])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_events_on_bounding_box_edge(self):
+        # Events on the edge of the bounding box are selected by the index
+        # as they are by the full parse
+        bbox = list(np.array([140.0, 35.1, 141.0, 36.0]))
+        index = get_event_index(self.filename)
+        self.assertEqual(index["min_latitude"][0], bbox[1])
+        expected = ISFReader(self.filename, bbox=bbox).read_file("A", "A")
+        reader = ISFReader(self.filename, bbox=bbox)
+        catalogue = reader.read_file_from_index("A", "A")
+        self.assertListEqual([event.id for event in expected.events],
+                             ["1001", "1002"])
+        self.assertListEqual([event.id for event in catalogue.events],
+                             [event.id for event in expected.events])
+
+    def test_rebuild_index_with_old_dtype(self):
+        # An index stored with single precision locations is rebuilt
+        index = get_event_index(self.filename)
+        old_dtype = [(name, "f4" if "itude" in name else dtype)
+                     for name, dtype in index.dtype.descr]
+        index_file = self.filename + ".idx.npy"
+        os.remove(index_file)
+        np.save(index_file, index.astype(old_dtype))
+        self.assertEqual(get_event_index(self.filename).dtype, index.dtype)
+
+
+class IngestToHDF5TestCase(unittest.TestCase):
+    """
+    Tests the incremental ingest of an ISF file into an hdf5 catalogue
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "catalogue.isf")
+        self.hdf5_file = os.path.join(self.tempdir, "catalogue.hdf5")
+        self.blocks = [
+            event_block("1001", [("101", "ISC", 10.0, 10.0),
+                                 ("201", "NEIC", 10.5, 10.5)],
+                        [("101", "ISC", 5.0), ("201", "NEIC", 4.8)]),
+            event_block("1002", [("102", "ISC", 20.0, 20.0)],
+                        [("102", "ISC", 4.0)]),
+            event_block("1003", [("103", "ISC", 30.0, 30.0)],
+                        [("103", "ISC", 6.0)])]
+        write_isf(self.filename, self.blocks)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _ingest(self, **kwargs):
+        index = get_event_index(self.filename, rebuild=True)
+        return ISFReader(self.filename, **kwargs).ingest_to_hdf5(
+            self.hdf5_file, index)
+
+    def _read(self, key):
+        return pd.read_hdf(self.hdf5_file, "catalogue/%s" % key)
+
+    def test_ingest_rejected_events_with_new_criteria(self):
+        # Events rejected by the criteria of a previous ingest are ingested
+        # when the criteria change
+        self.assertEqual(self._ingest(lower_magnitude=4.5), (3, 0))
+        self.assertListEqual(sorted(self._read("origins")["eventID"]),
+                             ["1001", "1001", "1003"])
+        self.assertListEqual(sorted(self._read("events")["eventID"]),
+                             ["1001", "1003"])
+        self.assertEqual(self._ingest(), (1, 0))
+        self.assertListEqual(sorted(self._read("origins")["eventID"]),
+                             ["1001", "1001", "1002", "1003"])
+
+    def test_ingest_changed_event(self):
+        # The rows of a changed event are replaced, not duplicated
+        self.assertEqual(self._ingest(), (3, 0))
+        self.blocks[0] = event_block("1001", [("101", "ISC", 10.0, 10.0)],
+                                     [("101", "ISC", 5.5)])
+        write_isf(self.filename, self.blocks)
+        self.assertEqual(self._ingest(), (0, 1))
+        origins = self._read("origins")
+        magnitudes = self._read("magnitudes")
+        self.assertListEqual(sorted(origins["originID"]),
+                             ["101", "102", "103"])
+        self.assertListEqual(
+            magnitudes[magnitudes["eventID"] == "1001"]["value"].tolist(),
+            [5.5])
+        self.assertEqual(len(magnitudes), 3)
+        # An unchanged file adds nothing
+        self.assertEqual(self._ingest(), (0, 0))
+        self.assertEqual(len(self._read("origins")), 3)
+
+    def test_ingest_partly_edited_file(self):
+        # Only the checksums of the changed and new events are rewritten
+        self.assertEqual(self._ingest(), (3, 0))
+        events = self._read("events")
+        self.blocks[1] = event_block("1002", [("102", "ISC", 20.0, 20.0)],
+                                     [("102", "ISC", 4.2)])
+        self.blocks.append(event_block("1004", [("104", "ISC", 40.0, 40.0)],
+                                       [("104", "ISC", 5.0)]))
+        write_isf(self.filename, self.blocks)
+        self.assertEqual(self._ingest(), (1, 1))
+        updated = self._read("events")
+        self.assertListEqual(list(updated["eventID"]),
+                             ["1001", "1003", "1002", "1004"])
+        unchanged = events[events["eventID"] != "1002"]
+        self.assertListEqual(list(updated["checksum"][:2]),
+                             list(unchanged["checksum"]))
+        self.assertNotEqual(
+            updated["checksum"][updated["eventID"] == "1002"].iloc[0],
+            events["checksum"][events["eventID"] == "1002"].iloc[0])
+        origins = self._read("origins")
+        self.assertListEqual(list(origins["originID"]),
+                             ["101", "201", "103", "102", "104"])
+        # A changed event that is now rejected loses its checksum
+        self.blocks[2] = event_block("1003", [("103", "ISC", 30.0, 30.0)],
+                                     [("103", "ISC", 4.0)])
+        write_isf(self.filename, self.blocks)
+        self.assertEqual(self._ingest(lower_magnitude=4.5), (0, 1))
+        self.assertListEqual(list(self._read("events")["eventID"]),
+                             ["1001", "1002", "1004"])
+        self.assertNotIn("1003", list(self._read("origins")["eventID"]))
+
+    def test_ingest_with_unindexed_checksums(self):
+        # A checksum table without the event ID data column is rewritten
+        self.assertEqual(self._ingest(), (3, 0))
+        events = self._read("events")
+        with pd.HDFStore(self.hdf5_file) as store:
+            store.put("catalogue/events", events, format="table")
+        self.blocks[0] = event_block("1001", [("101", "ISC", 10.0, 10.0)],
+                                     [("101", "ISC", 5.5)])
+        write_isf(self.filename, self.blocks)
+        self.assertEqual(self._ingest(), (0, 1))
+        with pd.HDFStore(self.hdf5_file) as store:
+            self.assertIn("eventID",
+                          store.get_storer("catalogue/events").data_columns)
+        self.assertListEqual(sorted(self._read("events")["eventID"]),
+                             ["1001", "1002", "1003"])
+        self.assertEqual(self._ingest(), (0, 0))
+
+
+class ReadFileColumnarTestCase(unittest.TestCase):
+    """
+    Tests the columnar reading of an ISF file
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "catalogue.isf")
+        write_isf(self.filename, [
+            event_block("1001", [("101", "ISC", 10.0, 10.0)],
+                        [("101", "ISC", 5.0)]),
+            event_block("1002", [("102", "ISC", 20.0, 20.0)],
+                        [("102", "ISC", 4.0)], comment="Mining explosion"),
+            event_block("1003", [("103", "ISC", 30.0, 30.0)],
+                        [("103", "ISC", 6.0)])])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_rejected_events(self):
+        # The rejected catalogue matches that of read_file
+        expected = ISFReader(self.filename, rejection_keywords=["mining"])
+        _ = expected.read_file("A", "A")
+        reader = ISFReader(self.filename, rejection_keywords=["mining"])
+        catalogue = reader.read_file_columnar("A", "A")
+        self.assertListEqual(list(catalogue.event_data["eventID"]),
+                             ["1001", "1003"])
+        self.assertEqual(len(reader.rejected_catalogue), 1)
+        event = reader.rejected_catalogue.events[0]
+        self.assertEqual(str(event), str(expected.rejected_catalogue.events[0]))
+        self.assertEqual(event.induced_flag, "Mining")
+        self.assertEqual(event.comment,
+                         expected.rejected_catalogue.events[0].comment)
+        self.assertEqual(len(event.origins[0].magnitudes), 1)
+
+    def test_without_rejected_events(self):
+        reader = ISFReader(self.filename, rejection_keywords=["mining"])
+        catalogue = reader.read_file_columnar("A", "A",
+                                              collect_rejected=False)
+        self.assertListEqual(list(catalogue.event_data["eventID"]),
+                             ["1001", "1003"])
+        self.assertEqual(len(reader.rejected_catalogue), 0)
+
+
+class IterEventsTestCase(unittest.TestCase):
+    """
+    Tests the streaming of the events of an ISF file
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "catalogue.isf")
+        write_isf(self.filename, get_test_blocks())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_same_events_as_read_file(self):
+        for kwargs in [{}, {"rejection_keywords": ["mining"]},
+                       {"selected_origin_agencies": ["ISC"],
+                        "lower_magnitude": 4.5}]:
+            expected = ISFReader(self.filename, **kwargs)
+            catalogue = expected.read_file("A", "A")
+            reader = ISFReader(self.filename, **kwargs)
+            events = reader.iter_events()
+            self.assertIsInstance(events, types.GeneratorType)
+            assert_catalogues_equal(list(events), catalogue)
+            assert_catalogues_equal(reader.rejected_catalogue,
+                                    expected.rejected_catalogue)
+
+    def test_events_streamed(self):
+        # Events are yielded before the rest of the file is parsed
+        reader = ISFReader(self.filename, rejection_keywords=["mining"])
+        events = reader.iter_events()
+        self.assertEqual(next(events).id, "1001")
+        self.assertEqual(next(events).id, "1002")
+        self.assertListEqual(reader.rejected_catalogue, [])
+        self.assertListEqual([event.id for event in events],
+                             ["1004", "1005", "1007"])
+        self.assertListEqual(
+            [event.id for event in reader.rejected_catalogue], ["1003"])
+
+
+class ReadFileParallelTestCase(unittest.TestCase):
+    """
+    Tests the multi-process reading of an ISF file
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "catalogue.isf")
+        write_isf(self.filename, get_test_blocks())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_same_catalogue_as_read_file(self):
+        kwargs = {"rejection_keywords": ["mining"], "lower_magnitude": 4.5}
+        expected = ISFReader(self.filename, **kwargs)
+        expected_catalogue = expected.read_file("A", "A")
+        # More chunks than events leaves some byte ranges empty
+        for chunks in [1, 3, 20]:
+            reader = ISFReader(self.filename, **kwargs)
+            catalogue = reader.read_file_parallel("A", "A", processes=2,
+                                                  chunks=chunks)
+            assert_catalogues_equal(catalogue, expected_catalogue)
+            self.assertEqual(reader.rejected_catalogue.id, "A-R")
+            assert_catalogues_equal(reader.rejected_catalogue,
+                                    expected.rejected_catalogue)
+
+
+class ReadTablesTestCase(unittest.TestCase):
+    """
+    Tests the direct reading of an ISF file into origin and magnitude
+    tables
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "catalogue.isf")
+        write_isf(self.filename, get_test_blocks() + [
+            event_block("1008",
+                        [("108", "ISC", 140.3, 35.3, 2007, 6, 15, 33.0,
+                          FULL_ORIGIN_FIELDS)],
+                        [("108", "ISC", 5.1, "mb", FULL_MAGNITUDE_FIELDS),
+                         ("108", "ISC", 5.3, "", FULL_MAGNITUDE_FIELDS)])])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_same_tables_as_read_file(self):
+        for kwargs in [{}, {"rejection_keywords": ["mining"]},
+                       {"selected_magnitude_agencies": ["ISC"],
+                        "bbox": [140.0, 35.0, 141.0, 36.0]}]:
+            expected = ISFReader(self.filename, **kwargs).read_file("A", "A")
+            expected_tables = get_origin_mag_tables(expected.events)
+            for batch_size in [2, 10000]:
+                reader = ISFReader(self.filename, **kwargs)
+                tables = reader.read_tables(batch_size=batch_size)
+                for data, expected_data in zip(tables, expected_tables):
+                    self.assertEqual(data.dtype, expected_data.dtype)
+                    pd.testing.assert_frame_equal(
+                        pd.DataFrame(data), pd.DataFrame(expected_data))
+                # Events rejected on keywords are omitted
+                self.assertListEqual(reader.rejected_catalogue, [])
+
+    def test_dataframes(self):
+        reader = ISFReader(self.filename, rejection_keywords=["mining"])
+        origins, magnitudes = reader.read_tables(as_dataframe=True)
+        expected_origins, expected_magnitudes = ISFReader(
+            self.filename, rejection_keywords=["mining"]).read_file(
+                "A", "A").build_dataframe()
+        self.assertNotIn("1003", origins["eventID"].tolist())
+        pd.testing.assert_frame_equal(origins, expected_origins)
+        pd.testing.assert_frame_equal(magnitudes, expected_magnitudes)
+
+
+class DecodeRowsTestCase(unittest.TestCase):
+    """
+    Tests the batch decoding of the fixed-width origin and magnitude rows
+    against the parsers of single rows
+    """
+    def setUp(self):
+        self.origin_rows = [
+            origin_row("101", "ISC", 140.5, 35.5),
+            origin_row("16957879", "ISC-GEM", -173.06, -16.01, 1960, 12, 31,
+                       33.0, FULL_ORIGIN_FIELDS),
+            origin_row("102", "NEIC", 0.0, -90.0, 2020, 2, 29, 0.0)]
+        self.magnitude_rows = [
+            magnitude_row("101", "ISC", 5.0),
+            magnitude_row("16957879", "ISC-GEM", 6.25, "Mw",
+                          FULL_MAGNITUDE_FIELDS),
+            magnitude_row("102", "NEIC", 4.0, "")]
+
+    def _assert_value(self, value, expected):
+        # Empty fields are decoded as nan (numbers) or empty strings
+        if expected is None:
+            if isinstance(value, str):
+                self.assertEqual(value, "")
+            else:
+                self.assertTrue(np.isnan(value))
+        elif isinstance(expected, str):
+            self.assertEqual(value, expected)
+        else:
+            self.assertAlmostEqual(value, expected, places=6)
+
+    def test_decode_origin_rows(self):
+        data = decode_origin_rows(self.origin_rows)
+        for iloc, row in enumerate(self.origin_rows):
+            orig = get_event_origin_row(row)
+            location = orig.location
+            expected = {
+                "year": orig.date.year, "month": orig.date.month,
+                "day": orig.date.day, "hour": orig.time.hour,
+                "minute": orig.time.minute,
+                "second": orig.time.second + orig.time.microsecond / 1.0E6,
+                "time_error": orig.time_error, "time_rms": orig.time_rms,
+                "latitude": location.latitude,
+                "longitude": location.longitude,
+                "semimajor90": location.semimajor90,
+                "semiminor90": location.semiminor90,
+                "error_strike": location.error_strike,
+                "depth": location.depth,
+                "depthSolution": location.depthSolution,
+                "depth_error": location.depth_error,
+                "Agency": orig.author, "originID": orig.id}
+            expected.update(orig.metadata)
+            self.assertSetEqual(set(data), set(expected))
+            for name in expected:
+                self._assert_value(data[name][iloc], expected[name])
+
+    def test_decode_magnitude_rows(self):
+        data = decode_magnitude_rows(self.magnitude_rows)
+        for iloc, row in enumerate(self.magnitude_rows):
+            mag = get_event_magnitude(row, "1001")
+            # Empty magnitude types are decoded as empty strings, which the
+            # readers then set to "UK" as Magnitude does
+            expected = {"magType": mag.scale if row[:5].strip() else None,
+                        "value": mag.value, "sigma": mag.sigma,
+                        "Nstations": mag.stations, "magAgency": mag.author,
+                        "originID": mag.origin_id}
+            self.assertSetEqual(set(data), set(expected))
+            for name in expected:
+                self._assert_value(data[name][iloc], expected[name])
+
+    def test_decode_selected_fields(self):
+        data = decode_origin_rows(self.origin_rows, ["Agency", "latitude"])
+        self.assertSetEqual(set(data), {"Agency", "latitude"})
+        self.assertListEqual(data["Agency"].tolist(),
+                             ["ISC", "ISC-GEM", "NEIC"])
+        np.testing.assert_array_equal(data["latitude"], [35.5, -16.01, -90.0])
+        data = decode_magnitude_rows(self.magnitude_rows, ["value"])
+        np.testing.assert_array_equal(data["value"], [5.0, 6.2, 4.0])
+
+
+class CompressedInputTestCase(unittest.TestCase):
+    """
+    Tests the reading of ISF files compressed with gzip, bzip2 and xz
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "catalogue.isf")
+        write_isf(self.filename, get_test_blocks())
+        with open(self.filename, "rb") as f:
+            self.data = f.read()
+        self.compressed = []
+        for compression, module in [("gzip", gzip), ("bz2", bz2),
+                                    ("xz", lzma)]:
+            # The compression is identified from the content, not the name
+            filename = os.path.join(self.tempdir, "catalogue_" + compression)
+            with module.open(filename, "wb") as f:
+                f.write(self.data)
+            self.compressed.append((compression, filename))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_open_catalogue_file(self):
+        self.assertIsNone(get_compression(self.filename))
+        for compression, filename in self.compressed:
+            self.assertEqual(get_compression(filename), compression)
+            with open_catalogue_file(filename, "rb") as f:
+                self.assertEqual(f.read(), self.data)
+            with open_catalogue_file(filename) as f:
+                self.assertListEqual(list(f),
+                                     self.data.decode().splitlines(True))
+
+    def test_read_compressed_file(self):
+        expected = ISFReader(self.filename, rejection_keywords=["mining"])
+        expected_catalogue = expected.read_file("A", "A")
+        for _, filename in self.compressed:
+            for method in ["read_file", "read_file_parallel",
+                           "read_file_columnar"]:
+                reader = ISFReader(filename, rejection_keywords=["mining"])
+                catalogue = getattr(reader, method)("A", "A")
+                if method == "read_file_columnar":
+                    catalogue = catalogue.to_isf_catalogue()
+                assert_catalogues_equal(catalogue, expected_catalogue)
+                assert_catalogues_equal(reader.rejected_catalogue,
+                                        expected.rejected_catalogue)
+            for data, expected_data in zip(
+                    ISFReader(filename).read_tables(),
+                    ISFReader(self.filename).read_tables()):
+                np.testing.assert_array_equal(data, expected_data)
+
+
+class EarlyRejectionTestCase(unittest.TestCase):
+    """
+    Tests that the agency, magnitude and bounding box criteria applied to
+    the raw rows select the same events as the criteria applied to the
+    events once built
+    """
+    CRITERIA = [
+        ({"bbox": [140.0, 35.0, 141.0, 36.0]},
+         ["1001", "1005", "1007"]),
+        ({"lower_magnitude": 4.5, "upper_magnitude": 5.0},
+         ["1001", "1005", "1007"]),
+        ({"selected_origin_agencies": ["ISC"],
+          "selected_magnitude_agencies": ["ISC"], "lower_magnitude": 4.5},
+         ["1001", "1004", "1005"]),
+        ({"selected_origin_agencies": ["NEIC"],
+          "bbox": [140.0, 35.0, 141.0, 36.0]},
+         ["1001"])]
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "catalogue.isf")
+        write_isf(self.filename, get_test_blocks())
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _get_reader(self, **kwargs):
+        return ISFReader(self.filename, rejection_keywords=["mining"],
+                         **kwargs)
+
+    def test_same_events_as_acceptance(self):
+        for kwargs, event_ids in self.CRITERIA:
+            # Without the block filter only the acceptance of the built
+            # events applies
+            expected = self._get_reader(**kwargs)
+            expected._get_block_filter = lambda: None
+            expected_catalogue = expected.read_file("A", "A")
+            self.assertListEqual(expected_catalogue.ids, event_ids)
+            reader = self._get_reader(**kwargs)
+            assert_catalogues_equal(reader.read_file("A", "A"),
+                                    expected_catalogue)
+            assert_catalogues_equal(reader.rejected_catalogue,
+                                    expected.rejected_catalogue)
+            reader = self._get_reader(**kwargs)
+            assert_catalogues_equal(
+                reader.read_file_from_index("A", "A"), expected_catalogue)
+            assert_catalogues_equal(reader.rejected_catalogue,
+                                    expected.rejected_catalogue)
+
+    def test_same_events_in_columnar_paths(self):
+        for kwargs, event_ids in self.CRITERIA:
+            expected = self._get_reader(**kwargs).read_file("A", "A")
+            reader = self._get_reader(**kwargs)
+            catalogue = reader.read_file_columnar("A", "A")
+            assert_catalogues_equal(catalogue.to_isf_catalogue(), expected)
+            origins, _ = self._get_reader(**kwargs).read_tables()
+            self.assertListEqual(list(np.unique(origins["eventID"])),
+                                 event_ids)
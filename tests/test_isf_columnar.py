@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+#
+# LICENSE
+#
+# Copyright (c) 2015 GEM Foundation
+#
+# The Catalogue Toolkit is free software: you can redistribute
+# it and/or modify it under the terms of the GNU Affero General Public
+# License as published by the Free Software Foundation, either version
+# 3 of the License, or (at your option) any later version.
+#
+# You should have received a copy of the GNU Affero General Public License
+# with this download. If not, see <http://www.gnu.org/licenses/>
+
+"""
+Tests for eqcat.isf_columnar
+"""
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+import pandas as pd
+from eqcat.parsers.isf_catalogue_reader import ISFReader
+from eqcat.isc_homogenisor import (Homogenisor, DuplicateFinder,
+                                   MagnitudeConversionRule,
+                                   ISCGORmb_toGCMTMw, ISCGORmb_toGCMTMw_Sigma,
+                                   is_GCMTMw, is_GCMTMw_Sigma)
+from tests.isf_utils import event_block, write_isf
+
+
+MAGNITUDE_RULES = [
+    MagnitudeConversionRule("GCMT", "Mw", is_GCMTMw, is_GCMTMw_Sigma),
+    MagnitudeConversionRule("ISC", "mb", ISCGORmb_toGCMTMw,
+                            ISCGORmb_toGCMTMw_Sigma)]
+
+
+class ColumnarCatalogueTestCase(unittest.TestCase):
+    """
+    Tests that the columnar catalogue gives the same results as the
+    catalogue of objects read from the same file
+    """
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, "catalogue.isf")
+        write_isf(self.filename, [
+            event_block("1001", [("101", "ISC", 10.0, 10.0),
+                                 ("201", "GCMT", 10.1, 10.1)],
+                        [("101", "ISC", 5.0), ("201", "GCMT", 5.6, "Mw")]),
+            event_block("1002", [("102", "NEIC", 20.0, 20.0, 2001)],
+                        [("102", "NEIC", 4.0)]),
+            event_block("1003", [("103", "ISC", 30.0, 30.0, 2002)],
+                        [("103", "ISC", 6.0)])])
+        # Duplicates of the first two events, and a new event
+        self.second_file = os.path.join(self.tempdir, "second.isf")
+        write_isf(self.second_file, [
+            event_block("2001", [("301", "GCMT", 10.2, 10.2)],
+                        [("301", "GCMT", 5.7, "Mw")]),
+            event_block("2002", [("302", "GCMT", 20.1, 20.1, 2001)],
+                        [("302", "GCMT", 4.3, "Mw")]),
+            event_block("2003", [("303", "GCMT", 40.0, 40.0, 2003)],
+                        [("303", "GCMT", 6.5, "Mw")])])
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def _read(self, filename):
+        return (ISFReader(filename).read_file("A", "A"),
+                ISFReader(filename).read_file_columnar("A", "A"))
+
+    def test_homogenise(self):
+        expected, catalogue = self._read(self.filename)
+        with redirect_stdout(io.StringIO()):
+            Homogenisor(expected).homogenise(MAGNITUDE_RULES,
+                                             ["GCMT", "ISC"])
+            Homogenisor(catalogue).homogenise(MAGNITUDE_RULES,
+                                              ["GCMT", "ISC"])
+        for event, expected_event in zip(catalogue.events, expected.events):
+            if expected_event.preferred is None:
+                self.assertIsNone(event.preferred)
+                continue
+            self.assertEqual(event.preferred.id, expected_event.preferred.id)
+            self.assertEqual(event.preferred.record_key,
+                             expected_event.preferred.record_key)
+            self.assertAlmostEqual(event.preferred.magnitude,
+                                   expected_event.preferred.magnitude)
+            self.assertAlmostEqual(event.preferred.magnitude_sigma,
+                                   expected_event.preferred.magnitude_sigma)
+
+    def test_merge_duplicates(self):
+        expected_second, second = self._read(self.second_file)
+        outputs = []
+        for catalogue in [expected_second, second]:
+            reference = ISFReader(self.filename).read_file("A", "A")
+            with redirect_stdout(io.StringIO()):
+                outputs.append(DuplicateFinder(
+                    reference, 3600.0, 50.0).merge_catalogue(catalogue))
+        expected, output = outputs
+        self.assertListEqual(output.ids, expected.ids)
+        self.assertListEqual(
+            [[str(orig) for orig in event.origins] for event in output],
+            [[str(orig) for orig in event.origins] for event in expected])
+
+    def test_build_dataframe(self):
+        expected, catalogue = self._read(self.filename)
+        expected_origins, expected_magnitudes = expected.build_dataframe()
+        origins, magnitudes = catalogue.build_dataframe()
+        pd.testing.assert_frame_equal(origins, expected_origins)
+        pd.testing.assert_frame_equal(magnitudes, expected_magnitudes)
+
+    def test_assign_ids(self):
+        catalogue = self._read(self.filename)[1]
+        _ = catalogue["1002"]
+        catalogue.ids = list(catalogue.ids)
+        self.assertListEqual(catalogue.ids, ["1001", "1002", "1003"])
+        catalogue.ids = ["E1", "E2", "E3000"]
+        self.assertListEqual(catalogue.ids, ["E1", "E2", "E3000"])
+        self.assertEqual(catalogue["E3000"].id, "E3000")
+        self.assertRaises(KeyError, catalogue.__getitem__, "1002")
+        with self.assertRaises(ValueError):
+            catalogue.ids = ["E1"]